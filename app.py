@@ -2,7 +2,7 @@ import logging
 
 from submodule_utils.logging import logger_factory
 from create_groups.parser import create_parser
-from create_groups import *
+import create_groups
 
 logger_factory()
 logger = logging.getLogger('create_groups')
@@ -10,5 +10,6 @@ logger = logging.getLogger('create_groups')
 if __name__ == "__main__":
     parser = create_parser()
     config = parser.get_args()
-    gc = GroupCreator(config)
+    # GroupCreator is imported after the arguments are parsed, so --help and bad arguments exit quickly
+    gc = create_groups.GroupCreator(config)
     gc.run()
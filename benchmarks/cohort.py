@@ -0,0 +1,173 @@
+"""Generation of synthetic cohorts of patches for benchmarks.
+
+A cohort has the directory tree /location/patches/annotation/subtype/slide/x_y.png of empty patch
+files and the hd5 files /location/h5/slide.h5 with the paths of the patches of each slide in a
+paths dataset, so it can be loaded with both use-extracted-patches and use-hd5 and patch_pattern
+annotation/subtype/slide.
+"""
+import os
+import json
+import shutil
+
+import h5py
+import numpy as np
+
+SUBTYPES = ['MMRd', 'p53abn', 'p53wt', 'POLE']
+ANNOTATIONS = ['Tumor', 'Stroma']
+default_patches_per_patient = 2000
+default_max_slides = 4
+default_subtype_skew = 1.
+default_slide_skew = 1.
+default_patch_skew = 1.
+default_seed = 0
+
+def get_zipf_weights(n, skew):
+    """Get weights of n ranks proportional to 1 / rank**skew, uniform if skew is 0"""
+    weights = 1. / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+def create_cohort_params(n_patches, n_patients=None, max_slides=default_max_slides,
+        subtype_skew=default_subtype_skew, slide_skew=default_slide_skew,
+        patch_skew=default_patch_skew, seed=default_seed):
+    """Create the parameters of a cohort.
+
+    Parameters
+    ----------
+    n_patches : int
+        The number of patches in the cohort
+
+    n_patients : int
+        The number of patients. By default there is a patient per default_patches_per_patient patches,
+        and at least 3 patients of every subtype
+
+    max_slides : int
+        The maximum number of slides of a patient
+
+    subtype_skew : float
+        Skew of the number of patients of each subtype. Subtype k has patients in proportion to 1 / k**subtype_skew
+
+    slide_skew : float
+        Skew of the number of slides of each patient. A patient has k slides with probability in proportion to 1 / k**slide_skew
+
+    patch_skew : float
+        Skew of the number of patches of each slide. The patches of a slide are in proportion to a
+        log-normal weight with sigma patch_skew
+
+    seed : int
+        Seed of the cohort
+
+    Returns
+    -------
+    dict
+    """
+    if n_patients is None:
+        n_patients = max(3 * len(SUBTYPES), n_patches // default_patches_per_patient)
+    return {
+        'n_patches': int(n_patches),
+        'n_patients': int(n_patients),
+        'max_slides': int(max_slides),
+        'subtype_skew': float(subtype_skew),
+        'slide_skew': float(slide_skew),
+        'patch_skew': float(patch_skew),
+        'seed': int(seed),
+    }
+
+def get_cohort_name(params):
+    """Get the name of the cohort of params, which is unique for every params"""
+    return '_'.join(f"{key}={value}" for key, value in params.items())
+
+def create_cohort_slides(params):
+    """Draw the slides of a cohort.
+
+    Returns
+    -------
+    list of (str, str, str, int)
+        The annotation, subtype, slide and number of patches of every slide directory
+    """
+    rng = np.random.default_rng(params['seed'])
+    n_patients = params['n_patients']
+    # every subtype has at least 3 patients so that every group has a patient of every subtype
+    patient_subtypes = np.concatenate([np.repeat(np.arange(len(SUBTYPES)), 3),
+            rng.choice(len(SUBTYPES), size=max(0, n_patients - 3 * len(SUBTYPES)),
+                    p=get_zipf_weights(len(SUBTYPES), params['subtype_skew']))])[:n_patients]
+    n_slides = 1 + rng.choice(params['max_slides'], size=n_patients,
+            p=get_zipf_weights(params['max_slides'], params['slide_skew']))
+    slides = []
+    for patient_idx, (subtype_idx, patient_slides) in enumerate(zip(patient_subtypes.tolist(),
+            n_slides.tolist())):
+        for slide_idx in range(patient_slides):
+            slides.append((SUBTYPES[subtype_idx], f"VOA-{1000 + patient_idx}{chr(ord('A') + slide_idx)}"))
+    weights = rng.lognormal(0., params['patch_skew'], size=len(slides))
+    slide_patches = rng.multinomial(params['n_patches'], weights / weights.sum())
+    slide_directories = []
+    for (subtype, slide), n_patches in zip(slides, slide_patches.tolist()):
+        n_tumor = int(round(n_patches * 0.7))
+        for annotation, annotation_patches in zip(ANNOTATIONS, [n_tumor, n_patches - n_tumor]):
+            if annotation_patches > 0:
+                slide_directories.append((annotation, subtype, slide, annotation_patches))
+    return slide_directories
+
+def get_patch_names(n_patches):
+    return [f"{(idx % 1000) * 256}_{(idx // 1000) * 256}.png" for idx in range(n_patches)]
+
+def generate_cohort(location, params, write_tree=True, write_hd5=True):
+    """Write a synthetic cohort to location, unless location already has the cohort of params.
+
+    Parameters
+    ----------
+    location : str
+        The directory of the cohort
+
+    params : dict
+        The parameters from create_cohort_params()
+
+    write_tree : bool
+        Whether to write the directory tree of empty patch files
+
+    write_hd5 : bool
+        Whether to write the hd5 files of the patch paths
+
+    Returns
+    -------
+    str
+        The patch location of the cohort
+
+    str
+        The hd5 location of the cohort
+    """
+    patch_location = os.path.join(location, 'patches')
+    hd5_location = os.path.join(location, 'h5')
+    params_path = os.path.join(location, 'cohort.json')
+    done = {'params': params, 'tree': False, 'hd5': False}
+    if os.path.exists(params_path):
+        with open(params_path, 'r') as f:
+            existing = json.load(f)
+        if existing['params'] == params:
+            done = existing
+        else:
+            shutil.rmtree(patch_location, ignore_errors=True)
+            shutil.rmtree(hd5_location, ignore_errors=True)
+    write_tree = write_tree and not done['tree']
+    write_hd5 = write_hd5 and not done['hd5']
+    if not (write_tree or write_hd5):
+        return patch_location, hd5_location
+
+    slide_paths = {}
+    for annotation, subtype, slide, n_patches in create_cohort_slides(params):
+        directory = os.path.join(patch_location, annotation, subtype, slide)
+        names = get_patch_names(n_patches)
+        if write_tree:
+            os.makedirs(directory, exist_ok=True)
+            for name in names:
+                open(os.path.join(directory, name), 'wb').close()
+        slide_paths.setdefault(slide, []).extend(os.path.join(directory, name) for name in names)
+    if write_hd5:
+        os.makedirs(hd5_location, exist_ok=True)
+        for slide, patch_paths in slide_paths.items():
+            with h5py.File(os.path.join(hd5_location, f"{slide}.h5"), 'w') as f:
+                f.create_dataset('paths', data=np.array(patch_paths, dtype=np.bytes_))
+    done['tree'] = done['tree'] or write_tree
+    done['hd5'] = done['hd5'] or write_hd5
+    with open(params_path, 'w') as f:
+        json.dump(done, f)
+    return patch_location, hd5_location
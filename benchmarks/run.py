@@ -0,0 +1,252 @@
+"""Benchmarks of the stages of create_groups on synthetic cohorts.
+
+Every stage is run once to measure its wall time and once more under tracemalloc to measure the peak
+memory it allocates. The parse_args stage starts a new interpreter, so its time is the startup time of
+the command line and its peak memory is not measured. The results are printed as a table and compared
+to the stored baselines, and the exit status is 1 if any stage is slower or allocates more than
+tolerance times its baseline.
+
+Baselines depend on the machine, so they are updated with --update_baselines on the machine that
+runs the benchmarks. Examples:
+
+    python -m benchmarks.run --location /tmp/create_groups_benchmarks --n_patches 10000 100000
+    python -m benchmarks.run --location /tmp/create_groups_benchmarks --n_patches 10000000 --no_tree
+    python -m benchmarks.run --location /tmp/create_groups_benchmarks --update_baselines
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import itertools
+import contextlib
+import subprocess
+import tracemalloc
+
+from submodule_utils.metadata.group import convert_yiping_to_mitch_format
+
+from create_groups.parser import create_parser
+from create_groups import GroupCreator
+
+from benchmarks.cohort import (create_cohort_params, get_cohort_name, generate_cohort,
+        default_max_slides, default_subtype_skew, default_slide_skew, default_patch_skew, default_seed)
+
+STAGES = ['parse_args', 'get_patch_paths', 'get_hd5_paths', 'create_patch_table', 'generate_groups',
+        'make_groups_from_groups_subtypes', 'print_group_summary']
+# stages that need the directory tree of the cohort
+TREE_STAGES = ['get_patch_paths']
+default_n_patches = [10000, 100000]
+default_baselines_location = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+default_tolerance = 1.5
+# parse_args runs in a new interpreter to measure the startup of the command line, including imports
+parse_args_code = """import sys
+from create_groups.parser import create_parser
+create_parser().get_args(sys.argv[1:])
+"""
+# differences below these are noise and are not regressions
+default_min_seconds = 0.05
+default_min_peak_mb = 1.
+
+def create_group_creator(load_args, out_location):
+    args_str = f"""
+    from-arguments
+    --balance_patches group
+    --patch_pattern annotation/subtype/slide
+    --out_location {out_location}
+    {load_args}
+    use-origin
+    """
+    return GroupCreator(create_parser().get_args(args_str.split()))
+
+def measure(fn):
+    """Run fn once for its wall time and once under tracemalloc for its peak memory
+
+    Returns
+    -------
+    float
+        The wall time in seconds
+
+    float
+        The peak memory allocated in MB
+    """
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak / 2**20
+
+def create_stage_fns(location, patch_location, hd5_location, stages, use_tree=True):
+    """Create a function to run each stage on a cohort, setting up the inputs of the stage outside of the function.
+
+    The stages other than get_patch_paths and get_hd5_paths load the patches from the directory tree,
+    or from the hd5 files if use_tree is not set.
+
+    Returns
+    -------
+    dict of function
+        {stage: function that runs the stage}
+    """
+    out_location = os.path.join(location, 'patient_groups.json')
+    gc_hd5 = create_group_creator(f"use-hd5 --hd5_location {hd5_location}", out_location)
+    gc = gc_hd5
+    if use_tree:
+        gc = create_group_creator(f"use-extracted-patches --patch_location {patch_location}",
+                out_location)
+    stage_fns = {}
+    for stage in stages:
+        if stage == 'parse_args':
+            args = ['from-arguments', '--out_location', out_location]
+            args += ['use-extracted-patches', '--patch_location', patch_location] if use_tree \
+                    else ['use-hd5', '--hd5_location', hd5_location]
+            args += ['use-origin']
+            stage_fns[stage] = lambda args=args: subprocess.run(
+                    [sys.executable, '-c', parse_args_code] + args, check=True,
+                    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        elif stage == 'get_patch_paths':
+            stage_fns[stage] = gc.get_patch_paths
+        elif stage == 'get_hd5_paths':
+            stage_fns[stage] = gc_hd5.get_hd5_paths
+        elif stage == 'create_patch_table':
+            stage_fns[stage] = gc.create_patch_table
+        elif stage == 'generate_groups':
+            stage_fns[stage] = gc.generate_groups
+        elif stage == 'make_groups_from_groups_subtypes':
+            patch_table = gc.create_patch_table()
+            subtype_patient_slide_patch = patch_table.create_subtype_patient_slide_patch_dict()
+            groups_subtypes_patients = gc.assign_patients_to_groups(subtype_patient_slide_patch)
+            groups_subtypes = {group_id: {subtype: list(itertools.chain.from_iterable(
+                    patches for patient in patients \
+                    for patches in subtype_patient_slide_patch[subtype][patient].values())) \
+                    for subtype, patients in subtypes_patients.items()} \
+                    for group_id, subtypes_patients in groups_subtypes_patients.items()}
+            stage_fns[stage] = lambda groups_subtypes=groups_subtypes: \
+                    gc.make_groups_from_groups_subtypes(groups_subtypes)
+        elif stage == 'print_group_summary':
+            patch_table, groups, _ = gc.generate_group_rows()
+            groups = gc.get_group_patches(convert_yiping_to_mitch_format(groups), patch_table)
+            group_names = {chunk['id']: f"Group {chunk['id'] + 1}" for chunk in groups['chunks']}
+            def print_group_summary(groups=groups, group_names=group_names):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    gc.print_group_summary(groups, group_names=group_names)
+            stage_fns[stage] = print_group_summary
+        else:
+            raise NotImplementedError(f"Stage {stage} is not implemented.")
+    return stage_fns
+
+def get_regressions(results, baselines, tolerance=default_tolerance):
+    """Compare the results of the stages of a cohort to their baselines
+
+    Parameters
+    ----------
+    results : dict
+        {stage: {'seconds': float, 'peak_mb': float}}
+
+    baselines : dict
+        The baselines of the cohort in the same format as results. Stages without baselines are skipped
+
+    Returns
+    -------
+    list of str
+        A description of every regression
+    """
+    regressions = []
+    for stage, result in results.items():
+        baseline = baselines.get(stage)
+        if baseline is None:
+            continue
+        for metric, min_difference in [('seconds', default_min_seconds), ('peak_mb', default_min_peak_mb)]:
+            if result[metric] > max(tolerance * baseline[metric], baseline[metric] + min_difference):
+                regressions.append(f"{stage} {metric} {result[metric]:.3f} > "
+                        f"{tolerance} * baseline {baseline[metric]:.3f}")
+    return regressions
+
+def format_results(cohort_name, results, baselines):
+    """Format the results of the stages of a cohort as a markdown table"""
+    lines = [f"### {cohort_name}", '',
+            '| Stage | Seconds | Baseline seconds | Peak MB | Baseline peak MB |',
+            '| --- | --- | --- | --- | --- |']
+    for stage, result in results.items():
+        baseline = baselines.get(stage)
+        baseline_seconds = '-' if baseline is None else f"{baseline['seconds']:.3f}"
+        baseline_peak_mb = '-' if baseline is None else f"{baseline['peak_mb']:.1f}"
+        lines.append(f"| {stage} | {result['seconds']:.3f} | {baseline_seconds} "
+                f"| {result['peak_mb']:.1f} | {baseline_peak_mb} |")
+    return '\n'.join(lines)
+
+def create_benchmark_parser():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--location", type=str, required=True,
+            help="Directory to write the synthetic cohorts to. A cohort is only written again if its parameters change.")
+    parser.add_argument("--n_patches", type=int, nargs='+', default=default_n_patches,
+            help="The number of patches of each cohort to benchmark.")
+    parser.add_argument("--n_patients", type=int, required=False,
+            help="The number of patients of every cohort. By default it grows with n_patches.")
+    parser.add_argument("--max_slides", type=int, default=default_max_slides,
+            help="The maximum number of slides of a patient.")
+    parser.add_argument("--subtype_skew", type=float, default=default_subtype_skew,
+            help="Zipf skew of the number of patients of each subtype. 0 is uniform.")
+    parser.add_argument("--slide_skew", type=float, default=default_slide_skew,
+            help="Zipf skew of the number of slides of each patient. 0 is uniform.")
+    parser.add_argument("--patch_skew", type=float, default=default_patch_skew,
+            help="Log-normal sigma of the number of patches of each slide. 0 is uniform.")
+    parser.add_argument("--seed", type=int, default=default_seed,
+            help="Seed of the cohorts.")
+    parser.add_argument("--no_tree", action='store_true',
+            help="Whether to skip writing the directory tree of empty patch files, which is slow for "
+            "large cohorts. The stages then load the patches from the hd5 files and get_patch_paths is skipped.")
+    parser.add_argument("--stages", type=str, nargs='+', default=STAGES, choices=STAGES,
+            help="The stages to benchmark.")
+    parser.add_argument("--baselines_location", type=str, default=default_baselines_location,
+            help="Path of the JSON file of the baselines.")
+    parser.add_argument("--update_baselines", action='store_true',
+            help="Whether to save the results as the baselines of the cohorts.")
+    parser.add_argument("--tolerance", type=float, default=default_tolerance,
+            help="The ratio to the baseline above which a stage regresses.")
+    return parser
+
+def main(argv=None):
+    config = create_benchmark_parser().parse_args(argv)
+    all_baselines = {}
+    if os.path.exists(config.baselines_location):
+        with open(config.baselines_location, 'r') as f:
+            all_baselines = json.load(f)
+    stages = [stage for stage in config.stages if not (config.no_tree and stage in TREE_STAGES)]
+    all_regressions = []
+    for n_patches in config.n_patches:
+        params = create_cohort_params(n_patches, n_patients=config.n_patients,
+                max_slides=config.max_slides, subtype_skew=config.subtype_skew,
+                slide_skew=config.slide_skew, patch_skew=config.patch_skew, seed=config.seed)
+        cohort_name = get_cohort_name(params)
+        location = os.path.join(config.location, cohort_name)
+        patch_location, hd5_location = generate_cohort(location, params,
+                write_tree=not config.no_tree)
+        results = {}
+        for stage, stage_fn in create_stage_fns(location, patch_location, hd5_location,
+                stages, use_tree=not config.no_tree).items():
+            seconds, peak_mb = measure(stage_fn)
+            results[stage] = {'seconds': seconds, 'peak_mb': peak_mb}
+        baselines = all_baselines.get(cohort_name, {})
+        print(format_results(cohort_name, results, baselines))
+        print()
+        regressions = get_regressions(results, baselines, tolerance=config.tolerance)
+        all_regressions += [f"{cohort_name}: {regression}" for regression in regressions]
+        if config.update_baselines:
+            all_baselines.setdefault(cohort_name, {}).update(results)
+    if config.update_baselines:
+        with open(config.baselines_location, 'w') as f:
+            json.dump(all_baselines, f, indent=4, sort_keys=True)
+            f.write('\n')
+        return 0
+    for regression in all_regressions:
+        print(f"Regression: {regression}")
+    return 1 if all_regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
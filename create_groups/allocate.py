@@ -0,0 +1,175 @@
+"""Allocation of patch counts across keys
+"""
+import numpy as np
+
+def water_fill(counts, max_total):
+    """Compute how many items to take from each key so that items are taken uniformly across keys.
+
+    This is the closed form of repeatedly taking the same number of items from every key that
+    still has items until max_total items are taken: every key takes min(count, level) items
+    where level is the largest integer such that the total taken is at most max_total.
+    As with the round based selection, nothing is taken if any key has no items.
+
+    Parameters
+    ----------
+    counts : array-like of int
+        The number of items of each key
+
+    max_total : int
+        The maximum number of items to take
+
+    Returns
+    -------
+    numpy.ndarray
+        The number of items to take from each key
+    """
+    counts = np.asarray(counts, dtype=np.int64).reshape(1, -1)
+    return water_fill_matrix(counts, np.ones(counts.shape, dtype=bool), max_total)[0]
+
+def water_fill_matrix(counts, is_key, max_total):
+    """Apply water_fill() to every row of a matrix at once in O(n k log k) for n rows of k keys.
+
+    Parameters
+    ----------
+    counts : array-like of int
+        Matrix of the number of items of each key in each row
+
+    is_key : array-like of bool
+        Matrix of whether each key is in the row. Only keys in the row take items.
+
+    max_total : int
+        The maximum number of items to take from each row
+
+    Returns
+    -------
+    numpy.ndarray
+        Matrix of the number of items to take from each key in each row, 0 for keys not in the row
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    is_key = np.asarray(is_key, dtype=bool)
+    n_rows, n_cols = counts.shape
+    if n_rows == 0 or n_cols == 0:
+        return np.zeros(counts.shape, dtype=np.int64)
+    max_total = max(0, max_total)
+    n_keys = is_key.sum(axis=1)
+    # keys that are not in the row are sorted last
+    sorted_counts = np.sort(np.where(is_key, counts, np.iinfo(np.int64).max), axis=1)
+    col = np.arange(n_cols)
+    is_sorted_key = col < n_keys[:, None]
+    sorted_counts = np.where(is_sorted_key, sorted_counts, 0)
+    # the total taken when the level is the count of the j-th smallest key
+    n_above = n_keys[:, None] - col - 1
+    totals = np.cumsum(sorted_counts, axis=1) + sorted_counts * n_above
+    # totals increase with j so the levels reached are the first n_reached keys
+    n_reached = (is_sorted_key & (totals <= max_total)).sum(axis=1)
+    rows = np.arange(n_rows)
+    last = np.maximum(n_reached - 1, 0)
+    level = np.where(n_reached > 0, sorted_counts[rows, last], 0)
+    total = np.where(n_reached > 0, totals[rows, last], 0)
+    n_remaining = n_keys - n_reached
+    level += (max_total - total) // np.maximum(n_remaining, 1) * (n_remaining > 0)
+    level[(is_key & (counts <= 0)).any(axis=1)] = 0
+    return np.where(is_key, np.minimum(counts, level[:, None]), 0)
+
+def balance_overall(counts):
+    """Set every cell to the min cell"""
+    return np.full(counts.shape, counts.min(), dtype=np.int64)
+
+def balance_group(counts):
+    """Set every cell in a group to the min cell of the group"""
+    return np.repeat(counts.min(axis=1, keepdims=True), counts.shape[1], axis=1)
+
+def balance_category(counts):
+    """Set every cell in a category to the min cell of the category"""
+    return np.repeat(counts.min(axis=0, keepdims=True), counts.shape[0], axis=0)
+
+def cap_overall(counts, cap):
+    """Cap every cell by cap"""
+    return np.minimum(counts, cap)
+
+def cap_group(counts, cap):
+    """Cap every group by cap, taking uniformly across the categories of groups over cap"""
+    is_over_cap = counts.sum(axis=1, keepdims=True) > cap
+    return np.where(is_over_cap,
+            water_fill_matrix(counts, np.ones(counts.shape, dtype=bool), cap), counts)
+
+def cap_category(counts, cap):
+    """Cap every category by cap, taking uniformly across the groups"""
+    return water_fill_matrix(counts.T, np.ones(counts.T.shape, dtype=bool), cap).T
+
+balance_modes = {
+    'overall': balance_overall,
+    'group': balance_group,
+    'category': balance_category,
+}
+
+cap_modes = {
+    'overall': cap_overall,
+    'group': cap_group,
+    'category': cap_category,
+}
+
+def balance_take_counts(counts, balance_patches):
+    """Compute the number of patches to take from every (group, category) cell to balance patches.
+
+    The patches selected from a cell are the range [0, take count) of the patches of the cell.
+    New balancing modes are added to balance_modes for modes without a cap, and to cap_modes
+    for modes that are set with a cap like 'group=135000'.
+
+    Parameters
+    ----------
+    counts : array-like of int
+        Matrix of the number of patches of each (group, category)
+
+    balance_patches : None or str or (tuple of str and int)
+        The balancing mode, or (mode, cap). Takes all patches if None.
+
+    Returns
+    -------
+    numpy.ndarray
+        Matrix of the number of patches to take from each (group, category)
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    if balance_patches is None:
+        return counts.copy()
+    elif isinstance(balance_patches, str):
+        if balance_patches not in balance_modes:
+            raise NotImplementedError(f"Balance type {balance_patches} is not implemented.")
+        return balance_modes[balance_patches](counts)
+    elif isinstance(balance_patches, tuple):
+        mode, cap = balance_patches
+        if mode not in cap_modes:
+            raise NotImplementedError(f"Balance type {mode} is not implemented.")
+        return cap_modes[mode](counts, cap)
+    else:
+        raise NotImplementedError(f"{balance_patches} is not implemented.")
+
+def fill_deficits(target_counts, counts, n_items):
+    """Assign new items to the keys that are furthest below their target count.
+
+    Every item goes to the key with the largest target_counts - counts, the first such key on ties,
+    so the keys reach their targets if no key is already above its target.
+
+    Parameters
+    ----------
+    target_counts : array-like of int
+        The number of items each key should have
+
+    counts : array-like of int
+        The number of items each key has
+
+    n_items : int
+        The number of new items
+
+    Returns
+    -------
+    list of int
+        The index of the key of each new item
+    """
+    deficits = np.asarray(target_counts, dtype=np.int64) - np.asarray(counts, dtype=np.int64)
+    keys = []
+    for _ in range(n_items):
+        key = int(np.argmax(deficits))
+        deficits[key] -= 1
+        keys.append(key)
+    return keys
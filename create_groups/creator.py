@@ -0,0 +1,1591 @@
+import os
+import glob
+import json
+import itertools
+import collections
+import copy
+import os.path
+import logging
+
+import numpy as np
+
+import submodule_utils as utils
+from submodule_utils.mixins import OutputMixin
+from submodule_utils.metadata.group import (
+        convert_yiping_to_mitch_format,
+        convert_mitch_to_yiping_format)
+
+from create_groups.defaults import *
+from create_groups.scan import (
+        ScanIndex, PatchDirectoryScanner, get_split_level, iter_patch_paths,
+        write_scan_shard, merge_scan_shards)
+
+from create_groups.allocate import (water_fill, water_fill_matrix,
+        balance_take_counts, fill_deficits)
+from create_groups.rng import RandomStreams
+from create_groups.table import (PatchTable, PatchPaths)
+from create_groups.spill import (PatchSpill, SpilledPaths)
+from create_groups.summary import summarize_groups
+from create_groups.sweep import (read_sweep, map_sweep)
+from create_groups.writer import (write_json, write_binary, get_options_location)
+from create_groups.reader import load_groups
+from create_groups.metrics import (StageMetrics, get_metrics_location)
+from create_groups.manifest import ManifestIndex
+from create_groups.pattern import PatchPatternParser
+from create_groups.hd5 import (
+        PathMatcher, load_hd5_paths, read_first_hd5_path, iter_hd5_path_batches)
+
+logger = logging.getLogger('create_groups')
+
+class GroupCreator(OutputMixin):
+    """Class that generates N groups that contain unique patients
+
+    Attributes
+    ----------
+    seed : int
+        seed for random shuffle
+
+    legacy_shuffle : bool
+        Whether to shuffle with the random module seeded before every shuffle, giving the same groups as earlier versions.
+        Otherwise every list is shuffled with its own NumPy Generator derived from seed
+
+    shuffle_workers : int
+        The number of threads used to shuffle lists when legacy_shuffle is not set
+
+    random_streams : RandomStreams
+        Shuffles the lists of patches and patients
+
+    n_groups : int
+        The number of groups in groups file
+
+    subtypes : dict
+        {subtype: label} of the subtypes of the study, where subtypes with the same label are one category
+
+    is_binary : bool
+        Whether we want to categorize patches by the Tumor/Normal category (true) or by the subtype category (false)
+
+    CategoryEnum : enum.Enum
+        The enum representing the categories and is one of (SubtypeEnum, BinaryEnum)
+
+    is_multiscale : bool
+        Whether patches have multiple scales aka. different magnifications i.e.
+        For non-multiscale patch, patch id has format: /subtype/slide_id/patch_location
+        For multiscale patch, patch id has format: /subtype/slide_id/magnification/patch_location
+
+    balance_patches : str or (tuple of str and int)
+        Whether we want to balance the patches in each category. Options:
+         - 'overall': we will select the number of patches of every (group, category) to the number of patches in (group, category) that is the smallest.
+
+    dataset_origin : list of str
+        The origins of the slide dataset the patches are generated from. One of DATASET_ORIGINS
+
+    manifest_location : str
+        Path to the manifest CSV file of use-manifest
+
+    manifest_cache : bool
+        Whether to cache the manifest indexed by slide ID in a manifest index, so that the manifest CSV file is only parsed when it changes
+
+    manifest_cache_location : str
+        Directory to save the manifest index in. If not set, the manifest index is saved next to manifest_location
+
+    manifest_index : ManifestIndex
+        The slides of the manifest compiled into a map by slide ID, which resolves the patient of the patch paths by their slide
+
+    patch_location : str
+        root directory of all patches of a study. The patch directory structure is '/patch_location/patch_pattern/x_y.png'
+
+    scan_workers : int
+        The number of threads used to list the directories in patch_location
+
+    scan_in_flight : int
+        The number of directory listings kept in flight by an asyncio event loop. If 0, the directories are listed by scan_workers threads
+
+    scan_cache : bool
+        Whether to cache the directory listings of patch_location in a scan index, so that unchanged directories are not listed again
+
+    scan_cache_location : str
+        Directory to save the scan index in. If not set, the scan index is saved next to patch_location
+
+    shard_index : int
+        The shard of patch_location listed by scan-shard
+
+    n_shards : int
+        The number of shards patch_location is split into by scan-shard. Slide directories are assigned to shards by a hash of their path
+
+    shard_location : str
+        Directory of the shard files written by scan-shard, which use-scan-shards merges into the listing of the whole patch_location
+
+    hd5_location : str
+        root directory of all hd5 of a study.
+
+    hd5_workers : int
+        The number of processes used to read the hd5 files
+
+    hd5_chunk_size : int
+        The number of paths read from a hd5 file at a time
+
+    patch_pattern : dict
+        Dictionary describing the directory structure of the patch paths.
+        A non-multiscale patch can be contained in a directory /path/to/patch/rootdir/Tumor/MMRD/VOA-1234/1_2.png so its patch_pattern is annotation/subtype/slide.
+        A multiscale patch can be contained in a directory /path/to/patch/rootdir/Stroma/P53ABN/VOA-1234/10/3_400.png so its patch pattern is annotation/subtype/slide/magnification
+
+    out_location : str
+        full path of the groups file (i.e. /path/to/patient_groups.json)
+
+    out_format : str
+        The format of the groups file. One of OUT_FORMATS. The hdf5 and npz groups files store the directories of the patch paths once and file names x_y.png as integer coordinates, and can be loaded with create_groups.reader.load_groups()
+
+    out_of_core : bool
+        Whether to spill the patch paths to partition files on disk instead of holding them in memory
+
+    spill_location : str
+        Directory to create the partition files of out_of_core in. If not set, the directory of out_location is used
+
+    memory_budget : int
+        The memory in MB used to buffer patch paths before they are written to the partition files
+
+    sweep_location : str
+        Path of a sweep file. If set, the patches are scanned once and groups are generated for every config in the sweep file, see create_groups.sweep.read_sweep()
+
+    sweep_workers : int
+        The number of processes used to generate the groups of the configs of a sweep
+
+    update_from : str
+        Path of an existing groups file to update. Patients in it keep their group, and a group of it is written unchanged if it was generated with the same group options and its recomputed patches have the same number of patches in every directory. Every group is still computed from the whole cohort
+
+    existing_groups : dict
+        The groups of update_from in Yiping format, or None if update_from is not set
+
+    existing_options : dict
+        The group options that update_from was generated with, see get_group_options(), or None if update_from is not set or has no options file
+
+    kept_group_ids : list of str
+        The groups of update_from that are written unchanged by the last generate_group_rows() or generate_group_records()
+
+    write_options : bool
+        Whether write_groups() writes the options of get_group_options() to a JSON file next to out_location, see create_groups.writer.get_options_location(). The options are also written if update_from is set
+
+    write_metrics : bool
+        Whether run() writes metrics to a JSON file next to out_location, see create_groups.metrics.get_metrics_location()
+
+    trace_memory : bool
+        Whether to trace the memory of the stages of run() with tracemalloc and by sampling the RSS, recording the peak and retained memory and the largest allocation sites of every stage in metrics
+
+    metrics : StageMetrics
+        The wall time, CPU time and item counts of the stages run by this group creator, which are also logged
+
+    min_patches : int
+        Only include from slides that have at least min_patches number of patches
+
+    max_patches : int
+        Only include from slides that have at most max_patches number of patches
+
+    max_patient_patches : int
+        Select at most max_patient_patches number of patches from each patient
+
+    TODO: fix documentation of balance_patches
+    """
+
+    def get_patch_path_wildcards(self, root, patch_wildcard):
+        """Get wildcards that match the patch paths in root. Filters patch paths by values of words.
+
+        Parameters
+        ----------
+        root : str
+            The directory that the patch_pattern is relative to
+
+        patch_wildcard : str
+            The wildcard of the patch file names
+
+        Returns
+        -------
+        list of str
+            List of wildcards for glob
+        """
+        patch_path_wildcard = root
+        patterns = sorted([[v, k] for k, v in self.patch_pattern.items()],
+                key=lambda x: x[0])
+        patterns = map(lambda x: x[1], patterns)
+        for word in patterns:
+            if word in self.filter_labels:
+                if word=='subtype':
+                    patch_path_wildcard = os.path.join(patch_path_wildcard, '**')
+                else:
+                    patch_path_wildcard = os.path.join(patch_path_wildcard,
+                                                       self.filter_labels[word])
+            else:
+                patch_path_wildcard = os.path.join(patch_path_wildcard, '**')
+        patch_path_wildcard = os.path.join(patch_path_wildcard, patch_wildcard)
+        if 'subtype' in self.filter_labels:
+            return utils.get_subtype_paths(self.filter_labels['subtype'],
+                                           self.patch_pattern,
+                                           patch_path_wildcard)
+        else:
+            return [patch_path_wildcard]
+
+    def scan_patch_directories(self):
+        """Scan the patch location for patch paths that match the patch pattern.
+
+        Returns
+        -------
+        list of (str, list of str)
+            List of directories and the names of the patches in them, in the order of the sorted patch paths
+        """
+        return list(self.iter_patch_directories())
+
+    def iter_patch_directories(self):
+        """Scan the patch location for patch paths that match the patch pattern, one slide directory at a time.
+
+        Yields
+        ------
+        (str, list of str)
+            A directory and the names of the patches in it, in the order of the sorted patch paths
+        """
+        index = None
+        if self.scan_cache:
+            index = ScanIndex.load(ScanIndex.get_default_path(self.patch_location,
+                    self.scan_cache_location), self.patch_location)
+        scanner = self.create_patch_directory_scanner(index=index)
+        yield from scanner.iter_scan()
+        if index is not None:
+            logger.info(f"Scan index {index.path}: reused {index.hits} and listed {index.misses} directories")
+            try:
+                index.save()
+            except OSError as e:
+                logger.warning(f"Could not save scan index {index.path}: {e}")
+
+    def create_patch_directory_scanner(self, index=None):
+        """Create a scanner of the patch paths in patch location that match the patch pattern"""
+        return PatchDirectoryScanner(self.patch_location,
+                self.get_patch_path_wildcards(self.patch_location, r'*.[jp][pn]g'),
+                workers=self.scan_workers,
+                split_level=get_split_level(self.patch_pattern),
+                index=index, in_flight=self.scan_in_flight)
+
+    def scan_shard(self):
+        """List the shard shard_index of n_shards of patch location and write it to out_location as a shard file.
+
+        Returns
+        -------
+        list of (str, list of str)
+            List of directories in the shard and the names of the patches in them
+        """
+        if not 0 <= self.shard_index < self.n_shards:
+            raise ValueError(f"Shard index {self.shard_index} is not in range 0 to {self.n_shards - 1}")
+        if not self.out_location.endswith('.npz'):
+            raise ValueError(f"Shard file {self.out_location} does not end in .npz, "
+                    "so use-scan-shards would not find it")
+        scanner = self.create_patch_directory_scanner()
+        leaves = list(scanner.iter_scan(shard_index=self.shard_index, n_shards=self.n_shards))
+        write_scan_shard(self.out_location, leaves, self.patch_location,
+                list(dict.fromkeys(self.get_patch_path_wildcards(self.patch_location, r'*.[jp][pn]g'))),
+                self.shard_index, self.n_shards)
+        return leaves
+
+    def iter_scan_shard_directories(self):
+        """Merge the shard files in shard location written by scan-shard.
+
+        Yields
+        ------
+        (str, list of str)
+            A directory and the names of the patches in it, in the order of iter_patch_directories()
+            on the patch location the shards were listed from
+        """
+        shard_paths = sorted(glob.glob(os.path.join(self.shard_location, '*.npz')))
+        patch_location, wildcards, leaves = merge_scan_shards(shard_paths)
+        expected_wildcards = list(dict.fromkeys(
+                self.get_patch_path_wildcards(patch_location, r'*.[jp][pn]g')))
+        if wildcards != expected_wildcards:
+            raise ValueError(f"Scan shards in {self.shard_location} were listed with wildcards {wildcards}, "
+                    f"but patch_pattern and filter_labels give wildcards {expected_wildcards}")
+        yield from leaves
+
+    def get_patch_paths(self):
+        """Get patch paths from patch location that match the patch paths. Filters patch paths by values of words.
+
+        Returns
+        -------
+        list of str
+            List of patch paths
+        """
+        patch_paths = list(iter_patch_paths(self.scan_patch_directories()))
+        patch_paths.sort()
+        return patch_paths
+
+    def get_hd5_paths(self):
+        """Get patch paths from hd5 location that match the patch paths. Filters patch paths by values of words.
+
+        Returns
+        -------
+        list of str
+            List of patch paths
+        """
+        hd5_files, root, wildcards = self.get_hd5_wildcards()
+        if root is None:
+            return []
+        return load_hd5_paths(hd5_files, workers=self.hd5_workers,
+                chunk_size=self.hd5_chunk_size, matcher=PathMatcher(root, wildcards))
+
+    def get_hd5_wildcards(self):
+        """Get the hd5 files in hd5 location and the wildcards that match the patch paths in them
+
+        Returns
+        -------
+        list of str
+            Sorted paths of the hd5 files
+
+        str
+            The directory that the patch_pattern is relative to, or None if the hd5 files have no paths
+
+        list of str
+            List of wildcards of the patch paths
+        """
+        hd5_files = sorted(glob.glob(f"{self.hd5_location}/*.h5"))
+        patch_path_wildcard = read_first_hd5_path(hd5_files)
+        if patch_path_wildcard is None:
+            return hd5_files, None, []
+        for _ in range(len(self.patch_pattern)+1):
+            patch_path_wildcard = os.path.dirname(patch_path_wildcard)
+        return hd5_files, patch_path_wildcard, \
+                self.get_patch_path_wildcards(patch_path_wildcard, '*.png')
+
+    def iter_patch_batches(self, batch_size=default_hd5_chunk_size):
+        """Get the patch paths from patch location or hd5 location in batches of directories,
+        in the same order as the patch paths of create_patch_table().
+
+        Yields
+        ------
+        list of (str, list of str)
+            Directories, including the trailing '/', and the names of the consecutive patches in them.
+            A batch has about batch_size patches
+        """
+        if self.should_use_extracted_patches or self.should_use_scan_shards:
+            batch = []
+            batch_patches = 0
+            leaves = self.iter_scan_shard_directories() if self.should_use_scan_shards \
+                    else self.iter_patch_directories()
+            for directory, names in leaves:
+                batch.append((os.path.join(directory, ''), names))
+                batch_patches += len(names)
+                if batch_patches >= batch_size:
+                    yield batch
+                    batch = []
+                    batch_patches = 0
+            if batch:
+                yield batch
+        else:
+            hd5_files, root, wildcards = self.get_hd5_wildcards()
+            if root is None:
+                return
+            for patch_paths in iter_hd5_path_batches(hd5_files, root, wildcards,
+                    chunk_size=self.hd5_chunk_size):
+                batch = []
+                for patch_path in patch_paths:
+                    idx = patch_path.rfind('/') + 1
+                    if not batch or batch[-1][0] != patch_path[:idx]:
+                        batch.append((patch_path[:idx], []))
+                    batch[-1][1].append(patch_path[idx:])
+                yield batch
+
+    @property
+    def should_use_extracted_patches(self):
+        return self.load_method == 'use-extracted-patches'
+
+    @property
+    def should_use_hd5(self):
+        return self.load_method == 'use-hd5'
+
+    @property
+    def should_scan_shard(self):
+        return self.load_method == 'scan-shard'
+
+    @property
+    def should_use_scan_shards(self):
+        return self.load_method == 'use-scan-shards'
+
+    @property
+    def should_use_manifest(self):
+        return self.define_method == 'use-manifest'
+
+    @property
+    def should_use_origin(self):
+        return self.define_method == 'use-origin'
+
+    def __init__(self, config):
+        """Initialize create groups component.
+
+        Arguments
+        ---------
+        config : argparse.Namespace
+            The args passed by user
+        """
+        self.seed = config.seed
+        self.legacy_shuffle = config.legacy_shuffle
+        self.shuffle_workers = config.shuffle_workers
+        self.random_streams = RandomStreams(self.seed, is_legacy=self.legacy_shuffle,
+                workers=self.shuffle_workers)
+        self.n_groups = config.n_groups
+        self.is_binary = config.is_binary
+        self.subtypes = config.subtypes
+        self.CategoryEnum = utils.create_category_enum(self.is_binary, self.subtypes)
+        self.is_multiscale = config.is_multiscale
+        self.patch_pattern = utils.create_patch_pattern(config.patch_pattern)
+        self.filter_labels = config.filter_labels
+        self.out_location = config.out_location
+        self.out_format = config.out_format
+        self.out_of_core = config.out_of_core
+        self.spill_location = config.spill_location
+        self.memory_budget = config.memory_budget
+        self.min_patches = config.min_patches
+        self.max_patches = config.max_patches
+        self.balance_patches = config.balance_patches
+        self.max_patient_patches = config.max_patient_patches
+        # modify in code for debugging
+        self.debug = False
+        self.load_method = config.load_method
+        # scan-shard only lists patches so it has no define method
+        self.define_method = None if self.should_scan_shard else config.define_method
+        if self.should_use_extracted_patches:
+            self.patch_location = config.patch_location
+            self.scan_workers = config.scan_workers
+            self.scan_in_flight = config.scan_in_flight
+            self.scan_cache = config.scan_cache
+            self.scan_cache_location = config.scan_cache_location
+        elif self.should_use_hd5:
+            self.hd5_location = config.hd5_location
+            self.hd5_workers = config.hd5_workers
+            self.hd5_chunk_size = config.hd5_chunk_size
+        elif self.should_scan_shard:
+            self.patch_location = config.patch_location
+            self.scan_workers = config.scan_workers
+            self.scan_in_flight = config.scan_in_flight
+            self.shard_index = config.shard_index
+            self.n_shards = config.n_shards
+        elif self.should_use_scan_shards:
+            self.shard_location = config.shard_location
+        else:
+            raise NotImplementedError(f"Load method {self.load_method} is not implemented")
+
+        if self.should_use_manifest:
+            self.manifest_location = config.manifest_location
+            self.manifest_cache = config.manifest_cache
+            self.manifest_cache_location = config.manifest_cache_location
+            self.manifest_index = ManifestIndex.load(self.manifest_location,
+                    ManifestIndex.get_default_path(self.manifest_location,
+                    self.manifest_cache_location) if self.manifest_cache else None)
+            self.dataset_origin = self.manifest_index.get_origins()
+        elif self.should_use_origin:
+            self.dataset_origin = config.dataset_origin
+        elif not self.should_scan_shard:
+            raise NotImplementedError(f"Define method {self.define_method} is not implemented")
+
+        self.sweep_location = config.sweep_location
+        self.sweep_workers = config.sweep_workers
+        self.update_from = config.update_from
+        self.existing_groups = None
+        self.existing_options = None
+        if self.update_from:
+            self.existing_groups = convert_mitch_to_yiping_format(load_groups(self.update_from))
+            options_location = get_options_location(self.update_from)
+            if os.path.isfile(options_location):
+                with open(options_location, 'r') as f:
+                    self.existing_options = json.load(f)
+        self.kept_group_ids = []
+        self.write_options = config.write_options
+        self.write_metrics = config.write_metrics
+        self.trace_memory = config.trace_memory
+        self.metrics = StageMetrics(trace_memory=self.trace_memory)
+
+
+    def select_patches_from_dict_as_dict(self, dict_patch, max_patches):
+        """Select at most max_patches patches from dict_patch, returning the patches as a dict.
+
+        Patches are selected uniformly across the keys of dict_patch, taking the first patches of each key.
+        """
+        counts = water_fill(list(map(len, dict_patch.values())), max_patches)
+        return {key: patches[:count] for (key, patches), count \
+                in zip(dict_patch.items(), counts.tolist())}
+
+    def select_patches_from_dict(self, dict_patch, max_patches=None):
+        """Select at most max_patches patches from dict_patch, or return all patches if max_patches is defined.
+
+        Will select patches unifromly across all list in dict if max_patches is smaller than the amount of patches the patient has.
+
+        Parameters
+        ----------
+        dict_patch : dict of list
+            {key: [patch_path]}
+
+        max_patches : int
+            the number of patches to select from slide patches in dict_patch
+
+        Returns
+        -------
+        list of str
+            List of patches selecte from dict_patch
+        """
+        if max_patches is None:
+            return list(itertools.chain.from_iterable(dict_patch.values()))
+        elif sum(map(len, dict_patch.values())) <= max_patches:
+            return list(itertools.chain.from_iterable(dict_patch.values()))
+        else:
+            selected_patches = self.select_patches_from_dict_as_dict(
+                    dict_patch, max_patches)
+            return list(itertools.chain.from_iterable(selected_patches.values()))
+
+    def create_patient_subtype_patch_to_select_count(self, subtype_patient_slide_patch):
+        """Produce counts of how many patches from each subtype to select for each patient.
+
+        Balances the counts of patches to select by subtype. This is important if patient has patches that span multiple subtypes like in Tumor/Normal situations.
+
+        Parameters
+        ----------
+        subtype_patient_slide_patch : dict
+            {subtype: {patient: {slide_id: [patch_path]}}
+
+        Returns
+        -------
+        dict
+            {patient: {subtype: number of patches to select}}
+
+        dict
+            {patient: {subtype: number of patches}}
+        """
+        if self.max_patient_patches is None:
+            raise Exception("Does not make sense to select max number of patches when self.max_patient_patches is None")
+        # dict {patient: {subtype: number of patches}}
+        patient_subtype_patch_count = {}
+        patient_ids = {}
+        entries = []
+        for subtype_idx, (subtype, patient_slide_patch) in enumerate(
+                subtype_patient_slide_patch.items()):
+            for patient, slide_patch in patient_slide_patch.items():
+                num_patches = sum(map(len, slide_patch.values()))
+                if patient not in patient_subtype_patch_count:
+                    patient_subtype_patch_count[patient] = {}
+                    patient_ids[patient] = len(patient_ids)
+                patient_subtype_patch_count[patient][subtype] = num_patches
+                entries.append((patient_ids[patient], subtype_idx, num_patches))
+        # select for all patients at once over a (patient x subtype) count matrix
+        patient_idx, subtype_idx, num_patches = np.array(entries,
+                dtype=np.int64).reshape(-1, 3).T
+        counts = np.zeros((len(patient_ids), len(subtype_patient_slide_patch)), dtype=np.int64)
+        is_subtype = np.zeros(counts.shape, dtype=bool)
+        counts[patient_idx, subtype_idx] = num_patches
+        is_subtype[patient_idx, subtype_idx] = True
+        select_counts = iter(water_fill_matrix(counts, is_subtype,
+                self.max_patient_patches)[patient_idx, subtype_idx].tolist())
+        # dict {patient: {subtype: number of patches}}
+        patient_subtype_patch_to_select_count = {p: {} for p in patient_subtype_patch_count.keys()}
+        for subtype, patient_slide_patch in subtype_patient_slide_patch.items():
+            for patient in patient_slide_patch.keys():
+                patient_subtype_patch_to_select_count[patient][subtype] = next(select_counts)
+        return patient_subtype_patch_to_select_count, patient_subtype_patch_count
+
+    def get_slide_select_counts(self, subtype_patient_slide_patch,
+            patient_subtype_patch_to_select_count=None):
+        """Get the number of patches that select_patches_from_dict() selects from each slide of a patient.
+
+        Parameters
+        ----------
+        subtype_patient_slide_patch : dict
+            {subtype: {patient: {slide_id: [patch_path]}}
+
+        patient_subtype_patch_to_select_count : dict
+            {patient: {subtype: number of patches to select}}. Selects all patches if not set.
+
+        Returns
+        -------
+        list of (tuple of str, list, int)
+            For every slide, the key (subtype, patient, slide_id), the patches of the slide and the number of patches to select
+        """
+        key_patches_counts = []
+        for subtype, patient_slide_patch in subtype_patient_slide_patch.items():
+            for patient, slide_patch in patient_slide_patch.items():
+                counts = list(map(len, slide_patch.values()))
+                if patient_subtype_patch_to_select_count is not None:
+                    max_patches = patient_subtype_patch_to_select_count[patient][subtype]
+                    if sum(counts) > max_patches:
+                        counts = water_fill(counts, max_patches).tolist()
+                for (slide, patches), count in zip(slide_patch.items(), counts):
+                    key_patches_counts.append(((subtype, patient, slide), patches, count))
+        return key_patches_counts
+
+    def count_subtype_patient_slide_patch(self, subtype_patient_slide_patch):
+        """Count the patients, slides and patches of subtype_patient_slide_patch for the metrics of a stage
+
+        Returns
+        -------
+        dict of int
+            {'patients': int, 'slides': int, 'patches': int}
+        """
+        slide_patches = [patches for patient_slide_patch in subtype_patient_slide_patch.values() \
+                for slide_patch in patient_slide_patch.values() for patches in slide_patch.values()]
+        return {
+            'patients': sum(len(patient_slide_patch) for patient_slide_patch \
+                    in subtype_patient_slide_patch.values()),
+            'slides': len(slide_patches),
+            'patches': sum(len(patches) for patches in slide_patches),
+        }
+
+    def count_groups_subtypes_patches(self, groups_subtypes):
+        """Count the patches of groups_subtypes {group_id: {subtype: [patch]}} for the metrics of a stage"""
+        return sum(len(patches) for subtypes_patches in groups_subtypes.values() \
+                for patches in subtypes_patches.values())
+
+    def shuffle_and_balance_groups(self, groups_subtypes):
+        """Shuffle the patches of every (group, subtype), balance them into groups by make_groups_from_groups_subtypes() and shuffle every group.
+
+        Parameters
+        ----------
+        groups_subtypes : dict of (dict of list)
+            Dict locator for patches like so {group_idx: {subtype: [patch]}}, shuffled in place
+
+        Returns
+        -------
+        dict of list
+            Group data to save to group JSON file.
+        """
+        n_patches = self.count_groups_subtypes_patches(groups_subtypes)
+        with self.metrics.stage('shuffle_group_subtypes', patches=n_patches):
+            # reshuffle to randomize occurance of patches by patient and slide
+            self.random_streams.shuffle_each('group_subtype', [((group_id, subtype), patches) \
+                    for group_id, subtypes_patches in groups_subtypes.items() \
+                    for subtype, patches in subtypes_patches.items()])
+
+        with self.metrics.stage('balance_groups', patches=n_patches):
+            groups = self.make_groups_from_groups_subtypes(groups_subtypes)
+
+        n_patches = sum(len(patches) for patches in groups.values())
+        with self.metrics.stage('shuffle_groups', patches=n_patches):
+            # reshuffle to randomize occurance of patches by subtype
+            self.random_streams.shuffle_each('group', groups.items())
+            # for group_idx in range(len(groups)):
+            #     random.seed(self.seed)
+            #     random.shuffle(groups['group_' + str(group_idx + 1)])
+        return groups
+
+    def make_groups_from_groups_subtypes(self, groups_subtypes):
+        """Makes groups from groups_subtypes dict, applying patch balancing using the balance_patches parameter.
+
+        Parameters
+        ----------
+        groups_subtypes : dict of (dict of list)
+            Dict locator for patch paths like so {group_idx: {subtype: [patch_path]}} to select patches from.
+
+        Returns
+        -------
+        dict of list
+            Group data to save to group JSON file.
+        """
+        group_ids = ['group_' + str(group_idx + 1) for group_idx in range(self.n_groups)]
+        subtypes = list(next(iter(groups_subtypes.values())).keys()) if groups_subtypes else []
+        counts = np.zeros((len(group_ids), len(subtypes)), dtype=np.int64)
+        for group_idx, group_id in enumerate(group_ids):
+            for subtype_idx, subtype in enumerate(subtypes):
+                counts[group_idx, subtype_idx] = len(groups_subtypes[group_id][subtype])
+        take_counts = balance_take_counts(counts, self.balance_patches).tolist()
+        groups = {}
+        for group_id, group_take_counts in zip(group_ids, take_counts):
+            cells = [groups_subtypes[group_id][subtype] for subtype in subtypes]
+            if cells and all(isinstance(cell, np.ndarray) for cell in cells):
+                groups[group_id] = np.concatenate([cell[:take_count] for cell, take_count \
+                        in zip(cells, group_take_counts)])
+            else:
+                groups[group_id] = list(itertools.chain.from_iterable(
+                        itertools.islice(cell, take_count) \
+                        for cell, take_count in zip(cells, group_take_counts)))
+        return groups
+
+    def parse_patch_table(self, patch_table):
+        """Parse the fields of the patches used in summaries from the directories of patch_table and cache them as directory columns.
+
+        The directories are split into the words of the patch_pattern once. The slide of a directory
+        is its slide word, and since the category only depends on the annotation and subtype words,
+        it is parsed from the first patch path of one directory for every distinct pair of them.
+        The columns are 'slide', the annotation and subtype words, 'category', 'slide_id', 'patient' and 'origin'.
+
+        Parameters
+        ----------
+        patch_table : PatchTable
+            The patch table to parse
+        """
+        if 'category' in patch_table.directory_columns:
+            return
+        label_words = [word for word in ['annotation', 'subtype'] if word in self.patch_pattern]
+        patch_table.parse_directories(PatchPatternParser(self.patch_pattern), label_words + ['slide'])
+        first_rows = patch_table.get_first_row_of_directories()
+        slides, slide_codes = patch_table.directory_columns['slide']
+        directories = np.flatnonzero((first_rows >= 0) & (slide_codes >= 0))
+        word_codes = np.stack([patch_table.directory_columns[word][1][directories] \
+                for word in label_words] + [np.zeros(len(directories), dtype=np.int32)], axis=1)
+        _, first_idx, label_idx = np.unique(word_codes, axis=0, return_index=True,
+                return_inverse=True)
+        labels = []
+        for directory in directories[first_idx].tolist():
+            patch_id = utils.create_patch_id(patch_table.get_path(first_rows[directory]),
+                    self.patch_pattern)
+            labels.append(utils.get_label_by_patch_id(patch_id, self.patch_pattern,
+                    self.CategoryEnum, is_binary=self.is_binary).name)
+        categories = [None] * len(first_rows)
+        slide_ids = [None] * len(first_rows)
+        for directory, idx in zip(directories.tolist(), label_idx.reshape(-1).tolist()):
+            categories[directory] = labels[idx]
+            slide_ids[directory] = slides[slide_codes[directory]]
+        patch_table.set_directory_column('category', categories)
+        patch_table.set_directory_column('slide_id', slide_ids)
+        slide_ids, slide_codes = patch_table.directory_columns['slide_id']
+        patients = [utils.get_patient_by_slide_id(slide_id,
+                dataset_origin=self.dataset_origin) for slide_id in slide_ids]
+        origins = [utils.get_origin(slide_id) for slide_id in slide_ids]
+        patch_table.set_directory_column('patient',
+                [None if c < 0 else patients[c] for c in slide_codes.tolist()])
+        patch_table.set_directory_column('origin',
+                [None if c < 0 else origins[c] for c in slide_codes.tolist()])
+
+    def create_group_summary(self, patch_table, group_names, group_directories):
+        """Count the patients, slides and patches of every group and category over the directory columns of patch_table.
+
+        Parameters
+        ----------
+        patch_table : PatchTable
+            The patch table of the directories of the patches, parsed by parse_patch_table() if it is not yet
+
+        group_names : list of str
+            The name of each group
+
+        group_directories : list of numpy.ndarray
+            The index of the directory in patch_table of every patch of each group
+
+        Returns
+        -------
+        GroupSummary
+        """
+        self.parse_patch_table(patch_table)
+        subtype_names = [s.name for s in self.CategoryEnum]
+        categories, category_codes = patch_table.directory_columns['category']
+        category_idx = np.array([subtype_names.index(c) for c in categories] + [-1])
+        _, slide_codes = patch_table.directory_columns['slide_id']
+        _, patient_codes = patch_table.directory_columns['patient']
+        origins, origin_codes = patch_table.directory_columns['origin']
+        # a patient is identified by its patient ID and its origin
+        _, directory_patient = np.unique(patient_codes.astype(np.int64) * (len(origins) + 1) \
+                + origin_codes, return_inverse=True)
+        return summarize_groups(group_names, subtype_names, group_directories,
+                category_idx[category_codes], directory_patient.reshape(-1), slide_codes)
+
+    def format_group_summary(self, summary):
+        """Render the patient counts and the patch counts of a group summary as markdown tables
+
+        Parameters
+        ----------
+        summary : GroupSummary
+
+        Returns
+        -------
+        str
+            The tables separated by an empty line
+        """
+        patient_counts = summary.pivot('patients')
+        slide_counts = summary.pivot('slides')
+        patch_counts = summary.pivot('patches')
+        markdown_patient_output = self.markdown_header('Patient Counts')
+        markdown_patch_output = self.markdown_header('Patch Counts')
+        for group_idx, group_name in enumerate(summary.groups):
+            markdown_patient_output += self.markdown_formatter(patient_counts[group_idx],
+                    ' Patient in ' + group_name)
+            markdown_patch_output += self.markdown_formatter(patch_counts[group_idx],
+                    ' Patch in ' + group_name)
+        markdown_patient_output += self.markdown_formatter(slide_counts[-1],
+                'Whole Slide Image')
+        markdown_patch_output += self.markdown_formatter(patch_counts[-1],
+                'Total')
+        return markdown_patient_output + '\n\n' + markdown_patch_output
+
+    def group_summary(self, groups, patch_table=None):
+        """Function to print the group summary
+
+        Parameters
+        ----------
+        groups : dict
+            Groups in Yiping format
+
+        patch_table : PatchTable
+            If set, the groups are rows of patch_table
+
+        Returns
+        -------
+        GroupSummary
+            The counts of the printed summary
+        """
+        if patch_table is None:
+            patch_table = PatchTable.from_paths(itertools.chain.from_iterable(groups.values()))
+            group_rows = {}
+            start = 0
+            for group_id, patch_paths in groups.items():
+                group_rows[group_id] = np.arange(start, start + len(patch_paths))
+                start += len(patch_paths)
+            groups = group_rows
+        summary = self.create_group_summary(patch_table,
+                ['Group ' + group_id.split('_')[-1] for group_id in groups],
+                [patch_table.directory[np.asarray(rows, dtype=np.int64)] for rows in groups.values()])
+        print(self.format_group_summary(summary))
+        return summary
+
+    def get_summary_directories(self, group_patches):
+        """Get a patch table of the directories of patches and the directory of every patch in it.
+
+        Patches that are views of the rows of one patch table use that table, and patches that are
+        views of the records of one PatchSpill read only the directories of the records and one patch
+        path of every directory. Otherwise the patch paths are loaded into a new patch table.
+
+        Parameters
+        ----------
+        group_patches : list of sequence of str
+            The patch paths of each group, such as the imgs of the chunks of groups in Mitch format
+
+        Returns
+        -------
+        PatchTable
+            The patch table of the directories
+
+        list of numpy.ndarray
+            The index of the directory in the patch table of every patch of each group
+        """
+        if group_patches and all(isinstance(patches, PatchPaths) for patches in group_patches) \
+                and len({id(patches.table) for patches in group_patches}) == 1:
+            patch_table = group_patches[0].table
+            return patch_table, [patch_table.directory[patches.rows] for patches in group_patches]
+        if group_patches and all(isinstance(patches, SpilledPaths) for patches in group_patches) \
+                and len({id(patches.spill) for patches in group_patches}) == 1:
+            spill = group_patches[0].spill
+            group_spill_directories = [spill.get_directories(patches.records) for patches in group_patches]
+            spill_directories, first_idx = np.unique(np.concatenate(group_spill_directories),
+                    return_index=True)
+            records = np.concatenate([patches.records for patches in group_patches])
+            # one patch path of every directory is enough to parse the labels of the directory
+            patch_table = PatchTable.from_paths(spill.get_paths(records[first_idx]))
+            directory_map = np.full(len(spill.directories), -1, dtype=np.int64)
+            directory_map[spill_directories] = patch_table.directory
+            return patch_table, [directory_map[directories] for directories in group_spill_directories]
+        patch_table = PatchTable.from_paths(itertools.chain.from_iterable(group_patches))
+        ends = np.cumsum([len(patches) for patches in group_patches], dtype=np.int64)
+        return patch_table, [patch_table.directory[end - len(patches):end] \
+                for patches, end in zip(group_patches, ends.tolist())]
+
+    def print_group_summary(self, groups, group_names=None):
+        """Print the patient and patch counts of every group and category as markdown tables, like group_summary().
+
+        Overrides OutputMixin.print_group_summary() to count over the directory columns of a patch
+        table with get_summary_directories() instead of parsing every patch path.
+
+        Parameters
+        ----------
+        groups : dict
+            Groups in Mitch format, where imgs can be lazy views of a patch table or a PatchSpill
+
+        group_names : dict of str
+            {chunk id: name of the group}. By default the chunk with id i is 'Group i+1'
+
+        Returns
+        -------
+        GroupSummary
+            The counts of the printed summary
+        """
+        if group_names is None:
+            group_names = {chunk['id']: f"Group {chunk['id'] + 1}" for chunk in groups['chunks']}
+        patch_table, group_directories = self.get_summary_directories(
+                [chunk['imgs'] for chunk in groups['chunks']])
+        summary = self.create_group_summary(patch_table,
+                [group_names[chunk['id']] for chunk in groups['chunks']], group_directories)
+        print(self.format_group_summary(summary))
+        return summary
+
+    def create_subtype_patient_slide_patch_dict(self, patch_paths):
+        """Group patch paths by subtype, patient and slide, using the manifest or the dataset origin to get the patient of a slide.
+
+        Returns
+        -------
+        dict
+            {subtype: {patient: {slide_id: [patch_path]}}
+        """
+        if self.should_use_origin:
+            return utils.create_subtype_patient_slide_patch_dict(
+                    patch_paths, self.patch_pattern, self.CategoryEnum,
+                    is_binary=self.is_binary, dataset_origin=self.dataset_origin)
+        else:
+            return self.manifest_index.create_subtype_patient_slide_patch_dict(
+                    patch_paths, self.patch_pattern, self.CategoryEnum,
+                    is_binary=self.is_binary)
+
+    def create_patch_table(self):
+        """Load the patch paths into a patch table and label the directories of the patches by subtype, patient and slide.
+
+        Returns
+        -------
+        PatchTable
+            The labeled patch table
+        """
+        patch_table = self.load_patch_table()
+        self.label_patch_table(patch_table)
+        return patch_table
+
+    def load_patch_table(self):
+        """Load the patch paths into a patch table without labels
+
+        Returns
+        -------
+        PatchTable
+            The patch table
+        """
+        if self.should_use_extracted_patches and os.path.isdir(self.patch_location):
+            stage_name = 'scan_patches'
+        elif self.should_use_hd5 and os.path.isdir(self.hd5_location):
+            stage_name = 'read_hd5'
+        elif self.should_use_scan_shards and os.path.isdir(self.shard_location):
+            stage_name = 'merge_scan_shards'
+        else:
+            raise NotImplementedError
+        with self.metrics.stage(stage_name) as stage:
+            if self.should_use_extracted_patches:
+                patch_table = PatchTable.from_directories(self.scan_patch_directories())
+            elif self.should_use_hd5:
+                patch_table = PatchTable.from_paths(self.get_hd5_paths())
+            else:
+                patch_table = PatchTable.from_directories(self.iter_scan_shard_directories())
+            stage.count(patches=len(patch_table), directories=len(patch_table.directories))
+
+        if len(patch_table) == 0:
+            if self.should_use_extracted_patches:
+                raise Exception(f'No patches are obtained from patch_location {self.patch_location}')
+            elif self.should_use_hd5:
+                raise Exception(f'No patches are obtained from patch_location {self.hd5_location}')
+            else:
+                raise Exception(f'No patches are obtained from shard_location {self.shard_location}')
+        return patch_table
+
+    def label_patch_table(self, patch_table):
+        """Label the directories of the patches in patch_table by subtype, patient and slide, replacing any previous labels.
+
+        Patch paths in the same directory have the same labels, so only the first patch path in each directory is parsed.
+
+        Parameters
+        ----------
+        patch_table : PatchTable
+            The patch table to label
+        """
+        with self.metrics.stage('label_patches') as stage:
+            first_rows = patch_table.get_first_row_of_directories()
+            directories = np.flatnonzero(first_rows >= 0)
+            directories = directories[np.argsort(first_rows[directories], kind='stable')]
+            patch_paths = patch_table.get_paths(first_rows[directories])
+            patch_path_directory = dict(zip(patch_paths, directories.tolist()))
+            subtype_patient_slide_patch = self.create_subtype_patient_slide_patch_dict(patch_paths)
+            for patient_slide_patch in subtype_patient_slide_patch.values():
+                for slide_patch in patient_slide_patch.values():
+                    for slide, patches in slide_patch.items():
+                        slide_patch[slide] = [patch_path_directory[p] for p in patches]
+            patch_table.set_directory_labels(subtype_patient_slide_patch)
+            # the categories depend on is_binary and subtypes so they are parsed again
+            patch_table.directory_columns.pop('category', None)
+            self.parse_patch_table(patch_table)
+            stage.count(directories=len(directories))
+
+    def create_patch_spill(self):
+        """Spill the patch paths to partition files labeled by subtype, patient and slide, like create_patch_table().
+
+        The patch paths are labeled one batch at a time, parsing the first patch path of every new directory.
+
+        Returns
+        -------
+        PatchSpill
+            The labeled patch records. The caller closes the spill to delete the partition files
+        """
+        if self.should_use_extracted_patches and os.path.isdir(self.patch_location):
+            location = self.patch_location
+        elif self.should_use_hd5 and os.path.isdir(self.hd5_location):
+            location = self.hd5_location
+        elif self.should_use_scan_shards and os.path.isdir(self.shard_location):
+            location = self.shard_location
+        else:
+            raise NotImplementedError
+
+        spill_location = self.spill_location or os.path.dirname(os.path.abspath(self.out_location))
+        spill = PatchSpill(spill_location, memory_budget=self.memory_budget * 2**20)
+        try:
+            n_patches = 0
+            with self.metrics.stage('spill_patches') as stage:
+                for batch in self.iter_patch_batches():
+                    directory_ids = []
+                    new_directories = {}
+                    for directory, names in batch:
+                        directory_id, is_new = spill.intern_directory(directory)
+                        directory_ids.append(directory_id)
+                        if is_new:
+                            new_directories[directory + names[0]] = directory_id
+                        n_patches += len(names)
+                    subtype_patient_slide_patch = self.create_subtype_patient_slide_patch_dict(
+                            list(new_directories))
+                    for subtype, patient_slide_patch in subtype_patient_slide_patch.items():
+                        for patient, slide_patch in patient_slide_patch.items():
+                            for slide, patches in slide_patch.items():
+                                for patch_path in patches:
+                                    spill.set_directory_label(new_directories[patch_path],
+                                            subtype, patient, slide)
+                    for directory_id, (_, names) in zip(directory_ids, batch):
+                        spill.append(directory_id, names)
+                spill.finish()
+                stage.count(patches=n_patches, directories=len(spill.directories))
+            if n_patches == 0:
+                raise Exception(f'No patches are obtained from patch_location {location}')
+        except BaseException:
+            spill.close()
+            raise
+        return spill
+
+    def generate_groups(self):
+        """Generate groups in Yiping format
+
+        Returns
+        -------
+        dict
+            Groups in Yiping format
+
+        list of str
+            Slides excluded from groups
+        """
+        if self.out_of_core:
+            spill, groups, ignored_slides = self.generate_group_records()
+            try:
+                groups = {group_id: self.existing_groups[group_id] if group_id in self.kept_group_ids \
+                        else spill.get_paths(records) for group_id, records in groups.items()}
+            finally:
+                spill.close()
+            return groups, ignored_slides
+        patch_table, groups, ignored_slides = self.generate_group_rows()
+        groups = {group_id: self.existing_groups[group_id] if group_id in self.kept_group_ids \
+                else patch_table.get_paths(rows) for group_id, rows in groups.items()}
+        return groups, ignored_slides
+
+    def remove_ignored_slides(self, subtype_patient_slide_patch):
+        """Remove slides that have fewer than min_patches or more than max_patches patches.
+
+        Parameters
+        ----------
+        subtype_patient_slide_patch : dict
+            {subtype: {patient: {slide_id: [patch_path]}}. The ignored slides are removed in place
+
+        Returns
+        -------
+        list of str
+            Slides excluded from groups
+        """
+        ignored_slides = []
+        for subtype, patient_slide_patch in subtype_patient_slide_patch.items():
+            for patient, slide_patch in patient_slide_patch.items():
+                for slide, patch in slide_patch.items():
+                    if self.min_patches and len(patch) < self.min_patches:
+                        ignored_slides += ['/'.join([subtype, patient, slide])]
+                    elif self.max_patches and len(patch) > self.max_patches:
+                        ignored_slides += ['/'.join([subtype, patient, slide])]
+
+        for ignored_slide in ignored_slides:
+            ignored_slide_subtype, ignored_slide_patient_num, ignored_slide_slide_id = ignored_slide.split('/')
+            del subtype_patient_slide_patch[ignored_slide_subtype][ignored_slide_patient_num][ignored_slide_slide_id]
+        return ignored_slides
+
+    def assign_patients_to_groups(self, subtype_patient_slide_patch, existing_group_patient_slides=None):
+        """Split the patients of every subtype into groups, balancing the number of patients of each origin across groups.
+
+        Parameters
+        ----------
+        subtype_patient_slide_patch : dict
+            {subtype: {patient: {slide_id: [patch_path]}}
+
+        existing_group_patient_slides : dict
+            {group_id: {subtype: {patient: set of slide_id}}} of an existing groups file. If set, the patients
+            in it keep their group and the new patients are put in the groups furthest below the number of
+            patients of their origin that utils.find_steps() gives for the group
+
+        Returns
+        -------
+        dict
+            {group_id: {subtype: [patient]}}
+        """
+        subtype_names = [s.name for s in self.CategoryEnum]
+        groups_subtypes_patients = {}
+        for group_idx in range(self.n_groups):
+            groups_subtypes_patients['group_' + str(group_idx + 1)] = {subtype_name: [] for subtype_name in subtype_names}
+
+        # dict {subtype: {origin: list of patients }}
+        patient_subtype_origin_dict = dict(
+            zip(subtype_names, [{} for s in subtype_names]))
+
+        for subtype in subtype_names:
+            for origin in self.dataset_origin:
+                patient_subtype_origin_dict[subtype][origin]  = []
+        for subtype, patients in subtype_patient_slide_patch.items():
+            for patient in patients.keys():
+                origin = patient[:patient.find('__')]
+                patient_subtype_origin_dict[subtype][origin] += [patient]
+
+        # dict {subtype: {origin: number of patients }}
+        patient_subtype_origin_count = dict(
+            zip(subtype_names, [{} for s in subtype_names]))
+        for subtype in subtype_names:
+            for origin in self.dataset_origin:
+                count = len(patient_subtype_origin_dict[subtype][origin])
+                assert count!=0, f"There is no patient for subtype -{subtype}- in origin -{origin}-"
+                patient_subtype_origin_count[subtype][origin] = count
+
+        for subtype_name in subtype_names:
+            # randomize occurance of patients to put into which group
+            self.random_streams.shuffle_sequence('patient', [((subtype_name, origin),
+                    patient_subtype_origin_dict[subtype_name][origin]) for origin in self.dataset_origin])
+            steps = utils.find_steps(patient_subtype_origin_count[subtype_name], self.n_groups)
+            if existing_group_patient_slides is None:
+                for group_idx in range(self.n_groups):
+                    selected_patients = []
+                    for origin in self.dataset_origin:
+                        start = sum(steps[origin][:group_idx])
+                        selected_patients += patient_subtype_origin_dict[subtype_name][origin][start:start+steps[origin][group_idx]]
+                    groups_subtypes_patients['group_' + str(group_idx + 1)][subtype_name] = selected_patients
+                continue
+            existing_patient_group = {}
+            for group_idx in range(self.n_groups):
+                group_id = 'group_' + str(group_idx + 1)
+                for patient in existing_group_patient_slides.get(group_id, {}).get(subtype_name, {}):
+                    existing_patient_group.setdefault(patient, group_idx)
+            for origin in self.dataset_origin:
+                patients = patient_subtype_origin_dict[subtype_name][origin]
+                patient_group = {patient: existing_patient_group[patient] for patient in patients \
+                        if patient in existing_patient_group}
+                new_patients = [patient for patient in patients if patient not in patient_group]
+                group_counts = np.bincount(np.asarray(list(patient_group.values()), dtype=np.int64),
+                        minlength=self.n_groups)
+                patient_group.update(zip(new_patients,
+                        fill_deficits(steps[origin], group_counts, len(new_patients))))
+                for patient in patients:
+                    groups_subtypes_patients['group_' + str(patient_group[patient] + 1)][subtype_name].append(patient)
+        return groups_subtypes_patients
+
+    def get_existing_group_patient_slides(self):
+        """Label the patches of existing_groups by subtype, patient and slide.
+
+        Patch paths in the same directory have the same labels, so only the first patch path in each directory is parsed.
+
+        Returns
+        -------
+        dict
+            {group_id: {subtype: {patient: set of slide_id}}}
+        """
+        group_ids = ['group_' + str(group_idx + 1) for group_idx in range(self.n_groups)]
+        if sorted(self.existing_groups.keys()) != sorted(group_ids):
+            raise ValueError(f"Groups file {self.update_from} has groups {sorted(self.existing_groups.keys())}, "
+                    f"expected {self.n_groups} groups")
+        directory_group = {}
+        patch_paths = []
+        for group_id, patches in self.existing_groups.items():
+            for patch_path in patches:
+                directory = patch_path[:patch_path.rfind('/') + 1]
+                if directory not in directory_group:
+                    directory_group[directory] = group_id
+                    patch_paths.append(patch_path)
+        group_patient_slides = {group_id: {} for group_id in group_ids}
+        subtype_patient_slide_patch = self.create_subtype_patient_slide_patch_dict(patch_paths)
+        for subtype, patient_slide_patch in subtype_patient_slide_patch.items():
+            for patient, slide_patch in patient_slide_patch.items():
+                for slide, patches in slide_patch.items():
+                    for patch_path in patches:
+                        group_id = directory_group[patch_path[:patch_path.rfind('/') + 1]]
+                        group_patient_slides[group_id].setdefault(subtype, {}) \
+                                .setdefault(patient, set()).add(slide)
+        return group_patient_slides
+
+    def get_group_options(self):
+        """Get the options that the contents of the groups depend on, which are written next to the groups file
+
+        Returns
+        -------
+        dict
+            The options as they are written to the JSON options file
+        """
+        return json.loads(json.dumps({
+            'seed': self.seed,
+            'legacy_shuffle': self.legacy_shuffle,
+            'n_groups': self.n_groups,
+            'is_binary': self.is_binary,
+            'subtypes': self.subtypes,
+            'patch_pattern': self.patch_pattern,
+            'filter_labels': self.filter_labels,
+            'min_patches': self.min_patches,
+            'max_patches': self.max_patches,
+            'max_patient_patches': self.max_patient_patches,
+            'balance_patches': self.balance_patches,
+        }))
+
+    def get_existing_group_directory_counts(self):
+        """Count the patches of every directory in each group of existing_groups
+
+        Returns
+        -------
+        dict
+            {group_id: {directory: number of patches}}
+        """
+        group_directory_counts = {}
+        for group_id, patches in self.existing_groups.items():
+            group_directory_counts[group_id] = collections.Counter(patch_path[:patch_path.rfind('/') + 1] \
+                    for patch_path in patches)
+        return group_directory_counts
+
+    def get_kept_group_ids(self, directories, group_directories):
+        """Get the groups of existing_groups that can be written unchanged in place of the recomputed groups.
+
+        A group is kept if update_from was generated with the same group options and the recomputed
+        group has the same number of patches in every directory as the existing group after balancing,
+        so that it has the same patients, slides, take counts of every category and patches of every slide.
+
+        Parameters
+        ----------
+        directories : list of str
+            The directories of the patches
+
+        group_directories : dict of numpy.ndarray
+            {group_id: the index in directories of the directory of every patch of the recomputed group}
+
+        Returns
+        -------
+        list of str
+            The groups that can be written unchanged from existing_groups
+        """
+        if self.existing_options is None:
+            logger.info(f"Updating groups from {self.update_from}: keeping no groups "
+                    f"since it has no options file {get_options_location(self.update_from)}. "
+                    f"Options files are written with --write_options")
+            return []
+        options = self.get_group_options()
+        changed_options = sorted(option for option, value in options.items() \
+                if self.existing_options.get(option) != value)
+        if changed_options:
+            logger.info(f"Updating groups from {self.update_from}: keeping no groups "
+                    f"since options {changed_options} changed")
+            return []
+        existing_group_directory_counts = self.get_existing_group_directory_counts()
+        kept_group_ids = []
+        for group_id, group_directory in group_directories.items():
+            counts = np.bincount(np.asarray(group_directory, dtype=np.int64), minlength=len(directories))
+            directory_counts = {directories[idx]: count for idx, count \
+                    in zip(np.flatnonzero(counts).tolist(), counts[counts > 0].tolist())}
+            if directory_counts == existing_group_directory_counts[group_id]:
+                kept_group_ids.append(group_id)
+        logger.info(f"Updating groups from {self.update_from}: keeping {kept_group_ids}")
+        return kept_group_ids
+
+    def assign_patients_to_existing_groups(self, subtype_patient_slide_patch):
+        """Assign patients to groups with assign_patients_to_groups(), keeping the groups of the patients in
+        existing_groups if update_from is set.
+
+        Returns
+        -------
+        dict
+            {group_id: {subtype: [patient]}}
+        """
+        if self.existing_groups is None:
+            return self.assign_patients_to_groups(subtype_patient_slide_patch)
+        return self.assign_patients_to_groups(subtype_patient_slide_patch,
+                self.get_existing_group_patient_slides())
+
+    def get_group_patches(self, groups, patches):
+        """Get the patch paths of groups in Mitch format, taking the kept groups from existing_groups.
+
+        Parameters
+        ----------
+        groups : dict
+            Groups in Mitch format with rows of patch_table or records of a spill as imgs
+
+        patches : PatchTable or PatchSpill
+            The patches that the imgs of groups index
+
+        Returns
+        -------
+        dict
+            Groups in Mitch format with lazy views of the patch paths as imgs
+        """
+        kept_groups = {}
+        if self.kept_group_ids:
+            kept_groups = convert_yiping_to_mitch_format({group_id: self.existing_groups[group_id] \
+                    for group_id in self.kept_group_ids})
+            kept_groups = {chunk['id']: chunk['imgs'] for chunk in kept_groups['chunks']}
+        return dict(groups, chunks=[dict(chunk, imgs=kept_groups[chunk['id']] \
+                if chunk['id'] in kept_groups else patches.view(chunk['imgs'])) \
+                for chunk in groups['chunks']])
+
+    def get_patient_subtype_patch_to_select_count(self, subtype_patient_slide_patch):
+        """Precompute how many patches we need from each (subtype, patient) if max_patient_patches is set.
+
+        Returns
+        -------
+        dict
+            {patient: {subtype: number of patches to select}}, or None if max_patient_patches is not set
+        """
+        patient_subtype_patch_to_select_count = None
+        if self.max_patient_patches:
+            patient_subtype_patch_to_select_count, patient_subtype_patch_count = self.create_patient_subtype_patch_to_select_count(
+                    subtype_patient_slide_patch)
+            if self.debug:
+                print('patient_subtype_patch_to_select_count')
+                print(json.dumps(patient_subtype_patch_to_select_count, indent=4, sort_keys=True))
+                print()
+                print('patient_subtype_patch_count')
+                print(json.dumps(patient_subtype_patch_count, indent=4, sort_keys=True))
+                print()
+        return patient_subtype_patch_to_select_count
+
+    def generate_group_rows(self, patch_table=None):
+        """Generate groups in Yiping format with the patches as rows of a patch table
+
+        Parameters
+        ----------
+        patch_table : PatchTable
+            Optional patch table labeled by label_patch_table() to use instead of loading the patches
+
+        Returns
+        -------
+        PatchTable
+            The patch table of the patches
+
+        dict of numpy.ndarray
+            Groups in Yiping format with the rows of the patch table in place of the patch paths
+
+        list of str
+            Slides excluded from groups
+        """
+        if patch_table is None:
+            patch_table = self.create_patch_table()
+        with self.metrics.stage('index_patches') as stage:
+            subtype_patient_slide_patch = patch_table.create_subtype_patient_slide_patch_dict()
+            ignored_slides = self.remove_ignored_slides(subtype_patient_slide_patch)
+            stage.count(**self.count_subtype_patient_slide_patch(subtype_patient_slide_patch))
+        with self.metrics.stage('assign_patients') as stage:
+            groups_subtypes_patients = self.assign_patients_to_existing_groups(subtype_patient_slide_patch)
+            stage.count(groups=len(groups_subtypes_patients),
+                    patients=sum(len(patients) for subtypes_patients in groups_subtypes_patients.values() \
+                            for patients in subtypes_patients.values()))
+
+        with self.metrics.stage('sample_slides',
+                **self.count_subtype_patient_slide_patch(subtype_patient_slide_patch)):
+            patient_subtype_patch_to_select_count = self.get_patient_subtype_patch_to_select_count(
+                    subtype_patient_slide_patch)
+            # shuffle to randomize occurance by patches by location in slide
+            self.random_streams.sample_each('slide', self.get_slide_select_counts(
+                    subtype_patient_slide_patch, patient_subtype_patch_to_select_count))
+
+        with self.metrics.stage('select_patches') as stage:
+            groups_subtypes = {}
+            for group_id, subtypes_patients in groups_subtypes_patients.items():
+                groups_subtypes[group_id] = {}
+                for subtype_name, selected_patients in subtypes_patients.items():
+                    groups_subtypes[group_id][subtype_name] = []
+                    for selected_patient in selected_patients:
+                        if self.max_patient_patches:
+                            groups_subtypes[group_id][subtype_name] += self.select_patches_from_dict(
+                                    subtype_patient_slide_patch[subtype_name][selected_patient],
+                                    max_patches=patient_subtype_patch_to_select_count[selected_patient][subtype_name])
+                        else:
+                            groups_subtypes[group_id][subtype_name] += self.select_patches_from_dict(
+                                    subtype_patient_slide_patch[subtype_name][selected_patient])
+            stage.count(patches=self.count_groups_subtypes_patches(groups_subtypes))
+
+        groups = self.shuffle_and_balance_groups(groups_subtypes)
+        groups = {group_id: np.asarray(rows, dtype=np.int64) for group_id, rows in groups.items()}
+        if self.existing_groups is not None:
+            self.kept_group_ids = self.get_kept_group_ids(patch_table.directories,
+                    {group_id: patch_table.directory[rows] for group_id, rows in groups.items()})
+        return patch_table, groups, ignored_slides
+
+    def generate_group_records(self):
+        """Generate groups in Yiping format with the patches as records of a PatchSpill.
+
+        Gives the same groups as generate_group_rows(). The slides are sampled one partition
+        of the spill at a time, so only the records of the selected patches are held in memory.
+
+        Returns
+        -------
+        PatchSpill
+            The spilled patch records. The caller closes the spill to delete the partition files
+
+        dict of numpy.ndarray
+            Groups in Yiping format with the records of the spill in place of the patch paths
+
+        list of str
+            Slides excluded from groups
+        """
+        spill = self.create_patch_spill()
+        try:
+            with self.metrics.stage('index_patches') as stage:
+                subtype_patient_slide_patch = spill.create_subtype_patient_slide_patch_dict()
+                ignored_slides = self.remove_ignored_slides(subtype_patient_slide_patch)
+                stage.count(**self.count_subtype_patient_slide_patch(subtype_patient_slide_patch))
+            with self.metrics.stage('assign_patients') as stage:
+                groups_subtypes_patients = self.assign_patients_to_existing_groups(subtype_patient_slide_patch)
+                stage.count(groups=len(groups_subtypes_patients),
+                        patients=sum(len(patients) for subtypes_patients in groups_subtypes_patients.values() \
+                                for patients in subtypes_patients.values()))
+
+            with self.metrics.stage('sample_slides',
+                    **self.count_subtype_patient_slide_patch(subtype_patient_slide_patch)):
+                patient_subtype_patch_to_select_count = self.get_patient_subtype_patch_to_select_count(
+                        subtype_patient_slide_patch)
+                select_counts = {key: count for key, _, count in self.get_slide_select_counts(
+                        subtype_patient_slide_patch, patient_subtype_patch_to_select_count)}
+
+                # shuffle to randomize occurance by patches by location in slide
+                slide_records = {}
+                for partition_slide_records in spill.iter_partition_slide_records():
+                    key_sizes_counts = [(key, len(records), select_counts[key]) \
+                            for key, records in partition_slide_records.items() if key in select_counts]
+                    positions = self.random_streams.sample_positions_each('slide', key_sizes_counts)
+                    for (key, _, count), key_positions in zip(key_sizes_counts, positions):
+                        slide_records[key] = partition_slide_records[key][key_positions[:count]]
+
+            with self.metrics.stage('select_patches') as stage:
+                groups_subtypes = {}
+                for group_id, subtypes_patients in groups_subtypes_patients.items():
+                    groups_subtypes[group_id] = {}
+                    for subtype_name, selected_patients in subtypes_patients.items():
+                        records = [slide_records[(subtype_name, patient, slide)] \
+                                for patient in selected_patients \
+                                for slide in subtype_patient_slide_patch[subtype_name][patient]]
+                        groups_subtypes[group_id][subtype_name] = np.concatenate(records) \
+                                if records else np.zeros(0, dtype=np.int64)
+                del slide_records
+                stage.count(patches=self.count_groups_subtypes_patches(groups_subtypes))
+
+            groups = self.shuffle_and_balance_groups(groups_subtypes)
+            if self.existing_groups is not None:
+                self.kept_group_ids = self.get_kept_group_ids(spill.directories,
+                        {group_id: spill.get_directories(records) for group_id, records in groups.items()})
+        except BaseException:
+            spill.close()
+            raise
+        return spill, groups, ignored_slides
+
+    def write_groups(self, groups, patch_table=None):
+        """Converts groups in Yiping format to Mitch format and writes it to
+        self.out_location as a JSON file, or as a binary groups file if self.out_format is not 'json'.
+
+        The patch paths are written in batches and the file is replaced atomically when complete.
+        If write_options or update_from is set, the options of get_group_options() are written to
+        the options file of self.out_location.
+
+        Parameters
+        ----------
+        groups : dict
+            Groups in Mitch format
+
+        patch_table : PatchTable
+            If set, the imgs of each chunk in groups are rows of patch_table
+            and the patch paths are rebuilt for writing
+        """
+        if patch_table is not None:
+            groups = dict(groups, chunks=[dict(chunk, imgs=patch_table.view(chunk['imgs']))
+                    for chunk in groups['chunks']])
+        if self.out_format == 'json':
+            write_json(self.out_location, groups)
+        else:
+            write_binary(self.out_location, groups, self.out_format)
+        if self.write_options or self.update_from:
+            write_json(get_options_location(self.out_location), self.get_group_options())
+
+    def create_sweep_group_creator(self, sweep_config):
+        """Create a copy of this group creator with the options of a sweep config
+
+        Parameters
+        ----------
+        sweep_config : dict
+            The options to set, from create_groups.sweep.read_sweep()
+
+        Returns
+        -------
+        GroupCreator
+        """
+        group_creator = copy.copy(self)
+        group_creator.sweep_location = None
+        group_creator.metrics = StageMetrics(trace_memory=group_creator.trace_memory)
+        for option, value in sweep_config.items():
+            setattr(group_creator, option, value)
+        group_creator.random_streams = RandomStreams(group_creator.seed,
+                is_legacy=group_creator.legacy_shuffle, workers=group_creator.shuffle_workers)
+        group_creator.CategoryEnum = utils.create_category_enum(group_creator.is_binary,
+                group_creator.subtypes)
+        return group_creator
+
+    def run_sweep(self):
+        """Generate the groups of every config in the sweep file sweep_location from one scan of the patches.
+
+        The patch table is loaded once and labeled once for every distinct is_binary and subtypes.
+        The configs with the same labels run in sweep_workers processes that share the patch table.
+        """
+        sweep_configs = read_sweep(self.sweep_location)
+        if self.out_of_core:
+            raise NotImplementedError("Sweeps are not implemented with out_of_core")
+        group_creators = [self.create_sweep_group_creator(sweep_config) for sweep_config in sweep_configs]
+        labels_configs = {}
+        for idx, group_creator in enumerate(group_creators):
+            labels = (group_creator.is_binary, tuple(sorted(group_creator.subtypes.items())))
+            labels_configs.setdefault(labels, []).append(idx)
+        patch_table = self.load_patch_table()
+        outputs = [None] * len(group_creators)
+        for config_indices in labels_configs.values():
+            group_creators[config_indices[0]].label_patch_table(patch_table)
+            config_outputs = map_sweep([group_creators[idx] for idx in config_indices],
+                    patch_table, workers=self.sweep_workers)
+            for idx, output in zip(config_indices, config_outputs):
+                outputs[idx] = output
+        for sweep_config, output in zip(sweep_configs, outputs):
+            print(f"Sweep config {json.dumps(sweep_config)}")
+            print(output)
+
+    def run(self, patch_table=None):
+        """Generate the groups, write them to out_location and print a summary of them.
+
+        Parameters
+        ----------
+        patch_table : PatchTable
+            Optional patch table labeled by label_patch_table() to use instead of loading the patches
+        """
+        with self.metrics.tracing():
+            if self.sweep_location:
+                return self.run_sweep()
+            if self.should_scan_shard:
+                with self.metrics.stage('scan_shard') as stage:
+                    leaves = self.scan_shard()
+                    stage.count(patches=sum(len(names) for _, names in leaves), directories=len(leaves))
+                print(f"Listed {stage.counts['patches']} patches in {len(leaves)} directories "
+                        f"of shard {self.shard_index} of {self.n_shards} to {self.out_location}")
+                if self.write_metrics:
+                    self.metrics.write(get_metrics_location(self.out_location))
+                return None
+            if self.out_of_core:
+                patches, groups, ignored_slides = self.generate_group_records()
+            else:
+                patches, groups, ignored_slides = self.generate_group_rows(patch_table=patch_table)
+            try:
+                n_patches = sum(len(group) for group in groups.values())
+                with self.metrics.stage('convert_groups', patches=n_patches):
+                    # the imgs of the chunks are lazy views of the rows in patch_table or the records in the spill
+                    groups = self.get_group_patches(convert_yiping_to_mitch_format(groups), patches)
+                with self.metrics.stage('write_groups', patches=n_patches):
+                    self.write_groups(groups)
+                # self.group_summary(groups)
+                with self.metrics.stage('print_group_summary', patches=n_patches):
+                    group_names = {chunk['id']: f"Group {chunk['id'] + 1}"  for chunk in groups['chunks']}
+                    summary = self.print_group_summary(groups, group_names=group_names)
+            finally:
+                if self.out_of_core:
+                    patches.close()
+            print('Ignored Slides')
+            print(ignored_slides)
+            if self.write_metrics:
+                self.metrics.write(get_metrics_location(self.out_location))
+            return summary
@@ -0,0 +1,23 @@
+"""Default values of the arguments of create_groups.
+
+This module imports nothing so that the parser can be created without importing NumPy, h5py or the
+modules of GroupCreator.
+"""
+default_component_id = 'create_groups'
+default_seed = 256
+default_n_groups = 3
+default_subtypes = {'MMRD':0, 'P53ABN': 1, 'P53WT': 2, 'POLE': 3}
+default_patch_pattern = 'annotation/subtype/slide'
+default_filter_labels = {}
+default_dataset_origin = ['ovcare']
+default_min_patches = 10
+default_max_patches = 1000000
+
+default_shuffle_workers = 4
+default_scan_workers = 8
+default_scan_in_flight = 0
+default_hd5_workers = 4
+default_hd5_chunk_size = 65536
+default_memory_budget = 1024
+default_sweep_workers = 1
+OUT_FORMATS = ['json', 'hdf5', 'npz']
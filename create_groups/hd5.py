@@ -0,0 +1,275 @@
+"""Loading of patch paths from the paths dataset of hd5 files
+"""
+import os
+import re
+import fnmatch
+import functools
+import concurrent.futures
+
+import numpy as np
+
+from create_groups.defaults import (default_hd5_workers, default_hd5_chunk_size)
+
+def open_h5(path, mode='r'):
+    """Open a HDF5 file with h5py.File.
+
+    h5py is slow to import, so it is imported here when a HDF5 file is first opened instead of when
+    the modules are imported. Only the runs that read hd5 files or hdf5 groups files, or write hdf5
+    groups files, import it.
+    """
+    import h5py
+    return h5py.File(path, mode)
+
+def has_magic(s):
+    return re.search(r'[*?[]', s) is not None
+
+class PathMatcher(object):
+    """Filters fixed width byte arrays of patch paths by glob wildcards without decoding them.
+
+    The wildcards are the ones created by GroupCreator.get_patch_path_wildcards() where every
+    component after the root is either a literal, '*' or '**', and the last component is of the
+    form '*suffix' (i.e. '*.png'). Paths with as many components as the wildcards are matched
+    component by component as numpy operations on the raw bytes, which gives the same result as
+    fnmatch since '*' can not match across '/' when the number of '/' is the same.
+    The remaining paths, and wildcards of any other form, are decoded and matched with fnmatch.
+
+    Attributes
+    ----------
+    wildcards : list of str
+        The wildcards to match
+
+    prefix : bytes
+        The root of the wildcards followed by '/'
+
+    n_slashes : int
+        The number of '/' in the wildcards
+
+    literals : list of (list of (int, bytes))
+        For each wildcard, the indices and values of the components that are literals
+
+    suffixes : list of bytes
+        For each wildcard, the suffix that the last component must end with
+
+    is_vectorized : bool
+        Whether the wildcards can be matched as numpy operations
+    """
+
+    def __init__(self, root, wildcards):
+        self.wildcards = wildcards
+        self.prefix = os.path.join(root, '').encode('utf-8')
+        self.n_slashes = None
+        self.literals = []
+        self.suffixes = []
+        self.is_vectorized = not has_magic(root)
+        for wildcard in wildcards:
+            if not self.is_vectorized:
+                break
+            components = wildcard[len(self.prefix.decode('utf-8')):].split('/')
+            n_slashes = self.prefix.count(b'/') + len(components) - 1
+            suffix = re.fullmatch(r'\*([^*?[]*)', components[-1])
+            if not wildcard.startswith(self.prefix.decode('utf-8')) or suffix is None \
+                    or (self.n_slashes is not None and self.n_slashes != n_slashes):
+                self.is_vectorized = False
+                break
+            self.n_slashes = n_slashes
+            literals = []
+            for idx, component in enumerate(components[:-1]):
+                if component in ('*', '**'):
+                    continue
+                elif has_magic(component):
+                    self.is_vectorized = False
+                    break
+                literals.append((idx + self.prefix.count(b'/'),
+                        component.encode('utf-8')))
+            self.literals.append(literals)
+            self.suffixes.append(suffix.group(1).encode('utf-8'))
+
+    @staticmethod
+    def equals_at(M, rows, starts, value):
+        """Check whether the bytes of each row of M at starts are equal to value"""
+        if len(value) == 0:
+            return np.ones(len(rows), dtype=bool)
+        cols = starts[:, None] + np.arange(len(value))
+        cols = np.minimum(cols, M.shape[1] - 1)
+        return (M[rows[:, None], cols] == np.frombuffer(value, dtype=np.uint8)).all(axis=1)
+
+    def fnmatch(self, patch_paths):
+        return [fnmatch.filter(patch_paths, wildcard) for wildcard in self.wildcards]
+
+    def filter(self, chunk):
+        """Filter a chunk of paths
+
+        Parameters
+        ----------
+        chunk : numpy.ndarray
+            Fixed width bytes array of paths
+
+        Returns
+        -------
+        list of (list of str)
+            For each wildcard, the decoded paths in chunk that match the wildcard
+        """
+        if not self.is_vectorized or chunk.itemsize == 0:
+            return self.fnmatch(np.char.decode(chunk, 'utf-8').tolist())
+        width = chunk.itemsize
+        M = chunk.view(np.uint8).reshape(len(chunk), width)
+        lengths = np.char.str_len(chunk)
+        is_slash = M == ord('/')
+        n_slashes = is_slash.sum(axis=1)
+        is_same_depth = n_slashes == self.n_slashes
+        if len(self.prefix) <= width:
+            is_same_depth &= (M[:, :len(self.prefix)] == np.frombuffer(self.prefix,
+                    dtype=np.uint8)).all(axis=1)
+        else:
+            is_same_depth[:] = False
+        rows = np.flatnonzero(is_same_depth)
+        # the positions of the '/' in each row of the same depth
+        slashes = np.nonzero(is_slash[rows])[1].reshape(len(rows), self.n_slashes)
+        # start and end of component idx are slashes[:, idx - 1] + 1 and slashes[:, idx]
+        other_patch_paths = np.char.decode(chunk[~is_same_depth], 'utf-8').tolist()
+        other_matches = self.fnmatch(other_patch_paths) if other_patch_paths else None
+        matches = []
+        for wildcard_idx, literals in enumerate(self.literals):
+            is_match = np.ones(len(rows), dtype=bool)
+            for idx, value in literals:
+                starts = slashes[:, idx - 1] + 1
+                ends = slashes[:, idx]
+                is_match &= (ends - starts) == len(value)
+                is_match &= self.equals_at(M, rows, starts, value)
+            suffix = self.suffixes[wildcard_idx]
+            starts = lengths[rows] - len(suffix)
+            is_match &= starts > slashes[:, -1]
+            is_match &= self.equals_at(M, rows, np.maximum(starts, 0), suffix)
+            if other_matches is None:
+                matches.append(np.char.decode(chunk[rows[is_match]], 'utf-8').tolist())
+            else:
+                # keep the order of the paths in chunk
+                match_rows = np.concatenate([rows[is_match],
+                        np.flatnonzero(~is_same_depth)[np.isin(other_patch_paths,
+                        other_matches[wildcard_idx])]])
+                match_rows.sort()
+                matches.append(np.char.decode(chunk[match_rows], 'utf-8').tolist())
+        return matches
+
+def iter_path_chunks(hd5_file, chunk_size=default_hd5_chunk_size):
+    """Read the paths dataset of a hd5 file in chunks.
+
+    Parameters
+    ----------
+    hd5_file : str
+        Path to the hd5 file
+
+    chunk_size : int
+        The number of paths to read at a time
+
+    Yields
+    ------
+    numpy.ndarray
+        Fixed width bytes array of at most chunk_size paths
+    """
+    with open_h5(hd5_file, 'r') as f:
+        dataset = f['paths']
+        for start in range(0, len(dataset), chunk_size):
+            chunk = dataset[start:start + chunk_size]
+            if chunk.dtype.kind != 'S':
+                # variable length strings are read as an object array
+                chunk = chunk.astype(np.bytes_)
+            yield chunk
+
+def read_hd5_paths(hd5_file, chunk_size=default_hd5_chunk_size):
+    """Read and decode the paths dataset of a hd5 file chunk by chunk.
+
+    Returns
+    -------
+    list of str
+        List of patch paths in the hd5 file
+    """
+    patch_paths = []
+    for chunk in iter_path_chunks(hd5_file, chunk_size=chunk_size):
+        patch_paths.extend(np.char.decode(chunk, 'utf-8').tolist())
+    return patch_paths
+
+def filter_hd5_paths(hd5_file, matcher, chunk_size=default_hd5_chunk_size):
+    """Read the paths dataset of a hd5 file chunk by chunk, only decoding the paths that match.
+
+    Returns
+    -------
+    list of (list of str)
+        For each wildcard of matcher, the patch paths in the hd5 file that match the wildcard
+    """
+    patch_paths = [[] for _ in matcher.wildcards]
+    for chunk in iter_path_chunks(hd5_file, chunk_size=chunk_size):
+        for wildcard_patch_paths, matches in zip(patch_paths, matcher.filter(chunk)):
+            wildcard_patch_paths.extend(matches)
+    return patch_paths
+
+def read_first_hd5_path(hd5_files):
+    """Get the first path in the paths datasets of hd5_files, or None if there are no paths"""
+    for hd5_file in hd5_files:
+        for chunk in iter_path_chunks(hd5_file, chunk_size=1):
+            return chunk[0].decode('utf-8')
+    return None
+
+def load_hd5_paths(hd5_files, workers=default_hd5_workers,
+        chunk_size=default_hd5_chunk_size, matcher=None):
+    """Read the paths datasets of hd5 files in a process pool, one file per task.
+
+    Parameters
+    ----------
+    hd5_files : list of str
+        Paths to the hd5 files
+
+    workers : int
+        The number of processes to read hd5 files with
+
+    chunk_size : int
+        The number of paths each process reads at a time
+
+    matcher : PathMatcher
+        Optional matcher to filter the paths with in the worker processes
+
+    Returns
+    -------
+    list of str
+        List of patch paths in the order of hd5_files. If matcher is set, the patch paths
+        matching each wildcard in the order of the wildcards, like calling fnmatch.filter
+        once per wildcard.
+    """
+    if matcher is None:
+        read_fn = functools.partial(read_hd5_paths, chunk_size=chunk_size)
+    else:
+        read_fn = functools.partial(filter_hd5_paths, matcher=matcher,
+                chunk_size=chunk_size)
+    if workers > 1 and len(hd5_files) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            files_patch_paths = list(executor.map(read_fn, hd5_files))
+    else:
+        files_patch_paths = list(map(read_fn, hd5_files))
+    patch_paths = []
+    if matcher is None:
+        for file_patch_paths in files_patch_paths:
+            patch_paths.extend(file_patch_paths)
+    else:
+        for wildcard_idx in range(len(matcher.wildcards)):
+            for file_patch_paths in files_patch_paths:
+                patch_paths.extend(file_patch_paths[wildcard_idx])
+    return patch_paths
+
+def iter_hd5_path_batches(hd5_files, root, wildcards, chunk_size=default_hd5_chunk_size):
+    """Read the patch paths that match wildcards from hd5 files one chunk at a time.
+
+    The batches are in the same order as load_hd5_paths() with a PathMatcher of wildcards,
+    so every hd5 file is read once per wildcard.
+
+    Yields
+    ------
+    list of str
+        The patch paths of a chunk of a hd5 file that match a wildcard
+    """
+    for wildcard in wildcards:
+        matcher = PathMatcher(root, [wildcard])
+        for hd5_file in hd5_files:
+            for chunk in iter_path_chunks(hd5_file, chunk_size=chunk_size):
+                patch_paths = matcher.filter(chunk)[0]
+                if patch_paths:
+                    yield patch_paths
@@ -0,0 +1,159 @@
+"""Indexing of the manifest of use-manifest by slide ID
+"""
+import os
+import json
+import hashlib
+import logging
+
+import submodule_utils as utils
+
+from create_groups.writer import write_json
+
+logger = logging.getLogger('create_groups')
+
+default_hash_block_size = 2**20
+
+def get_file_hash(path, block_size=default_hash_block_size):
+    """Get the SHA-256 hex digest of the contents of the file at path"""
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+class ManifestIndex(object):
+    """The slides of a manifest compiled into a hash map by slide ID.
+
+    The index is compiled once from the manifest CSV file and can be cached in a JSON file keyed
+    by the SHA-256 of the manifest file, so the CSV file is only parsed again when it changes.
+
+    Attributes
+    ----------
+    slides : dict of tuple
+        {slide_id: (patient_id, origin, subtype)} from the first row of every slide in the manifest.
+        subtype is None if the manifest has no subtype column
+
+    origins : list of str
+        The distinct origins of the manifest in the order they first appear
+
+    manifest_hash : str
+        The SHA-256 hex digest of the manifest file, or None if it was not hashed
+    """
+    version = 2
+
+    def __init__(self, slides, origins, manifest_hash=None):
+        self.slides = slides
+        self.origins = origins
+        self.manifest_hash = manifest_hash
+
+    @classmethod
+    def from_manifest(cls, manifest, manifest_hash=None):
+        """Compile the index of a manifest as read by utils.read_manifest(), {column: [value of each row]}"""
+        subtypes = manifest.get('subtype') or [None] * len(manifest['slide_id'])
+        slides = {}
+        for slide_id, patient_id, origin, subtype in zip(manifest['slide_id'],
+                manifest['patient_id'], manifest['origin'], subtypes):
+            slides.setdefault(slide_id, (patient_id, origin, subtype))
+        return cls(slides, list(dict.fromkeys(manifest['origin'])), manifest_hash=manifest_hash)
+
+    @classmethod
+    def get_default_path(cls, manifest_location, cache_location=None):
+        """Get the path of the cache file of manifest_location.
+        The cache file is put next to manifest_location unless cache_location is set.
+        """
+        manifest_location = os.path.abspath(manifest_location)
+        if cache_location:
+            key = hashlib.sha1(manifest_location.encode('utf-8')).hexdigest()[:16]
+            return os.path.join(cache_location, f"manifest_index_{key}.json")
+        parent, name = os.path.split(manifest_location)
+        return os.path.join(parent, f".{name}.manifest_index.json")
+
+    @classmethod
+    def load(cls, manifest_location, path=None):
+        """Load the index of the manifest at manifest_location.
+
+        If path is set, the index is loaded from the cache file at path if it was saved for the same
+        manifest contents. Otherwise the manifest CSV file is parsed and the index is saved to path.
+
+        Parameters
+        ----------
+        manifest_location : str
+            Path to the manifest CSV file
+
+        path : str
+            Path of the cache file, or None to always parse the manifest
+
+        Returns
+        -------
+        ManifestIndex
+        """
+        if path is None:
+            return cls.from_manifest(utils.read_manifest(manifest_location))
+        manifest_hash = get_file_hash(manifest_location)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        if data.get('version') == cls.version \
+                and data.get('manifest_hash') == manifest_hash:
+            logger.info(f"Manifest index {path}: reused")
+            return cls({slide_id: tuple(slide) for slide_id, slide in data['slides'].items()},
+                    data['origins'], manifest_hash=manifest_hash)
+        index = cls.from_manifest(utils.read_manifest(manifest_location),
+                manifest_hash=manifest_hash)
+        try:
+            index.save(path)
+        except OSError as e:
+            logger.warning(f"Could not save manifest index {path}: {e}")
+        return index
+
+    def save(self, path):
+        """Write the compiled index and the hash of its manifest to the cache file at path."""
+        write_json(path, {
+            'version': self.version,
+            'manifest_hash': self.manifest_hash,
+            'origins': self.origins,
+            'slides': {slide_id: list(slide) for slide_id, slide in self.slides.items()},
+        })
+
+    def get_origins(self):
+        """Get the distinct origins of the manifest in lower case"""
+        return [origin.lower() for origin in set(self.origins)]
+
+    def get_patient(self, slide_id):
+        """Get the patient of a slide as '<origin in lower case>__<patient_id>', or None if the slide is not in the manifest"""
+        slide = self.slides.get(slide_id)
+        if slide is None:
+            return None
+        patient_id, origin, _ = slide
+        return f"{origin.lower()}__{patient_id}"
+
+    def create_subtype_patient_slide_patch_dict(self, patch_paths, patch_pattern, CategoryEnum,
+            is_binary=False):
+        """Group patch paths by subtype, patient and slide like utils.create_subtype_patient_slide_patch_dict_manifest().
+
+        The slide of every patch path is joined to its patient through slides. The subtype is the
+        label of the patch path. Patch paths whose slide is not in the manifest, or whose label is
+        not one of CategoryEnum, are skipped.
+
+        Returns
+        -------
+        dict
+            {subtype: {patient: {slide_id: [patch_path]}} in the order of patch_paths
+        """
+        subtype_patient_slide_patch = {}
+        for patch_path in patch_paths:
+            patch_id = utils.create_patch_id(patch_path, patch_pattern)
+            slide_id = utils.get_slide_by_patch_id(patch_id, patch_pattern)
+            patient = self.get_patient(slide_id)
+            if patient is None:
+                continue
+            try:
+                subtype = utils.get_label_by_patch_id(patch_id, patch_pattern, CategoryEnum,
+                        is_binary=is_binary).name
+            except KeyError:
+                continue
+            subtype_patient_slide_patch.setdefault(subtype, {}).setdefault(patient, {}) \
+                    .setdefault(slide_id, []).append(patch_path)
+        return subtype_patient_slide_patch
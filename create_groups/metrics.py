@@ -0,0 +1,286 @@
+"""Timing, counting and memory tracing of the stages of creating groups
+"""
+import os
+import sys
+import time
+import logging
+import resource
+import threading
+import contextlib
+import tracemalloc
+
+from create_groups.writer import write_json
+
+logger = logging.getLogger('create_groups')
+
+metrics_version = 1
+default_n_allocation_sites = 10
+default_rss_interval = 0.05
+
+def get_rss():
+    """Get the resident set size of this process in bytes, or None if /proc is not available"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def get_max_rss():
+    """Get the peak resident set size of this process since it started in bytes"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+class RssSampler(object):
+    """Samples the resident set size of this process in a thread to get its peak over an interval of time.
+
+    Samples can miss a short spike, so the peak since the process started is also read from
+    getrusage(). It is the exact peak of the interval when the process reaches a new peak in it.
+
+    Attributes
+    ----------
+    interval : float
+        The seconds between samples
+
+    peak : int
+        The peak resident set size in bytes sampled so far
+    """
+
+    def __init__(self, interval=default_rss_interval):
+        self.interval = interval
+        self.peak = 0
+        self.start_max_rss = get_max_rss()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.sample_until_stopped, daemon=True)
+
+    def sample(self):
+        self.peak = max(self.peak, get_rss() or 0)
+
+    def sample_until_stopped(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling
+
+        Returns
+        -------
+        int
+            The peak resident set size in bytes between start() and stop()
+        """
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()
+        max_rss = get_max_rss()
+        if max_rss > self.start_max_rss:
+            self.peak = max(self.peak, max_rss)
+        return self.peak
+
+def get_allocation_sites(snapshot, start_snapshot, n_allocation_sites=default_n_allocation_sites):
+    """Get the source lines whose allocated memory grew the most between two tracemalloc snapshots
+
+    Returns
+    -------
+    list of dict
+        {'site': 'file:line', 'size_diff_mb': float, 'size_mb': float, 'count': int} of the sites with the largest growth
+    """
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')]
+    statistics = snapshot.filter_traces(filters).compare_to(
+            start_snapshot.filter_traces(filters), 'lineno')
+    return [{
+        'site': f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}",
+        'size_diff_mb': statistic.size_diff / 2**20,
+        'size_mb': statistic.size / 2**20,
+        'count': statistic.count,
+    } for statistic in statistics[:n_allocation_sites] if statistic.size_diff > 0]
+
+class Stage(object):
+    """The measurements of one run of a stage
+
+    Attributes
+    ----------
+    name : str
+        The name of the stage, i.e. 'load_patches'
+
+    wall_seconds : float
+        The wall time of the stage
+
+    cpu_seconds : float
+        The CPU time of this process in the stage, summed over its threads. The CPU time of worker processes is not included
+
+    counts : dict of int
+        {item: the number of items processed by the stage}, i.e. {'patches': 1000, 'slides': 10}
+
+    memory : dict
+        The memory of the stage in MB if memory is traced, otherwise None. The keys are
+         - 'traced_peak_mb': the peak memory allocated by Python during the stage, from tracemalloc
+         - 'traced_retained_mb': the memory allocated by Python that is still held at the end of the stage
+         - 'traced_retained_diff_mb': the change in the memory held from the start to the end of the stage
+         - 'rss_peak_mb': the peak resident set size of the process during the stage, including NumPy and h5py buffers
+         - 'rss_retained_mb': the resident set size at the end of the stage
+         - 'allocation_sites': the source lines that allocated the most memory still held at the end of the stage, from get_allocation_sites()
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_seconds = 0.
+        self.cpu_seconds = 0.
+        self.counts = {}
+        self.memory = None
+
+    def count(self, **counts):
+        """Set the number of items processed by the stage"""
+        self.counts.update({item: int(count) for item, count in counts.items()})
+
+    def get_throughputs(self):
+        """Get the number of items processed per second of wall time
+
+        Returns
+        -------
+        dict of float
+            {item: items per second}
+        """
+        if self.wall_seconds <= 0:
+            return {}
+        return {item: count / self.wall_seconds for item, count in self.counts.items()}
+
+    def to_dict(self):
+        stage_dict = {
+            'name': self.name,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'counts': self.counts,
+            'throughputs': self.get_throughputs(),
+        }
+        if self.memory is not None:
+            stage_dict['memory'] = self.memory
+        return stage_dict
+
+    def __str__(self):
+        throughputs = self.get_throughputs()
+        counts = ', '.join(f"{count} {item} ({throughputs.get(item, 0.):.1f}/s)" \
+                for item, count in self.counts.items())
+        lines = [f"Stage {self.name}: {self.wall_seconds:.3f}s wall, {self.cpu_seconds:.3f}s CPU" \
+                + (f", {counts}" if counts else '')]
+        if self.memory is not None:
+            lines.append(f"  {self.memory['traced_peak_mb']:.1f} MB traced peak, "
+                    f"{self.memory['traced_retained_mb']:.1f} MB traced retained "
+                    f"({self.memory['traced_retained_diff_mb']:+.1f} MB), "
+                    f"{self.memory['rss_peak_mb']:.1f} MB RSS peak, "
+                    f"{self.memory['rss_retained_mb']:.1f} MB RSS retained")
+            for site in self.memory['allocation_sites']:
+                lines.append(f"  {site['size_diff_mb']:+.1f} MB in {site['count']} blocks at {site['site']}")
+        return '\n'.join(lines)
+
+class StageMetrics(object):
+    """Records the wall time, CPU time and item counts of stages and logs every stage when it ends
+
+    Stages are recorded in the order they end, and a stage that runs more than once is recorded every time.
+
+    Attributes
+    ----------
+    stages : list of Stage
+        The stages that ended
+
+    trace_memory : bool
+        Whether to record the memory of the stages that run inside tracing(). Tracing slows down
+        the stages and taking the snapshots of the allocation sites takes time and memory
+
+    n_allocation_sites : int
+        The number of allocation sites recorded for every stage when memory is traced
+    """
+
+    def __init__(self, trace_memory=False, n_allocation_sites=default_n_allocation_sites):
+        self.stages = []
+        self.trace_memory = trace_memory
+        self.n_allocation_sites = n_allocation_sites
+
+    @contextlib.contextmanager
+    def tracing(self):
+        """Trace memory allocations with tracemalloc in the with block if trace_memory is set"""
+        is_started = self.trace_memory and not tracemalloc.is_tracing()
+        if is_started:
+            tracemalloc.start()
+        try:
+            yield
+        finally:
+            if is_started:
+                tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name, **counts):
+        """Measure the code in the with block as the stage name.
+
+        The stage is recorded even if the block raises, so the log shows how far a failed run got.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage
+
+        counts : int
+            The number of items processed by the stage if they are known before it runs.
+            Counts known at the end are set with Stage.count()
+
+        Yields
+        ------
+        Stage
+            The stage, whose times are set when the block ends
+        """
+        stage = Stage(name)
+        stage.count(**counts)
+        is_tracing = self.trace_memory and tracemalloc.is_tracing()
+        if is_tracing:
+            start_snapshot = tracemalloc.take_snapshot()
+            start_traced, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            rss_sampler = RssSampler()
+            rss_sampler.start()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.wall_seconds = time.perf_counter() - wall_start
+            stage.cpu_seconds = time.process_time() - cpu_start
+            if is_tracing:
+                rss_peak = rss_sampler.stop()
+                traced, traced_peak = tracemalloc.get_traced_memory()
+                stage.memory = {
+                    'traced_peak_mb': traced_peak / 2**20,
+                    'traced_retained_mb': traced / 2**20,
+                    'traced_retained_diff_mb': (traced - start_traced) / 2**20,
+                    'rss_peak_mb': rss_peak / 2**20,
+                    'rss_retained_mb': (get_rss() or 0) / 2**20,
+                    'allocation_sites': get_allocation_sites(tracemalloc.take_snapshot(),
+                            start_snapshot, n_allocation_sites=self.n_allocation_sites),
+                }
+            self.stages.append(stage)
+            logger.info(str(stage))
+
+    def to_dict(self):
+        metrics_dict = {
+            'version': metrics_version,
+            'wall_seconds': sum(stage.wall_seconds for stage in self.stages),
+            'cpu_seconds': sum(stage.cpu_seconds for stage in self.stages),
+            'stages': [stage.to_dict() for stage in self.stages],
+        }
+        memories = [stage.memory for stage in self.stages if stage.memory is not None]
+        if memories:
+            metrics_dict['traced_peak_mb'] = max(memory['traced_peak_mb'] for memory in memories)
+            metrics_dict['rss_peak_mb'] = max(memory['rss_peak_mb'] for memory in memories)
+        return metrics_dict
+
+    def write(self, path):
+        """Write the stages to path as a JSON file, replaced atomically when complete"""
+        write_json(path, self.to_dict())
+
+def get_metrics_location(out_location):
+    """Get the path of the metrics file of a groups file, i.e. /path/to/patient_groups.metrics.json
+    for /path/to/patient_groups.json"""
+    return f"{os.path.splitext(out_location)[0]}.metrics.json"
@@ -1,14 +1,12 @@
-import argparse
-
 from submodule_utils import (BALANCE_PATCHES_OPTIONS, DATASET_ORIGINS,
         PATCH_PATTERN_WORDS, set_random_seed, DEAFULT_SEED)
 from submodule_utils.manifest.arguments import manifest_arguments
 from submodule_utils.arguments import (
         AIMArgumentParser,
         dir_path, file_path, dataset_origin, balance_patches_options,
-        str_kv, int_kv, subtype_kv, make_dict,
-        ParseKVToDictAction, CustomHelpFormatter)
-from create_groups import *
+        str_kv, subtype_kv,
+        ParseKVToDictAction)
+from create_groups.defaults import *
 
 description="""Splits patches to groups by patient case and saves the path to these patches in a group file (i.e. /path/to/patient_groups.json).
 The patient_groups.json file uses Mitch's format for groups i.e. it is a json file with the format
@@ -84,7 +82,6 @@ If --max_patient_patches is set, then we will select max_patient_patches from ea
 # TODO: there is a chance --balance_patches sets empty groups. This happens if any patches for some (group, category) is zero.
 # TODO: in create_groups, variables are named 'subtype' instead of 'category'. That leads to confusion.
 # TODO: further explain how --max_patient_patches works in description
-# TODO: make GroupCreator.group_summary() return DataFrame. Test against DataFrame output
 # """
 epilog=""
 
@@ -94,6 +91,16 @@ def create_parser(parser):
     parser.add_argument("--seed", type=int, default=DEAFULT_SEED,
             help="Seed for random shuffle.")
 
+    parser.add_argument("--legacy_shuffle", action='store_true',
+            help="Whether to shuffle with Python's random module seeded before every shuffle. "
+            "Gives the same groups as earlier versions of create_groups. By default every slide, "
+            "(group, category) and group is shuffled with its own random stream derived from the seed, "
+            "and with --max_patient_patches only the patches selected from a slide are drawn from it.")
+
+    parser.add_argument("--shuffle_workers", type=int, default=default_shuffle_workers,
+            help="The number of threads used to shuffle patches. "
+            "The groups are the same for any number of workers. Not used with --legacy_shuffle.")
+
     parser.add_argument("--n_groups", type=int, default=default_n_groups,
             help="The number of groups in groups file.")
 
@@ -143,6 +150,68 @@ def create_parser(parser):
             help="full path of the groups file (i.e. /path/to/patient_groups.json). An "
             "example is '/projects/ovcare/classification/cchen/ml/data/local_ec_100/patient_groups.json'")
 
+    parser.add_argument("--out_format", type=str, default='json', choices=OUT_FORMATS,
+            help="The format of the groups file. The hdf5 and npz groups files store every "
+            "directory of the patch paths once, file names x_y.png as integer coordinates and "
+            "the bounds of the patches of every group. "
+            "They are loaded as groups in Mitch format by create_groups.reader.load_groups(), "
+            "or memory mapped for random access by create_groups.reader.GroupsFileReader")
+
+    parser.add_argument("--sweep_location", type=file_path, required=False,
+            help="Path of a JSON sweep file with a list of configs, i.e. "
+            "'[{\"out_location\": \"/path/to/groups_seed_1.json\", \"seed\": 1}, "
+            "{\"out_location\": \"/path/to/groups_cap.json\", \"balance_patches\": \"group=1000\"}]'. "
+            "The patches are scanned and parsed once and groups are written for every config. "
+            "A config can set out_location, out_format, seed, legacy_shuffle, n_groups, subtypes, "
+            "is_binary, balance_patches, min_patches, max_patches and max_patient_patches; "
+            "other options are the same for every config. --out_location is not written.")
+
+    parser.add_argument("--sweep_workers", type=int, default=default_sweep_workers,
+            help="The number of processes used to generate the groups of the configs of a sweep.")
+
+    parser.add_argument("--update_from", type=file_path, required=False,
+            help="Path of an existing groups file (i.e. /path/to/patient_groups.json) to update "
+            "with new patients and slides. Patients in the file keep their group and new patients "
+            "are put in the groups with the fewest patients of their origin relative to an even "
+            "split. A group is written as it is in the file only if the file was generated with the "
+            "same group options, which are read from its options file (i.e. "
+            "/path/to/patient_groups.options.json), and the recomputed group has the same number of "
+            "patches in every directory after balancing; the other groups are recomputed. Every "
+            "group is still computed from the whole cohort, so this takes as long as a new run and "
+            "only keeps the patient groups and the contents of the unchanged groups. The options file "
+            "is written with --write_options or --update_from. n_groups must be the same as in the file.")
+
+    parser.add_argument("--write_options", action='store_true',
+            help="Whether to write the options that the groups depend on to a JSON file next to "
+            "out_location, i.e. /path/to/patient_groups.options.json for "
+            "/path/to/patient_groups.json, so that the groups file can be updated with "
+            "--update_from. The options file is always written with --update_from.")
+
+    parser.add_argument("--out_of_core", action='store_true',
+            help="Whether to spill the patch paths to partition files on disk instead of holding "
+            "them in memory. Only the directories of the patches and the indices of the selected "
+            "patches are kept in memory. Gives the same groups as without --out_of_core.")
+
+    parser.add_argument("--spill_location", type=dir_path, required=False,
+            help="Directory to create the temporary partition files of --out_of_core in. "
+            "By default the partition files are created next to out_location.")
+
+    parser.add_argument("--memory_budget", type=int, default=default_memory_budget,
+            help="The memory in MB used to buffer patch paths before they are written to the "
+            "partition files of --out_of_core.")
+
+    parser.add_argument("--write_metrics", action='store_true',
+            help="Whether to write the wall time, CPU time, item counts and throughput of every "
+            "stage of the run to a JSON file next to out_location, i.e. "
+            "/path/to/patient_groups.metrics.json for /path/to/patient_groups.json. "
+            "The stages are logged whether or not this flag is set.")
+
+    parser.add_argument("--trace_memory", action='store_true',
+            help="Whether to trace the memory of every stage of the run with tracemalloc and by "
+            "sampling the resident set size. The peak and retained memory of every stage and the "
+            "source lines that allocated the most memory in it are logged and written with "
+            "--write_metrics, i.e. to size the --mem of Slurm jobs. Slows down the run.")
+
     parser.add_argument("--min_patches", type=int, required=False,
             help="Only include from slides that have at least min_patches number of patches")
 
@@ -168,6 +237,26 @@ def create_parser(parser):
             "'/patch_location/patch_pattern/x_y.png'. See --patch_pattern below. An example is "
             "'/projects/ovcare/classification/cchen/ml/data/local_ec_100/patches_256_sorted'")
 
+    parser_manifest.add_argument("--scan_workers", type=int, default=default_scan_workers,
+            help="The number of threads used to list the directories in patch_location. "
+            "Every slide directory is listed in a separate task.")
+
+    parser_manifest.add_argument("--scan_in_flight", type=int, default=default_scan_in_flight,
+            help="The number of directory listings kept in flight by an asyncio event loop. If set, "
+            "every directory is listed as soon as its parent is instead of one slide directory per "
+            "task of --scan_workers threads, which hides the latency of listings on network "
+            "filesystems like GPFS and NFS for wide trees with thousands of slide directories. "
+            "I.e. 64. The achieved listings per second are logged. By default the threads of "
+            "--scan_workers are used.")
+
+    parser_manifest.add_argument("--scan_cache", action='store_true',
+            help="Whether to cache the directory listings of patch_location in a scan index "
+            "keyed by directory mtimes. On later runs only the directories that changed are listed again.")
+
+    parser_manifest.add_argument("--scan_cache_location", type=dir_path, required=False,
+            help="Directory to save the scan index in. By default the scan index is saved "
+            "next to patch_location as .<patch_location name>.scan_index.json")
+
     help_hd5 = """Use hd5 files"""
     parser_hd5 = subparsers_load.add_parser("use-hd5",
             help=help_hd5)
@@ -175,7 +264,47 @@ def create_parser(parser):
     parser_hd5.add_argument("--hd5_location", type=dir_path, required=True,
             help="root directory of all hd5 of a study.")
 
-    subparsers_load_list = [parser_manifest, parser_hd5]
+    parser_hd5.add_argument("--hd5_workers", type=int, default=default_hd5_workers,
+            help="The number of processes used to read the hd5 files. Every hd5 file is read in a separate task.")
+
+    parser_hd5.add_argument("--hd5_chunk_size", type=int, default=default_hd5_chunk_size,
+            help="The number of paths read from the paths dataset of a hd5 file at a time.")
+
+    help_scan_shard = """List one shard of the patches in patch_location to a shard file at out_location, which must end in .npz.
+    Slide directories are split into n_shards shards by a hash of their path, so the shards can be
+    listed by separate jobs (i.e. the tasks of a Slurm array) and merged by use-scan-shards"""
+    parser_scan_shard = subparsers_load.add_parser("scan-shard",
+            help=help_scan_shard)
+
+    parser_scan_shard.add_argument("--patch_location", type=dir_path, required=True,
+            help="root directory of all patches of a study. The patch directory structure is "
+            "'/patch_location/patch_pattern/x_y.png'. See --patch_pattern below.")
+
+    parser_scan_shard.add_argument("--shard_index", type=int, required=True,
+            help="The shard to list, from 0 to n_shards - 1. "
+            "I.e. $SLURM_ARRAY_TASK_ID of a job submitted with --array=0-<n_shards - 1>")
+
+    parser_scan_shard.add_argument("--n_shards", type=int, required=True,
+            help="The number of shards patch_location is split into.")
+
+    parser_scan_shard.add_argument("--scan_workers", type=int, default=default_scan_workers,
+            help="The number of threads used to list the directories in the shard. "
+            "Every slide directory is listed in a separate task.")
+
+    parser_scan_shard.add_argument("--scan_in_flight", type=int, default=default_scan_in_flight,
+            help="The number of directory listings kept in flight by an asyncio event loop. "
+            "See --scan_in_flight of use-extracted-patches.")
+
+    help_scan_shards = """Use the listing of patch_location merged from the shard files of scan-shard"""
+    parser_scan_shards = subparsers_load.add_parser("use-scan-shards",
+            help=help_scan_shards)
+
+    parser_scan_shards.add_argument("--shard_location", type=dir_path, required=True,
+            help="Directory of the shard files written by scan-shard. It must contain the "
+            "*.npz shard files of every shard of a single scan and no other *.npz files. "
+            "The patch_pattern and filter_labels must be the same as the ones of scan-shard.")
+
+    subparsers_load_list = [parser_manifest, parser_hd5, parser_scan_shards]
 
     for subparser in subparsers_load_list:
         help_subparsers_define = """Specify how to define patient ID and slide ID:
@@ -194,6 +323,13 @@ def create_parser(parser):
                 help=help_manifest_)
         parser_manifest_.add_argument("--manifest_location", type=file_path, required=True,
                 help="Path to manifest CSV file.")
+        parser_manifest_.add_argument("--manifest_cache", action='store_true',
+                help="Whether to cache the manifest indexed by slide ID in a manifest index "
+                "keyed by the SHA-256 of the manifest file. On later runs the manifest CSV file "
+                "is only parsed again if it changed.")
+        parser_manifest_.add_argument("--manifest_cache_location", type=dir_path, required=False,
+                help="Directory to save the manifest index in. By default the manifest index is saved "
+                "next to manifest_location as .<manifest_location name>.manifest_index.json")
 
         help_origin = """Use origin for detecting patient ID and slide ID.
         NOTE: It only works for German, OVCARE, and TCGA."""
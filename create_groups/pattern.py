@@ -0,0 +1,57 @@
+"""Parsing of patch paths by patch_pattern
+"""
+
+class PatchPatternParser(object):
+    """Splits patch paths into the words of a patch_pattern.
+
+    The patch_pattern is compiled once into the order of the words, and a batch of paths is
+    split with one str.rsplit per path into columns instead of parsing every word separately.
+    The paths are still split one at a time, so callers parse every directory once rather
+    than every patch path, as PatchTable.parse_directories() does.
+
+    Attributes
+    ----------
+    words : list of str
+        The words of the patch_pattern in the order of the directories
+    """
+
+    def __init__(self, patch_pattern):
+        self.words = [word for word, _ in sorted(patch_pattern.items(),
+                key=lambda x: x[1])]
+
+    def split(self, patch_path):
+        """Split patch_path into root, the values of the words and the file name.
+
+        Returns
+        -------
+        list of str
+            [root, value of each word, file name] or None if patch_path has too few directories
+        """
+        parts = patch_path.rsplit('/', len(self.words) + 1)
+        if len(parts) != len(self.words) + 2:
+            return None
+        return parts
+
+    def parse(self, patch_paths):
+        """Parse a batch of patch paths into columns.
+
+        Every patch path is split with one str.rsplit, and the parts are transposed into one list
+        per word, so no dict is built per patch path.
+
+        Parameters
+        ----------
+        patch_paths : list of str
+            The patch paths, or directories ending with '/' in which case the file names are ''
+
+        Returns
+        -------
+        dict of list
+            {word: [value of each patch path]} with the keys 'root' and 'name' for the root
+            directory and the file name. The values of a patch path with too few directories are None
+        """
+        keys = ['root'] + self.words + ['name']
+        missing = [None] * len(keys)
+        rows = [missing if parts is None else parts for parts in map(self.split, patch_paths)]
+        if not rows:
+            return {key: [] for key in keys}
+        return {key: list(column) for key, column in zip(keys, zip(*rows))}
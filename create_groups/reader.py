@@ -0,0 +1,266 @@
+"""Reading of groups files
+"""
+import json
+import mmap
+import zipfile
+import collections.abc
+
+import numpy as np
+
+from create_groups.hd5 import open_h5
+from create_groups.writer import groups_file_version
+
+def decode_strings(data, offsets, indices=None):
+    """Get strings from the bytes and offsets created by writer.encode_strings()
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        The bytes of the strings
+
+    offsets : numpy.ndarray
+        The offsets of the strings in the bytes
+
+    indices : array-like of int
+        The indices of the strings to get. Gets all strings if not set.
+
+    Returns
+    -------
+    list of str
+    """
+    data = memoryview(np.ascontiguousarray(data, dtype=np.uint8))
+    if indices is None:
+        indices = range(len(offsets) - 1)
+    starts = np.asarray(offsets)[indices].tolist()
+    ends = np.asarray(offsets)[np.asarray(indices, dtype=np.int64) + 1].tolist()
+    return [str(data[start:end], 'utf-8') for start, end in zip(starts, ends)]
+
+def decode_paths(arrays, directories, extensions, rows):
+    """Get the patch paths of rows of the path table created by writer.create_path_table()
+
+    Parameters
+    ----------
+    arrays : dict of numpy.ndarray
+        The arrays of the groups file
+
+    directories : list of str
+        The decoded directories of the path table
+
+    extensions : list of str
+        The decoded extensions of the path table
+
+    rows : array-like of int
+        The rows of the path table
+
+    Returns
+    -------
+    list of str
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    path_name = arrays['path_name'][rows]
+    names = iter(decode_strings(arrays['names'], arrays['name_offsets'], path_name[path_name >= 0]))
+    patch_paths = []
+    for directory, x, y, extension, name in zip(arrays['path_directory'][rows].tolist(),
+            arrays['path_x'][rows].tolist(), arrays['path_y'][rows].tolist(),
+            arrays['path_extension'][rows].tolist(), path_name.tolist()):
+        if name >= 0:
+            patch_paths.append(directories[directory] + next(names))
+        else:
+            patch_paths.append(f"{directories[directory]}{x}_{y}{extensions[extension]}")
+    return patch_paths
+
+def check_version(path, arrays):
+    """Raise ValueError if the binary groups file at path is not of groups_file_version"""
+    version = int(arrays['version'])
+    if version != groups_file_version:
+        raise ValueError(f"Groups file {path} has version {version}, expected {groups_file_version}")
+
+def get_out_format(path):
+    """Get the format of a groups file from its first bytes"""
+    with open(path, 'rb') as f:
+        signature = f.read(8)
+    if signature == b'\x89HDF\r\n\x1a\n':
+        return 'hdf5'
+    elif signature[:4] == b'PK\x03\x04':
+        return 'npz'
+    return 'json'
+
+def read_arrays(path, out_format):
+    """Read all arrays of a binary groups file"""
+    if out_format == 'hdf5':
+        with open_h5(path, 'r') as f:
+            return {key: f[key][()] for key in f.keys()}
+    elif out_format == 'npz':
+        with np.load(path) as f:
+            return {key: f[key] for key in f.files}
+    else:
+        raise NotImplementedError(f"Out format {out_format} is not implemented.")
+
+def load_groups(path):
+    """Load a groups file written in any of OUT_FORMATS as groups in Mitch format.
+
+    Parameters
+    ----------
+    path : str
+        Path of the groups file
+
+    Returns
+    -------
+    dict
+        Groups in Mitch format, the same as json.load() of the JSON groups file
+    """
+    out_format = get_out_format(path)
+    if out_format == 'json':
+        with open(path) as f:
+            return json.load(f)
+    arrays = read_arrays(path, out_format)
+    check_version(path, arrays)
+    directories = decode_strings(arrays['directories'], arrays['directory_offsets'])
+    extensions = decode_strings(arrays['extensions'], arrays['extension_offsets'])
+    chunks = []
+    for chunk_id, (start, end) in zip(arrays['chunk_ids'].tolist(), arrays['chunk_bounds'].tolist()):
+        chunks.append({'id': chunk_id, 'imgs': decode_paths(arrays, directories, extensions,
+                np.arange(start, end))})
+    return {'chunks': chunks}
+
+def get_npz_array_offsets(path):
+    """Get the offset, dtype and shape of every array of an uncompressed NPZ file.
+
+    Returns
+    -------
+    dict of (int, numpy.dtype, tuple)
+        {key: (offset of the array data in the file, dtype, shape)}
+    """
+    array_offsets = {}
+    with open(path, 'rb') as f, zipfile.ZipFile(f) as zf:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"Array {info.filename} in {path} is compressed and can not be memory mapped")
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_length = int.from_bytes(local_header[26:28], 'little')
+            extra_length = int.from_bytes(local_header[28:30], 'little')
+            data_offset = info.header_offset + 30 + name_length + extra_length
+            with zf.open(info) as array_file:
+                version = np.lib.format.read_magic(array_file)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(array_file)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(array_file)
+                array_offsets[info.filename[:-len('.npy')]] = (data_offset + array_file.tell(),
+                        dtype, shape)
+    return array_offsets
+
+def get_hdf5_array_offsets(path):
+    """Get the offset, dtype and shape of every dataset of a HDF5 file with contiguous datasets.
+
+    Returns
+    -------
+    dict of (int, numpy.dtype, tuple)
+        {key: (offset of the dataset data in the file, dtype, shape)}
+    """
+    array_offsets = {}
+    with open_h5(path, 'r') as f:
+        for key, dataset in f.items():
+            offset = dataset.id.get_offset()
+            if offset is None and dataset.size > 0:
+                raise ValueError(f"Dataset {key} in {path} is not contiguous and can not be memory mapped")
+            array_offsets[key] = (offset or 0, dataset.dtype, dataset.shape)
+    return array_offsets
+
+class GroupsFileReader(collections.abc.Mapping):
+    """Random access reader of the groups in a binary groups file written with --out_format hdf5 or npz.
+
+    The file is memory mapped and the arrays of the path table are read in place, so opening the
+    file does not load or parse the paths. A patch path is only decoded when it is accessed.
+    Forked worker processes share the mapped pages of the file, and a pickled reader maps the file
+    again when unpickled.
+
+    The reader is a mapping of chunk id to a MappedGroup, i.e. reader[0][10] is the 11th patch path of the chunk with id 0.
+
+    Attributes
+    ----------
+    path : str
+        Path of the groups file
+
+    directories : list of str
+        The directories of the patch paths
+
+    extensions : list of str
+        The extensions of the file names of the form x_y.png
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.open()
+
+    def open(self):
+        out_format = get_out_format(self.path)
+        if out_format == 'npz':
+            array_offsets = get_npz_array_offsets(self.path)
+        elif out_format == 'hdf5':
+            array_offsets = get_hdf5_array_offsets(self.path)
+        else:
+            raise NotImplementedError(f"Out format {out_format} can not be memory mapped.")
+        with open(self.path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.arrays = {}
+        for key, (offset, dtype, shape) in array_offsets.items():
+            self.arrays[key] = np.ndarray(shape, dtype=dtype, buffer=self.mmap, offset=offset)
+        check_version(self.path, self.arrays)
+        self.directories = decode_strings(self.arrays['directories'],
+                self.arrays['directory_offsets'])
+        self.extensions = decode_strings(self.arrays['extensions'],
+                self.arrays['extension_offsets'])
+        self.chunk_idx = {chunk_id: chunk_idx \
+                for chunk_idx, chunk_id in enumerate(self.arrays['chunk_ids'].tolist())}
+
+    def close(self):
+        self.arrays = {}
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.open()
+
+    def __len__(self):
+        return len(self.chunk_idx)
+
+    def __iter__(self):
+        return iter(self.chunk_idx)
+
+    def __getitem__(self, chunk_id):
+        start, end = self.arrays['chunk_bounds'][self.chunk_idx[chunk_id]].tolist()
+        return MappedGroup(self, range(start, end))
+
+    def get_paths(self, indices):
+        """Decode the patch paths of indices into the path table"""
+        return decode_paths(self.arrays, self.directories, self.extensions, indices)
+
+    def to_mitch_format(self):
+        """Get all groups in Mitch format, the same as load_groups()"""
+        return {'chunks': [{'id': chunk_id, 'imgs': self[chunk_id][:]} for chunk_id in self]}
+
+class MappedGroup(collections.abc.Sequence):
+    """Lazy sequence of the patch paths of a group in a GroupsFileReader"""
+
+    def __init__(self, reader, indices):
+        self.reader = reader
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.reader.get_paths(self.indices[idx])
+        return self.reader.get_paths([self.indices[idx]])[0]
@@ -0,0 +1,203 @@
+"""Reproducible shuffling of patches
+"""
+import random
+import hashlib
+import concurrent.futures
+
+import numpy as np
+
+from create_groups.defaults import default_shuffle_workers
+
+
+def get_key_entropy(key):
+    """Get a stable 64-bit integer from a key. Python's hash() is salted per process so it is not used."""
+    return int.from_bytes(hashlib.sha256(repr(key).encode('utf-8')).digest()[:8], 'little')
+
+def sample_permutation_prefix(generator, n, k):
+    """Draw the first k items of a random permutation of range(n) by a partial Fisher-Yates shuffle.
+
+    Only the k swaps of the prefix are done, and the swapped positions are kept in a dict, so the
+    time and memory are O(k) instead of O(n).
+
+    Returns
+    -------
+    list of int
+        The first k items of the permutation
+    """
+    picks = generator.integers(np.arange(k), n).tolist()
+    displaced = {}
+    prefix = []
+    for idx, pick in enumerate(picks):
+        prefix.append(displaced.get(pick, pick))
+        displaced[pick] = displaced.get(idx, idx)
+    return prefix
+
+class RandomStreams(object):
+    """Shuffles lists either with the global random module seeded before every shuffle, or with an
+    independent NumPy Generator for every (stage, key).
+
+    The Generator of a (stage, key) is derived from a SeedSequence on the seed so it does not
+    depend on which other lists are shuffled, or in which order. Lists can then be shuffled in a
+    thread pool and give the same output whatever the number of workers.
+
+    Attributes
+    ----------
+    seed : int
+        The seed of all shuffles
+
+    is_legacy : bool
+        Whether to seed the random module before shuffles. Gives the same order as when every
+        shuffle is preceded by random.seed(seed)
+
+    workers : int
+        The number of threads used to shuffle lists
+    """
+
+    def __init__(self, seed, is_legacy=False, workers=default_shuffle_workers):
+        self.seed = seed
+        self.is_legacy = is_legacy
+        self.workers = workers
+
+    def get_generator(self, stage, key):
+        """Get the Generator of a (stage, key)
+
+        Parameters
+        ----------
+        stage : str
+            The name of the step that shuffles, i.e. 'slide'
+
+        key : hashable
+            The key of the list in the stage, i.e. (subtype, patient, slide)
+
+        Returns
+        -------
+        numpy.random.Generator
+        """
+        seed_sequence = np.random.SeedSequence(self.seed,
+                spawn_key=(get_key_entropy(stage), get_key_entropy(key)))
+        return np.random.default_rng(seed_sequence)
+
+    def shuffle_with_generator(self, items, stage, key):
+        permutation = self.get_generator(stage, key).permutation(len(items))
+        if isinstance(items, np.ndarray):
+            items[:] = items[permutation]
+        else:
+            items[:] = [items[idx] for idx in permutation.tolist()]
+
+    def sample_with_generator(self, items, stage, key, count):
+        if count >= len(items):
+            self.shuffle_with_generator(items, stage, key)
+        else:
+            prefix = sample_permutation_prefix(self.get_generator(stage, key),
+                    len(items), max(0, count))
+            items[:] = [items[idx] for idx in prefix]
+
+    def sample_positions_with_generator(self, stage, key, size, count):
+        generator = self.get_generator(stage, key)
+        if count >= size:
+            return generator.permutation(size)
+        return np.array(sample_permutation_prefix(generator, size, max(0, count)), dtype=np.int64)
+
+    def map_with_workers(self, fn, args_list):
+        """Call fn on every args in a thread pool of self.workers threads"""
+        if self.workers > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(fn, *args) for args in args_list]
+                for future in futures:
+                    future.result()
+        else:
+            for args in args_list:
+                fn(*args)
+
+    def shuffle_each(self, stage, key_items):
+        """Shuffle lists in place. In legacy mode the random module is seeded before every list.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the step that shuffles
+
+        key_items : iterable of (hashable, list)
+            The key of each list and the list to shuffle
+        """
+        if self.is_legacy:
+            for _, items in key_items:
+                random.seed(self.seed)
+                random.shuffle(items)
+        else:
+            self.map_with_workers(self.shuffle_with_generator,
+                    [(items, stage, key) for key, items in key_items])
+
+    def sample_each(self, stage, key_items_counts):
+        """Shuffle lists in place, keeping only a random sample of count items of each list.
+
+        Lists with fewer than count items are fully shuffled. Otherwise only count items are drawn
+        by a partial Fisher-Yates shuffle and the list is replaced by them. In legacy mode every
+        list is fully shuffled and kept whole to give the same order as earlier versions.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the step that shuffles
+
+        key_items_counts : iterable of (hashable, list, int)
+            The key of each list, the list to shuffle and the number of items to keep
+        """
+        if self.is_legacy:
+            self.shuffle_each(stage, [(key, items) for key, items, _ in key_items_counts])
+        else:
+            self.map_with_workers(self.sample_with_generator,
+                    [(items, stage, key, count) for key, items, count in key_items_counts])
+
+    def sample_positions_each(self, stage, key_sizes_counts):
+        """Draw the positions that sample_each() keeps of lists, given only the number of items of each list.
+
+        The positions are drawn like sample_each() draws the items, so indexing a list by them gives
+        the same items in the same order. Only count positions of a list are drawn, and no list
+        of the positions of all items is built, except in legacy mode where the random module
+        shuffles every list whole.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the step that shuffles
+
+        key_sizes_counts : iterable of (hashable, int, int)
+            The key of each list, the number of items in it and the number of items to keep
+
+        Returns
+        -------
+        list of numpy.ndarray
+            The positions of the items kept of each list. In legacy mode the positions of all items are returned
+        """
+        key_sizes_counts = list(key_sizes_counts)
+        if self.is_legacy:
+            positions = [list(range(size)) for _, size, _ in key_sizes_counts]
+            self.shuffle_each(stage, [(key, key_positions) \
+                    for (key, _, _), key_positions in zip(key_sizes_counts, positions)])
+            return [np.array(key_positions, dtype=np.int64) for key_positions in positions]
+        positions = [None] * len(key_sizes_counts)
+        def sample_positions(idx, key, size, count):
+            positions[idx] = self.sample_positions_with_generator(stage, key, size, count)
+        self.map_with_workers(sample_positions, [(idx, key, size, count) \
+                for idx, (key, size, count) in enumerate(key_sizes_counts)])
+        return positions
+
+    def shuffle_sequence(self, stage, key_items):
+        """Shuffle lists in place. In legacy mode the random module is seeded once before the first list.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the step that shuffles
+
+        key_items : iterable of (hashable, list)
+            The key of each list and the list to shuffle
+        """
+        if self.is_legacy:
+            random.seed(self.seed)
+            for _, items in key_items:
+                random.shuffle(items)
+        else:
+            for key, items in key_items:
+                self.shuffle_with_generator(items, stage, key)
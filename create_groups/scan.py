@@ -0,0 +1,627 @@
+"""Directory scanning of patch trees laid out as /patch_location/patch_pattern/x_y.png
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import fnmatch
+import heapq
+import asyncio
+import threading
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from create_groups.defaults import (default_scan_workers, default_scan_in_flight)
+from create_groups.writer import (encode_strings, atomic_path)
+from create_groups.reader import decode_strings
+
+logger = logging.getLogger('create_groups')
+
+default_racy_mtime_window = 2.
+scan_shard_version = 1
+
+def has_magic(s):
+    return re.search(r'[*?[]', s) is not None
+
+def get_shard(path, n_shards):
+    """Get the shard of a directory from its path relative to patch_location.
+    The shard is the same in every process and on every node.
+    """
+    return int.from_bytes(hashlib.sha1(path.encode('utf-8')).digest()[:8], 'little') % n_shards
+
+def scandir(path):
+    """List directory path
+
+    Returns
+    -------
+    list of (str, bool)
+        List of entry names and whether the entry is a directory
+    """
+    try:
+        with os.scandir(path) as it:
+            return [(entry.name, entry.is_dir()) for entry in it]
+    except OSError:
+        return []
+
+class ComponentMatcher(object):
+    """Matches names in a directory against one component of a glob wildcard.
+
+    Follows the rules of glob.glob: literal components match by equality,
+    wildcard components do not match hidden names unless they start with '.'.
+    """
+
+    def __init__(self, component):
+        self.component = component
+        self.is_literal = not has_magic(component)
+        self.matches_hidden = component.startswith('.')
+        if not self.is_literal:
+            self.regex = re.compile(fnmatch.translate(os.path.normcase(component)))
+
+    def __call__(self, name):
+        if self.is_literal:
+            return name == self.component
+        if name.startswith('.') and not self.matches_hidden:
+            return False
+        return self.regex.match(os.path.normcase(name)) is not None
+
+class ScanIndex(object):
+    """On-disk cache of the directory listings of a patch_location, keyed by directory mtimes.
+
+    A directory is only listed again if its mtime changed since the listing was cached.
+    Listings of directories modified less than racy_mtime_window seconds before they were
+    listed are not cached since the mtime may not change on a later modification.
+
+    Attributes
+    ----------
+    path : str
+        Path of the cache file
+
+    patch_location : str
+        Absolute path of the root directory of the cached directories
+
+    directories : dict
+        The cached listings loaded from the cache file {path: [mtime_ns, [dir_name], [file_name]]}
+
+    updated_directories : dict
+        The listings used in the current scan in the same format as directories
+    """
+    version = 1
+
+    def __init__(self, path, patch_location,
+            racy_mtime_window=default_racy_mtime_window):
+        self.path = path
+        self.patch_location = os.path.abspath(patch_location)
+        self.racy_mtime_window = racy_mtime_window
+        self.directories = {}
+        self.updated_directories = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_default_path(cls, patch_location, cache_location=None):
+        """Get the path of the cache file of patch_location.
+        The cache file is put next to patch_location unless cache_location is set.
+        """
+        patch_location = os.path.abspath(patch_location)
+        if cache_location:
+            key = hashlib.sha1(patch_location.encode('utf-8')).hexdigest()[:16]
+            return os.path.join(cache_location, f"scan_index_{key}.json")
+        parent, name = os.path.split(patch_location)
+        return os.path.join(parent, f".{name}.scan_index.json")
+
+    @classmethod
+    def load(cls, path, patch_location, **kwargs):
+        """Load the cache file at path. Returns an empty index if the file does not exist or is for another patch_location.
+        """
+        index = cls(path, patch_location, **kwargs)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if data.get('version') == cls.version \
+                and data.get('patch_location') == index.patch_location:
+            index.directories = data['directories']
+        return index
+
+    def save(self):
+        """Write the index to the cache file.
+
+        Listings of directories not visited in the current scan are kept, except for directories removed from a visited parent.
+        """
+        directories = {}
+        for path, listing in self.directories.items():
+            if path in self.updated_directories:
+                continue
+            parent, name = os.path.split(path)
+            if parent in self.updated_directories \
+                    and name not in self.updated_directories[parent][1]:
+                continue
+            directories[path] = listing
+        directories.update(self.updated_directories)
+        data = {
+            'version': self.version,
+            'patch_location': self.patch_location,
+            'directories': directories,
+        }
+        with atomic_path(self.path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+
+    def list_directory(self, path, list_fn):
+        """List directory path, using the cached listing if the directory is unchanged.
+
+        Parameters
+        ----------
+        path : str
+            The path to the directory
+
+        list_fn : function
+            Function that lists a directory as a list of (name, is_dir)
+
+        Returns
+        -------
+        list of (str, bool)
+            List of entry names and whether the entry is a directory
+        """
+        key = os.path.abspath(path)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return []
+        cached = self.directories.get(key)
+        if cached is not None and cached[0] == mtime_ns:
+            with self.lock:
+                self.hits += 1
+                self.updated_directories[key] = cached
+            return [(name, True) for name in cached[1]] \
+                    + [(name, False) for name in cached[2]]
+        entries = list_fn(path)
+        with self.lock:
+            self.misses += 1
+            if time.time() - mtime_ns / 1e9 > self.racy_mtime_window:
+                self.updated_directories[key] = [mtime_ns,
+                        [name for name, is_dir in entries if is_dir],
+                        [name for name, is_dir in entries if not is_dir]]
+        return entries
+
+class PatchDirectoryScanner(object):
+    """Lists the patches in patch_location matching a set of glob wildcards using os.scandir.
+
+    The wildcards are the same as the ones passed to glob.glob, so every wildcard has one
+    component per word in patch_pattern followed by a wildcard for the patch file name.
+    Directories are pruned as soon as they stop matching all wildcards, and the subtrees below
+    split_level are listed concurrently in a thread pool.
+
+    If in_flight is set, directories are listed by an asyncio event loop that keeps up to in_flight
+    listings in flight in a bounded executor. Every directory is listed as soon as its parent is,
+    including the directories inside the subtrees, which hides the latency of network filesystems
+    where each listing is a slow round trip but the server handles many listings in parallel.
+
+    Attributes
+    ----------
+    patch_location : str
+        root directory of all patches of a study
+
+    components : list of (list of ComponentMatcher)
+        The components of each wildcard relative to patch_location
+
+    workers : int
+        The number of threads used to list directories
+
+    in_flight : int
+        The number of directory listings kept in flight by the asyncio event loop, or 0 to list
+        every subtree below split_level in one task of the thread pool of workers threads
+
+    split_level : int
+        The depth of the directories that each are listed in their own task (i.e. the slide directories)
+
+    index : ScanIndex
+        Optional cache of directory listings
+
+    n_listings : int
+        The number of directories listed by the last scan
+
+    max_listings_in_flight : int
+        The largest number of directories listed at the same time by the last scan
+
+    scan_seconds : float
+        The wall time of the last scan, including the time the caller spent between the yielded directories
+    """
+
+    def __init__(self, patch_location, wildcards, workers=default_scan_workers,
+            split_level=0, index=None, in_flight=default_scan_in_flight):
+        self.patch_location = patch_location
+        self.index = index
+        prefix = os.path.join(patch_location, '')
+        self.components = []
+        for wildcard in dict.fromkeys(wildcards):
+            if not wildcard.startswith(prefix):
+                raise ValueError(f"Wildcard {wildcard} is not in patch_location {patch_location}")
+            self.components.append([ComponentMatcher(c)
+                    for c in wildcard[len(prefix):].split(os.sep)])
+        self.depth = len(self.components[0]) - 1 if self.components else 0
+        self.workers = max(1, workers)
+        self.in_flight = max(0, in_flight)
+        self.split_level = min(split_level, self.depth)
+        self.n_listings = 0
+        self.listings_in_flight = 0
+        self.max_listings_in_flight = 0
+        self.scan_seconds = 0.
+        self.lock = threading.Lock()
+
+    def list_directory(self, path):
+        """List directory path, using the index if there is one.
+
+        Returns
+        -------
+        list of (str, bool)
+            List of entry names and whether the entry is a directory
+        """
+        with self.lock:
+            self.listings_in_flight += 1
+            self.max_listings_in_flight = max(self.max_listings_in_flight,
+                    self.listings_in_flight)
+        try:
+            if self.index is not None:
+                return self.index.list_directory(path, scandir)
+            return scandir(path)
+        finally:
+            with self.lock:
+                self.listings_in_flight -= 1
+                self.n_listings += 1
+
+    def get_listing_rate(self):
+        """Get the number of directories listed per second of wall time by the last scan"""
+        if self.scan_seconds <= 0:
+            return 0.
+        return self.n_listings / self.scan_seconds
+
+    def match_entries(self, entries, level, alive):
+        """Get the entries of a directory that match the wildcards at the given level
+
+        Parameters
+        ----------
+        entries : list of (str, bool)
+            The entry names of the directory and whether each entry is a directory, from list_directory()
+
+        level : int
+            The depth of the directory below patch_location
+
+        alive : tuple of int
+            The indices of the wildcards the directory matches
+
+        Returns
+        -------
+        list of (str, tuple of int)
+            List of entry names and the indices of the wildcards each entry matches
+        """
+        is_leaf = level == self.depth
+        matched = []
+        for name, is_dir in entries:
+            if not (is_leaf or is_dir):
+                continue
+            name_alive = tuple(w for w in alive if self.components[w][level](name))
+            if name_alive:
+                matched.append((name, name_alive))
+        return matched
+
+    def match(self, path, level, alive):
+        """List the entries of a directory that match the wildcards at the given level.
+        The arguments and the return value are the same as match_entries() without the entries.
+        """
+        return self.match_entries(self.list_directory(path), level, alive)
+
+    def expand(self, node):
+        """Get the child directories of a directory node that match the wildcards.
+        A node is a tuple (path, level, alive) of the arguments to match()
+        """
+        path, level, alive = node
+        return [(os.path.join(path, name), level + 1, name_alive)
+                for name, name_alive in self.match(path, level, alive)]
+
+    def walk(self, node):
+        """Walk the subtree of a directory node
+
+        Returns
+        -------
+        list of (str, list of str)
+            List of leaf directories and the names of the patches in them
+        """
+        path, level, alive = node
+        if level == self.depth:
+            names = [name for name, _ in self.match(path, level, alive)]
+            return [(path, names)] if names else []
+        leaves = []
+        for child in self.expand(node):
+            leaves.extend(self.walk(child))
+        return leaves
+
+    async def walk_async(self, node, list_fn):
+        """Walk the subtree of a directory node like walk(), listing the child directories of
+        every directory concurrently.
+
+        Parameters
+        ----------
+        list_fn : coroutine function
+            Lists a directory like list_directory()
+        """
+        path, level, alive = node
+        matched = self.match_entries(await list_fn(path), level, alive)
+        if level == self.depth:
+            names = [name for name, _ in matched]
+            return [(path, names)] if names else []
+        children = [(os.path.join(path, name), level + 1, name_alive)
+                for name, name_alive in matched]
+        leaves = []
+        for child_leaves in await asyncio.gather(
+                *[self.walk_async(child, list_fn) for child in children]):
+            leaves.extend(child_leaves)
+        return leaves
+
+    async def expand_async(self, frontier, list_fn):
+        """Get the child directories of every directory node in frontier like expand(), listing them concurrently"""
+        children = await asyncio.gather(*[list_fn(path) for path, _, _ in frontier])
+        return [(os.path.join(path, name), level + 1, name_alive)
+                for (path, level, alive), entries in zip(frontier, children)
+                for name, name_alive in self.match_entries(entries, level, alive)]
+
+    def select_subtrees(self, frontier, shard_index, n_shards):
+        """Get the directory nodes at split_level in the shard shard_index, sorted so that
+        every leaf of a subtree sorts before the leaves of the next subtree
+        """
+        if n_shards > 1:
+            prefix = os.path.join(self.patch_location, '')
+            frontier = [node for node in frontier
+                    if get_shard(node[0][len(prefix):], n_shards) == shard_index]
+        return sorted(frontier, key=lambda node: node[0] + os.sep)
+
+    def iter_scan(self, shard_index=0, n_shards=1):
+        """Scan patch_location, yielding the leaf directories one subtree at a time.
+
+        The subtrees below split_level are listed with at most 2 * workers subtrees (or 2 * in_flight
+        subtrees if in_flight is set) listed ahead of the one being yielded, so the listing of the
+        whole patch_location is never held in memory. The number of listings and the listings per
+        second are logged when the scan ends.
+
+        Parameters
+        ----------
+        shard_index : int
+            The shard of the subtrees to list
+
+        n_shards : int
+            The number of shards. Every subtree below split_level is in the shard given by get_shard()
+            of its path, so the shards of n_shards scans together list all of patch_location
+
+        Yields
+        ------
+        (str, list of str)
+            A leaf directory and the sorted names of the patches in it, in the order of scan()
+        """
+        if not self.components:
+            return
+        self.n_listings = 0
+        self.max_listings_in_flight = 0
+        start = time.perf_counter()
+        if self.in_flight > 0:
+            yield from self.iter_scan_async(shard_index, n_shards)
+        else:
+            yield from self.iter_scan_threads(shard_index, n_shards)
+        self.scan_seconds = time.perf_counter() - start
+        logger.info(f"Listed {self.n_listings} directories in {self.scan_seconds:.3f}s "
+                f"({self.get_listing_rate():.1f} listings/s, "
+                f"at most {self.max_listings_in_flight} in flight)")
+
+    def iter_scan_threads(self, shard_index=0, n_shards=1):
+        """Scan patch_location like iter_scan(), walking every subtree below split_level in a task of a thread pool"""
+        root = (self.patch_location, 0, tuple(range(len(self.components))))
+        frontier = [root]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            map_fn = executor.map if self.workers > 1 else map
+            for _ in range(self.split_level):
+                frontier = [c for children in map_fn(self.expand, frontier)
+                        for c in children]
+            pending = collections.deque()
+            for node in self.select_subtrees(frontier, shard_index, n_shards):
+                pending.append(executor.submit(self.walk, node))
+                if len(pending) >= 2 * self.workers:
+                    yield from self.sort_subtree(pending.popleft().result())
+            while pending:
+                yield from self.sort_subtree(pending.popleft().result())
+
+    def iter_scan_async(self, shard_index=0, n_shards=1):
+        """Scan patch_location like iter_scan(), listing up to in_flight directories at the same time.
+
+        The event loop runs in its own thread so the listings stay in flight while the caller
+        processes the yielded directories. The listings are run in a thread pool of in_flight threads.
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.in_flight)
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        async def list_fn(path):
+            return await loop.run_in_executor(executor, self.list_directory, path)
+
+        def submit(coroutine):
+            return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+        async def cancel_tasks():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        pending = collections.deque()
+        try:
+            frontier = [(self.patch_location, 0, tuple(range(len(self.components))))]
+            for _ in range(self.split_level):
+                frontier = submit(self.expand_async(frontier, list_fn)).result()
+            for node in self.select_subtrees(frontier, shard_index, n_shards):
+                pending.append(submit(self.walk_async(node, list_fn)))
+                if len(pending) >= 2 * self.in_flight:
+                    yield from self.sort_subtree(pending.popleft().result())
+            while pending:
+                yield from self.sort_subtree(pending.popleft().result())
+        finally:
+            # the scan is stopped early if the caller closes the generator or a listing raises
+            submit(cancel_tasks()).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def sort_subtree(self, leaves):
+        for _, names in leaves:
+            names.sort()
+        leaves.sort(key=lambda leaf: leaf[0] + os.sep)
+        return leaves
+
+    def scan(self):
+        """Scan patch_location
+
+        Returns
+        -------
+        list of (str, list of str)
+            List of leaf directories and the sorted names of the patches in them.
+            The directories are ordered so that joining each directory with its names gives
+            the sorted list of patch paths.
+        """
+        return list(self.iter_scan())
+
+def get_split_level(patch_pattern):
+    """Get the depth of the directories to list in separate tasks.
+
+    Tasks are split at the slide directories so that every task lists one slide. If there is
+    no slide in the patch_pattern then tasks are split at the first level.
+    """
+    if 'slide' in patch_pattern:
+        return patch_pattern['slide'] + 1
+    return 1
+
+def write_scan_shard(path, leaves, patch_location, wildcards, shard_index, n_shards):
+    """Write the leaf directories listed in a shard of a scan to an uncompressed NPZ file.
+
+    The directories and the patch names are stored as UTF-8 byte arrays with offsets, together with
+    the patch_location and wildcards of the scan so that merge_scan_shards() can check the shards
+    belong to the same scan. A relative patch_location is made absolute, together with the wildcards
+    and directories below it, so that shards listed from different working directories merge.
+    The file is written atomically with create_groups.writer.atomic_path().
+
+    Parameters
+    ----------
+    path : str
+        Path of the shard file
+
+    leaves : list of (str, list of str)
+        The leaf directories and the names of the patches in them from PatchDirectoryScanner.iter_scan()
+
+    patch_location : str
+        The patch_location of the scan
+
+    wildcards : list of str
+        The wildcards of the scan
+
+    shard_index : int
+        The shard of the scan
+
+    n_shards : int
+        The number of shards of the scan
+    """
+    abs_patch_location = os.path.abspath(patch_location)
+    if abs_patch_location != patch_location:
+        # the wildcards and directories are paths below patch_location
+        to_abs = lambda path: os.path.join(abs_patch_location,
+                path[len(patch_location):].lstrip(os.sep))
+        wildcards = [to_abs(wildcard) for wildcard in wildcards]
+        leaves = [(to_abs(directory), names) for directory, names in leaves]
+        patch_location = abs_patch_location
+    arrays = {}
+    arrays['version'] = np.array(scan_shard_version, dtype=np.int64)
+    arrays['shard_index'] = np.array(shard_index, dtype=np.int64)
+    arrays['n_shards'] = np.array(n_shards, dtype=np.int64)
+    arrays['patch_location'], _ = encode_strings([patch_location])
+    arrays['wildcards'], arrays['wildcard_offsets'] = encode_strings(wildcards)
+    arrays['directories'], arrays['directory_offsets'] = encode_strings(
+            [directory for directory, _ in leaves])
+    arrays['name_counts'] = np.array([len(names) for _, names in leaves], dtype=np.int64)
+    arrays['names'], arrays['name_offsets'] = encode_strings(
+            [name for _, names in leaves for name in names])
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+
+def read_scan_shard(path):
+    """Read a shard file written by write_scan_shard()
+
+    Returns
+    -------
+    dict
+        The 'patch_location', 'wildcards', 'shard_index' and 'n_shards' of the shard and
+        the 'leaves' listed in the shard as a list of (str, list of str)
+    """
+    with np.load(path) as f:
+        arrays = {key: f[key] for key in f.files}
+    if int(arrays['version']) != scan_shard_version:
+        raise ValueError(f"Scan shard {path} has version {int(arrays['version'])}, expected {scan_shard_version}")
+    directories = decode_strings(arrays['directories'], arrays['directory_offsets'])
+    names = decode_strings(arrays['names'], arrays['name_offsets'])
+    ends = np.cumsum(arrays['name_counts']).tolist()
+    starts = [0] + ends[:-1]
+    return {
+        'patch_location': str(arrays['patch_location'].tobytes(), 'utf-8'),
+        'wildcards': decode_strings(arrays['wildcards'], arrays['wildcard_offsets']),
+        'shard_index': int(arrays['shard_index']),
+        'n_shards': int(arrays['n_shards']),
+        'leaves': [(directory, names[start:end]) for directory, start, end \
+                in zip(directories, starts, ends)],
+    }
+
+def merge_scan_shards(paths):
+    """Merge the shard files of a scan into the listing of the whole scan.
+
+    Parameters
+    ----------
+    paths : list of str
+        Paths of the shard files. There must be exactly one shard file for every shard of the scan
+
+    Returns
+    -------
+    str
+        The patch_location of the scan
+
+    list of str
+        The wildcards of the scan
+
+    iterator of (str, list of str)
+        The leaf directories and the sorted names of the patches in them, in the order of
+        PatchDirectoryScanner.scan() on the whole patch_location
+    """
+    if not paths:
+        raise ValueError("There are no scan shards to merge")
+    shards = [read_scan_shard(path) for path in paths]
+    first = shards[0]
+    for path, shard in zip(paths, shards):
+        for key in ['patch_location', 'wildcards', 'n_shards']:
+            if shard[key] != first[key]:
+                raise ValueError(f"Scan shard {path} has {key} {shard[key]}, "
+                        f"but scan shard {paths[0]} has {key} {first[key]}")
+    shard_indices = collections.Counter(shard['shard_index'] for shard in shards)
+    duplicated = sorted(idx for idx, count in shard_indices.items() if count > 1)
+    missing = sorted(set(range(first['n_shards'])) - set(shard_indices))
+    if duplicated or missing:
+        raise ValueError(f"Scan shards of {first['patch_location']} are not complete. "
+                f"Duplicated shards: {duplicated}. Missing shards: {missing}")
+    leaves = heapq.merge(*[shard['leaves'] for shard in shards],
+            key=lambda leaf: leaf[0] + os.sep)
+    return first['patch_location'], first['wildcards'], leaves
+
+def iter_patch_paths(leaves):
+    for directory, names in leaves:
+        for name in names:
+            yield os.path.join(directory, name)
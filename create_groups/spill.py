@@ -0,0 +1,272 @@
+"""Out-of-core storage of patch records in on-disk partitions
+"""
+import os
+import shutil
+import tempfile
+import collections.abc
+
+import numpy as np
+
+from create_groups.defaults import default_memory_budget
+from create_groups.rng import get_key_entropy
+
+default_n_partitions = 64
+
+class PatchSpill(object):
+    """Patch records spilled to on-disk partitions keyed by (subtype, patient).
+
+    A record is the index of the directory and the file name of a patch. Records are appended to
+    the partition of the (subtype, patient) of their directory in the order they are added, so
+    the records of a slide are in the same order as the rows of a PatchTable. Only the directories,
+    their labels and the number of records of each slide are kept in memory. Appended records are
+    buffered and written to the partition files when the buffers reach a quarter of the memory budget.
+
+    Every partition is stored as 3 files: the directory index of each record as int32, the UTF-8
+    file names of the records, and the end offset of each file name as int64.
+
+    Attributes
+    ----------
+    location : str
+        The temporary directory of the partition files
+
+    memory_budget : int
+        The memory budget in bytes
+
+    n_partitions : int
+        The number of partitions
+
+    directories : list of str
+        The directories of the records, including the trailing '/'
+
+    directory_slide : list of int
+        Index of the slide of each directory in slides, or -1 if the directory is not labeled
+
+    slides : list of (tuple of str)
+        The (subtype, patient, slide) of the slides
+
+    slide_counts : list of int
+        The number of records of each slide
+
+    subtype_patient_slide : dict
+        {subtype: {patient: {slide: index of the slide in slides}}} in the order of the first record of each slide
+    """
+
+    def __init__(self, spill_location, memory_budget=default_memory_budget * 2**20,
+            n_partitions=default_n_partitions):
+        self.location = tempfile.mkdtemp(prefix='create_groups_spill_', dir=spill_location)
+        self.memory_budget = memory_budget
+        self.n_partitions = n_partitions
+        self.directories = []
+        self.directory_ids = {}
+        self.directory_slide = []
+        self.slides = []
+        self.slide_ids = {}
+        self.slide_counts = []
+        self.subtype_patient_slide = {}
+        self.partition_counts = np.zeros(n_partitions, dtype=np.int64)
+        self.partition_bytes = np.zeros(n_partitions, dtype=np.int64)
+        self.partition_starts = None
+        self.buffers = {}
+        self.buffered_bytes = 0
+        self.mapped_partitions = {}
+
+    def __len__(self):
+        return int(self.partition_counts.sum()) + sum(len(b[1]) for b in self.buffers.values())
+
+    def get_partition_path(self, partition, column):
+        return os.path.join(self.location, f"partition_{partition}.{column}")
+
+    def get_partition(self, subtype, patient):
+        return get_key_entropy((subtype, patient)) % self.n_partitions
+
+    def intern_directory(self, directory):
+        """Intern a directory
+
+        Returns
+        -------
+        int
+            Index of the directory
+
+        bool
+            Whether the directory is new and is not labeled yet
+        """
+        directory_id = self.directory_ids.get(directory)
+        if directory_id is not None:
+            return directory_id, False
+        directory_id = len(self.directories)
+        self.directory_ids[directory] = directory_id
+        self.directories.append(directory)
+        self.directory_slide.append(-1)
+        return directory_id, True
+
+    def set_directory_label(self, directory_id, subtype, patient, slide):
+        key = (subtype, patient, slide)
+        slide_id = self.slide_ids.get(key)
+        if slide_id is None:
+            slide_id = len(self.slides)
+            self.slide_ids[key] = slide_id
+            self.slides.append(key)
+            self.slide_counts.append(0)
+        self.directory_slide[directory_id] = slide_id
+
+    def append(self, directory_id, names):
+        """Append the records of file names in a directory. Records of directories that are not labeled are dropped."""
+        slide_id = self.directory_slide[directory_id]
+        if slide_id < 0 or not names:
+            return
+        subtype, patient, slide = self.slides[slide_id]
+        if self.slide_counts[slide_id] == 0:
+            self.subtype_patient_slide.setdefault(subtype, {}).setdefault(patient, {})[slide] = slide_id
+        self.slide_counts[slide_id] += len(names)
+        directory_ids, partition_names = self.buffers.setdefault(
+                self.get_partition(subtype, patient), ([], []))
+        directory_ids.extend([directory_id] * len(names))
+        partition_names.extend(names)
+        self.buffered_bytes += sum(map(len, names)) + 64 * len(names)
+        if self.buffered_bytes > self.memory_budget // 4:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records to the partition files"""
+        for partition, (directory_ids, names) in self.buffers.items():
+            encoded = [name.encode('utf-8') for name in names]
+            ends = np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64,
+                    count=len(encoded))) + self.partition_bytes[partition]
+            with open(self.get_partition_path(partition, 'directory'), 'ab') as f:
+                f.write(np.asarray(directory_ids, dtype=np.int32).tobytes())
+            with open(self.get_partition_path(partition, 'names'), 'ab') as f:
+                f.write(b''.join(encoded))
+            with open(self.get_partition_path(partition, 'name_ends'), 'ab') as f:
+                f.write(ends.tobytes())
+            self.partition_counts[partition] += len(names)
+            self.partition_bytes[partition] = ends[-1]
+        self.buffers = {}
+        self.buffered_bytes = 0
+
+    def finish(self):
+        """Write the remaining records. Records are numbered across partitions after this."""
+        self.flush()
+        self.partition_starts = np.concatenate([[0], np.cumsum(self.partition_counts)])
+
+    def create_subtype_patient_slide_patch_dict(self):
+        """Get the slides like PatchTable.create_subtype_patient_slide_patch_dict() with
+        range(number of records) in place of the rows of each slide
+
+        Returns
+        -------
+        dict
+            {subtype: {patient: {slide: range}}}
+        """
+        return {subtype: {patient: {slide: range(self.slide_counts[slide_id]) \
+                for slide, slide_id in slide_ids.items()} \
+                for patient, slide_ids in patient_slide_ids.items()} \
+                for subtype, patient_slide_ids in self.subtype_patient_slide.items()}
+
+    def iter_partition_slide_records(self):
+        """Get the records of every slide, one partition at a time.
+
+        Yields
+        ------
+        dict of numpy.ndarray
+            {(subtype, patient, slide): the records of the slide in order} for the slides in a partition
+        """
+        directory_slide = np.asarray(self.directory_slide, dtype=np.int64)
+        for partition in range(self.n_partitions):
+            if self.partition_counts[partition] == 0:
+                continue
+            slide_ids = directory_slide[np.fromfile(
+                    self.get_partition_path(partition, 'directory'), dtype=np.int32)]
+            order = np.argsort(slide_ids, kind='stable')
+            unique_slide_ids, starts = np.unique(slide_ids[order], return_index=True)
+            records = np.split(order + self.partition_starts[partition], starts[1:])
+            yield {self.slides[slide_id]: slide_records for slide_id, slide_records \
+                    in zip(unique_slide_ids.tolist(), records)}
+
+    def map_partition(self, partition):
+        if partition not in self.mapped_partitions:
+            columns = []
+            for column, dtype in [('directory', np.int32), ('names', np.uint8),
+                    ('name_ends', np.int64)]:
+                path = self.get_partition_path(partition, column)
+                columns.append(np.memmap(path, dtype=dtype, mode='r') \
+                        if os.path.getsize(path) > 0 else np.zeros(0, dtype=dtype))
+            self.mapped_partitions[partition] = tuple(columns)
+        return self.mapped_partitions[partition]
+
+    def get_paths(self, records):
+        """Read the patch paths of records
+
+        Parameters
+        ----------
+        records : array-like of int
+            The records numbered across partitions
+
+        Returns
+        -------
+        list of str
+            List of patch paths
+        """
+        records = np.asarray(records, dtype=np.int64)
+        patch_paths = [None] * len(records)
+        partitions = np.searchsorted(self.partition_starts, records, side='right') - 1
+        for partition in np.unique(partitions).tolist():
+            idx = np.flatnonzero(partitions == partition)
+            local = records[idx] - self.partition_starts[partition]
+            directory, names, name_ends = self.map_partition(partition)
+            ends = name_ends[local]
+            starts = np.where(local > 0, name_ends[np.maximum(local - 1, 0)], 0)
+            names = memoryview(names)
+            for i, directory_id, start, end in zip(idx.tolist(), directory[local].tolist(),
+                    starts.tolist(), ends.tolist()):
+                patch_paths[i] = self.directories[directory_id] + str(names[start:end], 'utf-8')
+        return patch_paths
+
+    def get_directories(self, records):
+        """Read the index of the directory of records in directories without reading their file names
+
+        Parameters
+        ----------
+        records : array-like of int
+            The records numbered across partitions
+
+        Returns
+        -------
+        numpy.ndarray
+            The index of the directory of each record
+        """
+        records = np.asarray(records, dtype=np.int64)
+        directories = np.zeros(len(records), dtype=np.int32)
+        partitions = np.searchsorted(self.partition_starts, records, side='right') - 1
+        for partition in np.unique(partitions).tolist():
+            idx = np.flatnonzero(partitions == partition)
+            directory, _, _ = self.map_partition(partition)
+            directories[idx] = directory[records[idx] - self.partition_starts[partition]]
+        return directories
+
+    def view(self, records):
+        """Get a lazy sequence of the patch paths of records"""
+        return SpilledPaths(self, records)
+
+    def close(self):
+        """Delete the partition files"""
+        self.mapped_partitions = {}
+        shutil.rmtree(self.location, ignore_errors=True)
+
+class SpilledPaths(collections.abc.Sequence):
+    """Lazy sequence of the patch paths of records in a PatchSpill"""
+
+    def __init__(self, spill, records):
+        self.spill = spill
+        self.records = np.asarray(records, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.spill.get_paths(self.records[idx])
+        return self.spill.get_paths([self.records[idx]])[0]
+
+    def __iter__(self, batch_size=4096):
+        for start in range(0, len(self.records), batch_size):
+            yield from self.spill.get_paths(self.records[start:start + batch_size])
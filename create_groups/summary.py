@@ -0,0 +1,140 @@
+"""Summaries of groups counted over integer-coded columns
+"""
+import numpy as np
+
+COUNT_COLUMNS = ['patients', 'slides', 'patches']
+
+class GroupSummary(object):
+    """The number of patients, slides and patches of every (group, category), stored as columns like a DataFrame in long format.
+
+    There is a row for every (group, category) in the order of groups and categories, followed by
+    a row for every category of the group 'Total' over all groups. A patient or slide is counted
+    in a group by the category of its first patch in the group, and in 'Total' by the category
+    of its first patch in the first group it is in, so it is counted once per group and once in total.
+
+    A pandas DataFrame can be created with pandas.DataFrame(summary.to_dict()).
+
+    Attributes
+    ----------
+    groups : list of str
+        The names of the groups
+
+    categories : list of str
+        The names of the categories
+
+    columns : dict of numpy.ndarray
+        {'group': group name of each row, 'category': category name of each row,
+        'patients': int, 'slides': int, 'patches': int}
+    """
+    total_group = 'Total'
+
+    def __init__(self, groups, categories, counts):
+        """
+        Parameters
+        ----------
+        counts : dict of numpy.ndarray
+            {column in COUNT_COLUMNS: (number of groups + 1) x (number of categories) array of counts, where the last row is the total}
+        """
+        self.groups = list(groups)
+        self.categories = list(categories)
+        group_names = self.groups + [self.total_group]
+        self.columns = {
+            'group': np.repeat(np.array(group_names, dtype=object), len(self.categories)),
+            'category': np.tile(np.array(self.categories, dtype=object), len(group_names)),
+        }
+        for column in COUNT_COLUMNS:
+            self.columns[column] = np.asarray(counts[column], dtype=np.int64).reshape(-1)
+
+    def __len__(self):
+        return len(self.columns['group'])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def pivot(self, column):
+        """Get a count column as a table
+
+        Returns
+        -------
+        numpy.ndarray
+            (number of groups + 1) x (number of categories) array of counts, where the last row is the total
+        """
+        return self.columns[column].reshape(len(self.groups) + 1, len(self.categories))
+
+    def to_dict(self):
+        """Get the columns as lists
+
+        Returns
+        -------
+        dict of list
+            {column: values of the rows}
+        """
+        return {column: values.tolist() for column, values in self.columns.items()}
+
+def count_first(keys, category, n_categories):
+    """Count every distinct key by the category of its first occurrence
+
+    Returns
+    -------
+    numpy.ndarray
+        The number of keys of each category
+
+    numpy.ndarray
+        The index of the first occurrence of every key
+    """
+    _, first_idx = np.unique(keys, return_index=True)
+    return np.bincount(category[first_idx], minlength=n_categories), first_idx
+
+def summarize_groups(groups, categories, group_directories, directory_category,
+        directory_patient, directory_slide):
+    """Count the patients, slides and patches of every (group, category) from the directories of the patches.
+
+    The labels are per directory, so the patches are only counted by grouping integer codes.
+    Patches whose directory has no category are not counted.
+
+    Parameters
+    ----------
+    groups : list of str
+        The names of the groups
+
+    categories : list of str
+        The names of the categories
+
+    group_directories : list of numpy.ndarray
+        The index of the directory of every patch of each group
+
+    directory_category : numpy.ndarray
+        Index of the category of each directory in categories, or -1 if the directory has no category
+
+    directory_patient : numpy.ndarray
+        Index from 0 of the patient of each directory
+
+    directory_slide : numpy.ndarray
+        Index from 0 of the slide of each directory
+
+    Returns
+    -------
+    GroupSummary
+    """
+    n_categories = len(categories)
+    counts = {column: np.zeros((len(groups) + 1, n_categories), dtype=np.int64) \
+            for column in COUNT_COLUMNS}
+    is_counted = {
+        'patients': np.zeros(int(directory_patient.max(initial=-1)) + 1, dtype=bool),
+        'slides': np.zeros(int(directory_slide.max(initial=-1)) + 1, dtype=bool),
+    }
+    for group_idx, directories in enumerate(group_directories):
+        directories = np.asarray(directories, dtype=np.int64)
+        category = directory_category[directories]
+        directories = directories[category >= 0]
+        category = category[category >= 0]
+        counts['patches'][group_idx] = np.bincount(category, minlength=n_categories)
+        for column, directory_keys in [('patients', directory_patient), ('slides', directory_slide)]:
+            keys = directory_keys[directories]
+            counts[column][group_idx], first_idx = count_first(keys, category, n_categories)
+            # keys seen in an earlier group are already counted in the total
+            first_idx = first_idx[~is_counted[column][keys[first_idx]]]
+            counts[column][-1] += np.bincount(category[first_idx], minlength=n_categories)
+            is_counted[column][keys[first_idx]] = True
+    counts['patches'][-1] = counts['patches'][:-1].sum(axis=0)
+    return GroupSummary(groups, categories, counts)
@@ -0,0 +1,128 @@
+"""Generating several groupings from one scan of the patches
+"""
+import io
+import json
+import argparse
+import contextlib
+import multiprocessing
+import concurrent.futures
+
+from submodule_utils.arguments import balance_patches_options
+
+from create_groups.defaults import (OUT_FORMATS, default_sweep_workers)
+
+def out_format(value):
+    if value not in OUT_FORMATS:
+        raise ValueError(f"Out format {value} is not one of {OUT_FORMATS}")
+    return value
+
+def boolean(value):
+    if not isinstance(value, bool):
+        raise ValueError(f"Value {value!r} is not a JSON boolean true or false")
+    return value
+
+def subtypes(value):
+    if not isinstance(value, dict) or not value:
+        raise argparse.ArgumentTypeError(f"Subtypes {value!r} is not a non-empty JSON object of subtype to label")
+    converted = {}
+    for subtype, label in value.items():
+        try:
+            if isinstance(label, (bool, float)):
+                raise ValueError
+            converted[subtype] = int(label)
+        except (TypeError, ValueError):
+            raise argparse.ArgumentTypeError(f"Subtype {subtype}={label!r} does not have an integer label") from None
+    return converted
+
+# the options a sweep config can set and the function that converts their values
+SWEEP_OPTIONS = {
+    'out_location': str,
+    'out_format': out_format,
+    'seed': int,
+    'legacy_shuffle': boolean,
+    'n_groups': int,
+    'subtypes': subtypes,
+    'is_binary': boolean,
+    'balance_patches': balance_patches_options,
+    'min_patches': int,
+    'max_patches': int,
+    'max_patient_patches': int,
+}
+
+def read_sweep(path):
+    """Read a sweep file.
+
+    A sweep file is a JSON list of configs. Every config is a dict of the options in SWEEP_OPTIONS
+    that differ from the command line arguments, and must set out_location. For example
+
+    [
+        {"out_location": "/path/to/groups_seed_1.json", "seed": 1},
+        {"out_location": "/path/to/groups_cap.json", "balance_patches": "group=1000", "n_groups": 5},
+        {"out_location": "/path/to/groups_binary.json", "is_binary": true, "max_patient_patches": null}
+    ]
+
+    Returns
+    -------
+    list of dict
+        The options of each config with values converted like the command line arguments
+    """
+    with open(path, 'r') as f:
+        sweep_configs = json.load(f)
+    if not isinstance(sweep_configs, list) or not sweep_configs:
+        raise ValueError(f"Sweep file {path} is not a non-empty list of configs")
+    converted_configs = []
+    for idx, sweep_config in enumerate(sweep_configs):
+        unknown_options = sorted(set(sweep_config) - set(SWEEP_OPTIONS))
+        if unknown_options:
+            raise ValueError(f"Sweep config {idx} in {path} has unknown options {unknown_options}. "
+                    f"Options are {sorted(SWEEP_OPTIONS)}")
+        if not sweep_config.get('out_location'):
+            raise ValueError(f"Sweep config {idx} in {path} does not set out_location")
+        converted_configs.append({key: None if value is None else SWEEP_OPTIONS[key](value) \
+                for key, value in sweep_config.items()})
+    out_locations = [sweep_config['out_location'] for sweep_config in converted_configs]
+    if len(set(out_locations)) < len(out_locations):
+        raise ValueError(f"Sweep configs in {path} do not have distinct out_location")
+    return converted_configs
+
+# set before forking the worker processes of map_sweep() so that they inherit the patch table
+sweep_state = {}
+
+def run_group_creator(group_creator, patch_table):
+    """Run group_creator on patch_table
+
+    Returns
+    -------
+    str
+        What the run printed
+    """
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        group_creator.run(patch_table=patch_table)
+    return output.getvalue()
+
+def run_sweep_group_creator(idx):
+    return run_group_creator(sweep_state['group_creators'][idx], sweep_state['patch_table'])
+
+def map_sweep(group_creators, patch_table, workers=default_sweep_workers):
+    """Run group creators on the same labeled patch table.
+
+    With more than one worker the group creators run in forked processes that share the patch table
+    with this process, so the patch table is neither copied nor pickled. Processes are not used if
+    fork is not available.
+
+    Returns
+    -------
+    list of str
+        What each run printed
+    """
+    if workers > 1 and len(group_creators) > 1 \
+            and 'fork' in multiprocessing.get_all_start_methods():
+        sweep_state['group_creators'] = group_creators
+        sweep_state['patch_table'] = patch_table
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                    mp_context=multiprocessing.get_context('fork')) as executor:
+                return list(executor.map(run_sweep_group_creator, range(len(group_creators))))
+        finally:
+            sweep_state.clear()
+    return [run_group_creator(group_creator, patch_table) for group_creator in group_creators]
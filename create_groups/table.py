@@ -0,0 +1,363 @@
+"""Columnar storage of patch paths
+"""
+import os
+import re
+import array
+import collections.abc
+
+import numpy as np
+
+class PatchTable(object):
+    """Table of patch paths stored as integer columns instead of path strings.
+
+    Every patch is a row. The directory of a patch is an index into the interned directories
+    and the patch file name x_y.png is stored as the coordinates x and y and an index into the
+    interned extensions. File names of any other form are interned in names. Subtype, patient
+    and slide are stored per directory since every word in the patch_pattern is a directory.
+    The patch paths are only rebuilt when calling get_path() or get_paths().
+
+    Attributes
+    ----------
+    directories : list of str
+        Interned directories of the patch paths, including the trailing '/'
+
+    extensions : list of str
+        Interned extensions of file names of the form x_y.png
+
+    names : list of str
+        Interned file names that are not of the form x_y.png
+
+    directory : numpy.ndarray
+        Index of the directory of each row
+
+    x : numpy.ndarray
+        The x coordinate of each row
+
+    y : numpy.ndarray
+        The y coordinate of each row
+
+    extension : numpy.ndarray
+        Index of the extension of each row, or -1 if the row is in names
+
+    name : numpy.ndarray
+        Index of the file name of each row in names, or -1 if the row is of the form x_y.png
+
+    subtypes : list of str
+        Interned subtypes (categories) of the directories
+
+    patients : list of str
+        Interned patients of the directories
+
+    slides : list of str
+        Interned slides of the directories
+
+    directory_subtype : numpy.ndarray
+        Index of the subtype of each directory, or -1 if the directory is not labeled
+
+    directory_patient : numpy.ndarray
+        Index of the patient of each directory, or -1 if the directory is not labeled
+
+    directory_slide : numpy.ndarray
+        Index of the slide of each directory, or -1 if the directory is not labeled
+
+    directory_columns : dict of (list, numpy.ndarray)
+        Other parsed fields of the directories {field: (interned values, index of the value of each directory)}
+    """
+    name_regex = re.compile(r'(0|[1-9][0-9]{0,8})_(0|[1-9][0-9]{0,8})(\.[^./]*)')
+
+    def __init__(self):
+        self.directories = []
+        self.extensions = []
+        self.names = []
+        self.directory = np.zeros(0, dtype=np.int32)
+        self.x = np.zeros(0, dtype=np.int32)
+        self.y = np.zeros(0, dtype=np.int32)
+        self.extension = np.zeros(0, dtype=np.int16)
+        self.name = np.zeros(0, dtype=np.int32)
+        self.subtypes = []
+        self.patients = []
+        self.slides = []
+        self.directory_subtype = np.zeros(0, dtype=np.int32)
+        self.directory_patient = np.zeros(0, dtype=np.int32)
+        self.directory_slide = np.zeros(0, dtype=np.int32)
+        self.directory_columns = {}
+
+    def __len__(self):
+        return len(self.directory)
+
+    @classmethod
+    def from_directories(cls, leaves):
+        """Create a table from a directory listing.
+
+        Parameters
+        ----------
+        leaves : iterable of (str, list of str)
+            Directories and the names of the patches in them, like PatchDirectoryScanner.scan()
+        """
+        builder = PatchTableBuilder()
+        for directory, names in leaves:
+            directory_idx = builder.intern_directory(os.path.join(directory, ''))
+            for name in names:
+                builder.append(directory_idx, name)
+        return builder.build()
+
+    @classmethod
+    def from_paths(cls, patch_paths):
+        """Create a table from a list of patch paths
+        """
+        builder = PatchTableBuilder()
+        for patch_path in patch_paths:
+            idx = patch_path.rfind('/') + 1
+            builder.append(builder.intern_directory(patch_path[:idx]), patch_path[idx:])
+        return builder.build()
+
+    def get_name(self, row):
+        name = self.name[row]
+        if name >= 0:
+            return self.names[name]
+        return f"{self.x[row]}_{self.y[row]}{self.extensions[self.extension[row]]}"
+
+    def get_path(self, row):
+        return self.directories[self.directory[row]] + self.get_name(row)
+
+    def get_paths(self, rows=None):
+        """Rebuild the patch paths of rows
+
+        Parameters
+        ----------
+        rows : array-like of int
+            The rows to get the paths of. Gets all rows if not set.
+
+        Returns
+        -------
+        list of str
+            List of patch paths
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        rows = np.asarray(rows, dtype=np.int64)
+        directories = self.directories
+        extensions = self.extensions
+        names = self.names
+        patch_paths = []
+        for directory, x, y, extension, name in zip(self.directory[rows].tolist(),
+                self.x[rows].tolist(), self.y[rows].tolist(),
+                self.extension[rows].tolist(), self.name[rows].tolist()):
+            if name >= 0:
+                patch_paths.append(directories[directory] + names[name])
+            else:
+                patch_paths.append(f"{directories[directory]}{x}_{y}{extensions[extension]}")
+        return patch_paths
+
+    def view(self, rows):
+        """Get a lazy sequence of the patch paths of rows"""
+        return PatchPaths(self, rows)
+
+    def get_first_row_of_directories(self):
+        """Get the first row of each directory, or -1 if the directory has no rows"""
+        first_rows = np.full(len(self.directories), len(self), dtype=np.int64)
+        np.minimum.at(first_rows, self.directory, np.arange(len(self)))
+        first_rows[first_rows == len(self)] = -1
+        return first_rows
+
+    def set_directory_column(self, field, values):
+        """Intern the value of a field for each directory.
+
+        Parameters
+        ----------
+        field : str
+            The name of the field
+
+        values : list
+            The value of the field for each directory, or None if the directory has no value
+        """
+        value_ids = {}
+        interned = []
+        codes = np.full(len(values), -1, dtype=np.int32)
+        for directory, value in enumerate(values):
+            if value is None:
+                continue
+            value_id = value_ids.get(value)
+            if value_id is None:
+                value_id = len(interned)
+                value_ids[value] = value_id
+                interned.append(value)
+            codes[directory] = value_id
+        self.directory_columns[field] = (interned, codes)
+
+    def parse_directories(self, parser, words):
+        """Parse words of the patch_pattern from the directories once and store them as directory columns.
+
+        Parameters
+        ----------
+        parser : PatchPatternParser
+            The parser of the patch_pattern
+
+        words : list of str
+            The words to store
+        """
+        columns = parser.parse(self.directories)
+        for word in words:
+            self.set_directory_column(word, columns[word])
+
+    def get_column(self, field, rows=None):
+        """Get the values of a directory column for rows
+
+        Returns
+        -------
+        list
+            The interned values of the field
+
+        numpy.ndarray
+            Index of the value of each row, or -1 if the directory of the row has no value
+        """
+        interned, codes = self.directory_columns[field]
+        directory = self.directory if rows is None else self.directory[rows]
+        return interned, codes[directory]
+
+    def set_directory_labels(self, subtype_patient_slide_directory):
+        """Set subtype, patient and slide of the directories.
+
+        Parameters
+        ----------
+        subtype_patient_slide_directory : dict
+            {subtype: {patient: {slide: [directory index]}}}
+        """
+        self.subtypes = []
+        self.patients = []
+        self.slides = []
+        patient_ids = {}
+        slide_ids = {}
+        self.directory_subtype = np.full(len(self.directories), -1, dtype=np.int32)
+        self.directory_patient = np.full(len(self.directories), -1, dtype=np.int32)
+        self.directory_slide = np.full(len(self.directories), -1, dtype=np.int32)
+        for subtype, patient_slide_directory in subtype_patient_slide_directory.items():
+            subtype_id = len(self.subtypes)
+            self.subtypes.append(subtype)
+            for patient, slide_directory in patient_slide_directory.items():
+                if patient not in patient_ids:
+                    patient_ids[patient] = len(self.patients)
+                    self.patients.append(patient)
+                for slide, directories in slide_directory.items():
+                    if slide not in slide_ids:
+                        slide_ids[slide] = len(self.slides)
+                        self.slides.append(slide)
+                    directories = np.asarray(directories, dtype=np.int64)
+                    self.directory_subtype[directories] = subtype_id
+                    self.directory_patient[directories] = patient_ids[patient]
+                    self.directory_slide[directories] = slide_ids[slide]
+
+    def create_subtype_patient_slide_patch_dict(self):
+        """Group the labeled rows by subtype, patient and slide.
+
+        The dict has the same key order as when grouping the patch paths of the rows one by one
+        and the rows in each slide are in increasing order.
+
+        Returns
+        -------
+        dict
+            {subtype: {patient: {slide: [row]}}}
+        """
+        directory_key = self.directory_slide.astype(np.int64)
+        directory_key = (directory_key * len(self.patients) + self.directory_patient) \
+                * len(self.subtypes) + self.directory_subtype
+        directory_key[self.directory_subtype < 0] = -1
+        row_key = directory_key[self.directory]
+        rows = np.flatnonzero(row_key >= 0)
+        row_key = row_key[rows]
+        # order (subtype, patient, slide) keys by their first row
+        keys, first_idx, key_idx = np.unique(row_key, return_index=True,
+                return_inverse=True)
+        key_order = np.argsort(first_idx, kind='stable')
+        key_rank = np.empty_like(key_order)
+        key_rank[key_order] = np.arange(len(key_order))
+        order = np.argsort(key_rank[key_idx], kind='stable')
+        counts = np.bincount(key_rank[key_idx], minlength=len(keys))
+        key_rows = np.split(rows[order], np.cumsum(counts)[:-1]) if len(keys) else []
+        subtype_patient_slide_patch = {}
+        for key, patches in zip(keys[key_order].tolist(), key_rows):
+            key, subtype = divmod(key, len(self.subtypes))
+            slide, patient = divmod(key, len(self.patients))
+            patient_slide_patch = subtype_patient_slide_patch.setdefault(
+                    self.subtypes[subtype], {})
+            slide_patch = patient_slide_patch.setdefault(self.patients[patient], {})
+            slide_patch[self.slides[slide]] = patches.tolist()
+        return subtype_patient_slide_patch
+
+class PatchTableBuilder(object):
+    """Appends patches to the columns of a PatchTable"""
+
+    def __init__(self):
+        self.table = PatchTable()
+        self.directory_ids = {}
+        self.extension_ids = {}
+        self.name_ids = {}
+        self.directory = array.array('i')
+        self.x = array.array('i')
+        self.y = array.array('i')
+        self.extension = array.array('h')
+        self.name = array.array('i')
+
+    def intern_directory(self, directory):
+        directory_id = self.directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = len(self.table.directories)
+            self.directory_ids[directory] = directory_id
+            self.table.directories.append(directory)
+        return directory_id
+
+    def append(self, directory_id, name):
+        self.directory.append(directory_id)
+        match = PatchTable.name_regex.fullmatch(name)
+        if match is None:
+            name_id = self.name_ids.get(name)
+            if name_id is None:
+                name_id = len(self.table.names)
+                self.name_ids[name] = name_id
+                self.table.names.append(name)
+            self.x.append(-1)
+            self.y.append(-1)
+            self.extension.append(-1)
+            self.name.append(name_id)
+        else:
+            extension = match.group(3)
+            extension_id = self.extension_ids.get(extension)
+            if extension_id is None:
+                extension_id = len(self.table.extensions)
+                self.extension_ids[extension] = extension_id
+                self.table.extensions.append(extension)
+            self.x.append(int(match.group(1)))
+            self.y.append(int(match.group(2)))
+            self.extension.append(extension_id)
+            self.name.append(-1)
+
+    def build(self):
+        table = self.table
+        table.directory = np.frombuffer(self.directory, dtype=np.int32).copy()
+        table.x = np.frombuffer(self.x, dtype=np.int32).copy()
+        table.y = np.frombuffer(self.y, dtype=np.int32).copy()
+        table.extension = np.frombuffer(self.extension, dtype=np.int16).copy()
+        table.name = np.frombuffer(self.name, dtype=np.int32).copy()
+        table.directory_subtype = np.full(len(table.directories), -1, dtype=np.int32)
+        table.directory_patient = np.full(len(table.directories), -1, dtype=np.int32)
+        table.directory_slide = np.full(len(table.directories), -1, dtype=np.int32)
+        return table
+
+class PatchPaths(collections.abc.Sequence):
+    """Lazy sequence of the patch paths of rows in a PatchTable"""
+
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = np.asarray(rows, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.table.get_paths(self.rows[idx])
+        return self.table.get_path(self.rows[idx])
+
+    def __iter__(self, batch_size=4096):
+        for start in range(0, len(self.rows), batch_size):
+            yield from self.table.get_paths(self.rows[start:start + batch_size])
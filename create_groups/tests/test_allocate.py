@@ -0,0 +1,212 @@
+import pytest
+import random
+
+from create_groups.allocate import (water_fill, balance_take_counts, fill_deficits)
+from create_groups import GroupCreator
+
+def select_patches_from_dict_as_dict_by_rounds(dict_patch, max_patches):
+    """The round based selection that water_fill() replaces"""
+    selected_patches = {k: [] for k in dict_patch.keys()}
+    tmp_dict_patch = {}
+    while True:
+        if len(dict_patch) == 0:
+            break
+        num_selected_patches = sum(map(len, selected_patches.values()))
+        num_patches_each_key = max(0, max_patches - \
+                num_selected_patches) // len(dict_patch)
+        num_patches_each_key = min(num_patches_each_key,
+                min(map(len, dict_patch.values())))
+        if num_patches_each_key < 1:
+            break
+        for key, patches in dict_patch.items():
+            selected_patches[key].extend(patches[:num_patches_each_key])
+            if len(patches[num_patches_each_key:]) > 0:
+                    tmp_dict_patch[key] = patches[num_patches_each_key:]
+        dict_patch = tmp_dict_patch
+        tmp_dict_patch = {}
+    return selected_patches
+
+def generate_dict_patch(n_keys, max_len, min_len=1):
+    return {f"key{k}": [f"key{k}/{i}" for i in range(random.randint(min_len, max_len))] \
+            for k in range(n_keys)}
+
+def test_water_fill():
+    assert water_fill([], 10).tolist() == []
+    assert water_fill([3, 1, 5], 100).tolist() == [3, 1, 5]
+    assert water_fill([3, 1, 5], 7).tolist() == [3, 1, 3]
+    assert water_fill([3, 1, 5], 8).tolist() == [3, 1, 4]
+    assert water_fill([4, 4, 4], 11).tolist() == [3, 3, 3]
+    assert water_fill([4, 0, 4], 11).tolist() == [0, 0, 0]
+    assert water_fill([4, 4], 0).tolist() == [0, 0]
+    assert water_fill([4, 4], -3).tolist() == [0, 0]
+
+@pytest.mark.parametrize('seed', range(5))
+def test_select_patches_from_dict_as_dict_is_same_as_rounds(seed):
+    random.seed(seed)
+    gc = GroupCreator.__new__(GroupCreator)
+    for _ in range(200):
+        dict_patch = generate_dict_patch(random.randint(0, 12), random.randint(1, 40),
+                min_len=random.choice([0, 1, 1, 1]))
+        max_patches = random.randint(-2, sum(map(len, dict_patch.values())) + 5)
+        expected = select_patches_from_dict_as_dict_by_rounds(dict_patch, max_patches)
+        actual = gc.select_patches_from_dict_as_dict(dict_patch, max_patches)
+        assert actual == expected
+        assert list(actual.keys()) == list(expected.keys())
+
+def create_patient_subtype_patch_to_select_count_by_rounds(subtype_patient_slide_patch,
+        max_patient_patches):
+    """The round based per patient selection that water_fill_matrix() replaces"""
+    patient_subtype_patch_count = {}
+    for subtype, patient_slide_patch in subtype_patient_slide_patch.items():
+        for patient, slide_patch in patient_slide_patch.items():
+            num_patches = sum(map(len, slide_patch.values()))
+            patient_subtype_patch_count.setdefault(patient, {})[subtype] = num_patches
+    patient_subtype_patch_to_select_count = {}
+    for patient, subtype_patch_count in patient_subtype_patch_count.items():
+        patient_subtype_patch_to_select_count[patient] = {s: 0 for s in subtype_patch_count.keys()}
+        tmp_subtype_patch_count = {}
+        while True:
+            if len(subtype_patch_count) == 0:
+                break
+            num_patches_each_subtype = max(0, max_patient_patches - \
+                    sum(patient_subtype_patch_to_select_count[patient].values())) \
+                    // len(subtype_patch_count)
+            num_patches_each_subtype = min(num_patches_each_subtype,
+                    min(subtype_patch_count.values()))
+            if num_patches_each_subtype < 1:
+                break
+            for subtype, patch_count in subtype_patch_count.items():
+                if patch_count <= num_patches_each_subtype:
+                    patient_subtype_patch_to_select_count[patient][subtype] += patch_count
+                else:
+                    patient_subtype_patch_to_select_count[patient][subtype] += num_patches_each_subtype
+                    tmp_subtype_patch_count[subtype] = patch_count - num_patches_each_subtype
+            subtype_patch_count = tmp_subtype_patch_count
+            tmp_subtype_patch_count = {}
+    return patient_subtype_patch_to_select_count, patient_subtype_patch_count
+
+def generate_subtype_patient_slide_patch(n_subtypes, n_patients):
+    subtype_patient_slide_patch = {}
+    for subtype_idx in random.sample(range(n_subtypes), n_subtypes):
+        patient_slide_patch = {}
+        for patient_idx in random.sample(range(n_patients), random.randint(0, n_patients)):
+            patient_slide_patch[f"patient{patient_idx}"] = {
+                    f"slide{patient_idx}_{slide_idx}": list(range(random.randint(0, 30))) \
+                    for slide_idx in range(random.randint(0, 3))}
+        subtype_patient_slide_patch[f"subtype{subtype_idx}"] = patient_slide_patch
+    return subtype_patient_slide_patch
+
+@pytest.mark.parametrize('seed', range(5))
+def test_create_patient_subtype_patch_to_select_count_is_same_as_rounds(seed):
+    random.seed(seed)
+    gc = GroupCreator.__new__(GroupCreator)
+    for _ in range(50):
+        subtype_patient_slide_patch = generate_subtype_patient_slide_patch(
+                random.randint(0, 4), random.randint(1, 20))
+        gc.max_patient_patches = random.randint(-1, 100)
+        expected = create_patient_subtype_patch_to_select_count_by_rounds(
+                subtype_patient_slide_patch, gc.max_patient_patches)
+        actual = gc.create_patient_subtype_patch_to_select_count(subtype_patient_slide_patch)
+        assert actual == expected
+        for actual_dict, expected_dict in zip(actual, expected):
+            assert list(actual_dict.keys()) == list(expected_dict.keys())
+            for patient in expected_dict.keys():
+                assert list(actual_dict[patient].keys()) == list(expected_dict[patient].keys())
+
+def make_groups_from_groups_subtypes_by_lists(groups_subtypes, balance_patches):
+    """The list based balancing that balance_take_counts() replaces"""
+    gc = GroupCreator.__new__(GroupCreator)
+    groups = {group_idx: [] for group_idx in groups_subtypes.keys()}
+    subtypes_groups = {}
+    for group_idx, group_subtypes in groups_subtypes.items():
+        for subtype, patches in group_subtypes.items():
+            subtypes_groups.setdefault(subtype, {})[group_idx] = patches
+    if balance_patches is None:
+        for group_idx, groups_subtype in groups_subtypes.items():
+            for patches in groups_subtype.values():
+                groups[group_idx] += patches
+    elif balance_patches == 'overall':
+        num_patches_to_pick = min(map(lambda d: min(map(len, d.values())),
+                groups_subtypes.values()))
+        for group_idx, group_subtypes in groups_subtypes.items():
+            for patches in group_subtypes.values():
+                groups[group_idx] += patches[:num_patches_to_pick]
+    elif balance_patches == 'group':
+        for group_idx, group_subtypes in groups_subtypes.items():
+            num_patches_to_pick = min(map(len, group_subtypes.values()))
+            for patches in group_subtypes.values():
+                groups[group_idx] += patches[:num_patches_to_pick]
+    elif balance_patches == 'category':
+        for groups_patches in subtypes_groups.values():
+            num_patches_to_pick = min(map(len, groups_patches.values()))
+            for group_idx, patches in groups_patches.items():
+                groups[group_idx] += patches[:num_patches_to_pick]
+    elif balance_patches[0] == 'overall':
+        for group_idx, group_subtypes in groups_subtypes.items():
+            for patches in group_subtypes.values():
+                groups[group_idx] += patches[:balance_patches[1]]
+    elif balance_patches[0] == 'group':
+        for group_idx, group_subtypes in groups_subtypes.items():
+            groups[group_idx] += gc.select_patches_from_dict(group_subtypes,
+                    max_patches=balance_patches[1])
+    elif balance_patches[0] == 'category':
+        for groups_patches in subtypes_groups.values():
+            groups_patches_to_select = gc.select_patches_from_dict_as_dict(
+                    groups_patches, balance_patches[1])
+            for group_idx, patches in groups_patches_to_select.items():
+                groups[group_idx] += patches
+    return groups
+
+@pytest.mark.parametrize('balance_patches', [None, 'overall', 'group', 'category',
+        ('overall', 7), ('group', 40), ('category', 30)])
+def test_make_groups_from_groups_subtypes_is_same_as_lists(balance_patches):
+    random.seed(0)
+    gc = GroupCreator.__new__(GroupCreator)
+    gc.balance_patches = balance_patches
+    for _ in range(50):
+        gc.n_groups = random.randint(1, 5)
+        subtypes = ['A', 'B', 'C'][:random.randint(1, 3)]
+        groups_subtypes = {f"group_{group_idx + 1}": {
+                subtype: [f"/{subtype}/{group_idx}/{i}" for i in range(random.randint(0, 25))] \
+                for subtype in subtypes} for group_idx in range(gc.n_groups)}
+        expected = make_groups_from_groups_subtypes_by_lists(groups_subtypes, balance_patches)
+        actual = gc.make_groups_from_groups_subtypes(groups_subtypes)
+        assert actual == expected
+        assert list(actual.keys()) == list(expected.keys())
+
+def test_balance_take_counts_not_implemented():
+    with pytest.raises(NotImplementedError):
+        balance_take_counts([[1, 2]], 'patient')
+    with pytest.raises(NotImplementedError):
+        balance_take_counts([[1, 2]], ('patient', 10))
+    with pytest.raises(NotImplementedError):
+        balance_take_counts([[1, 2]], 10)
+
+def test_get_slide_select_counts_is_same_as_select_patches_from_dict():
+    random.seed(0)
+    gc = GroupCreator.__new__(GroupCreator)
+    for _ in range(20):
+        subtype_patient_slide_patch = generate_subtype_patient_slide_patch(3, 10)
+        gc.max_patient_patches = random.randint(1, 60)
+        patient_subtype_patch_to_select_count, _ = gc.create_patient_subtype_patch_to_select_count(
+                subtype_patient_slide_patch)
+        key_patches_counts = iter(gc.get_slide_select_counts(subtype_patient_slide_patch,
+                patient_subtype_patch_to_select_count))
+        for subtype, patient_slide_patch in subtype_patient_slide_patch.items():
+            for patient, slide_patch in patient_slide_patch.items():
+                selected_patches = gc.select_patches_from_dict(slide_patch,
+                        max_patches=patient_subtype_patch_to_select_count[patient][subtype])
+                expected = []
+                for slide, patches in slide_patch.items():
+                    key, slide_patches, count = next(key_patches_counts)
+                    assert key == (subtype, patient, slide)
+                    assert slide_patches is patches
+                    expected.extend(patches[:count])
+                assert selected_patches == expected
+
+def test_fill_deficits():
+    assert fill_deficits([3, 3, 2], [3, 1, 0], 4) == [1, 2, 1, 2]
+    assert fill_deficits([1, 1, 1], [2, 0, 0], 2) == [1, 2]
+    # groups above their target still give every item a group
+    assert fill_deficits([1, 1], [3, 0], 3) == [1, 1, 1]
+    assert fill_deficits([2, 2], [0, 0], 0) == []
@@ -0,0 +1,35 @@
+import pytest
+import json
+
+from benchmarks.cohort import (create_cohort_params, create_cohort_slides)
+from benchmarks.run import main
+
+@pytest.mark.parametrize('subtype_skew,slide_skew,patch_skew', [(0., 0., 0.), (2., 1., 1.5)])
+def test_create_cohort_slides(subtype_skew, slide_skew, patch_skew):
+    params = create_cohort_params(5000, n_patients=30, subtype_skew=subtype_skew,
+            slide_skew=slide_skew, patch_skew=patch_skew)
+    slides = create_cohort_slides(params)
+    assert sum(n_patches for _, _, _, n_patches in slides) == 5000
+    assert len({slide[:-1] for _, _, slide, _ in slides}) == 30
+    assert slides == create_cohort_slides(params)
+
+def test_benchmarks_compare_to_baselines(tmp_path, capsys):
+    baselines_location = str(tmp_path / 'baselines.json')
+    args = ['--location', str(tmp_path / 'cohorts'), '--n_patches', '2000',
+            '--baselines_location', baselines_location]
+    assert main(args + ['--update_baselines']) == 0
+    with open(baselines_location) as f:
+        baselines = json.load(f)
+    (cohort_baselines,) = baselines.values()
+    assert sorted(cohort_baselines.keys()) == sorted(['parse_args', 'get_patch_paths', 'get_hd5_paths',
+            'create_patch_table', 'generate_groups', 'make_groups_from_groups_subtypes',
+            'print_group_summary'])
+    for baseline in cohort_baselines.values():
+        baseline['seconds'] = 0.
+        baseline['peak_mb'] = 0.
+    cohort_baselines['generate_groups']['seconds'] = 1e6
+    with open(baselines_location, 'w') as f:
+        json.dump(baselines, f)
+    assert main(args + ['--stages', 'generate_groups']) == 0
+    assert main(args + ['--stages', 'get_patch_paths', 'get_hd5_paths']) == 1
+    assert 'Regression' in capsys.readouterr().out
@@ -0,0 +1,85 @@
+import pytest
+import os
+import fnmatch
+
+import h5py
+import numpy as np
+
+from create_groups.hd5 import (PathMatcher, read_hd5_paths, load_hd5_paths)
+
+def write_hd5_paths(hd5_file, patch_paths, is_variable_length=False):
+    with h5py.File(hd5_file, 'w') as f:
+        if is_variable_length:
+            f.create_dataset('paths', data=patch_paths, dtype=h5py.string_dtype())
+        else:
+            f.create_dataset('paths', data=np.array([p.encode('utf-8') for p in patch_paths]))
+
+def create_hd5_files(hd5_location, n_files=5, n_paths=23):
+    hd5_files = []
+    expected = []
+    for file_idx in range(n_files):
+        slide_id = f"VOA-{file_idx + 1}00A"
+        patch_paths = [f"/patches/Tumor/MMRd/{slide_id}/256/10/{i}_{i * 2}.png" for i in range(n_paths)]
+        hd5_file = os.path.join(hd5_location, f"{slide_id}.h5")
+        write_hd5_paths(hd5_file, patch_paths, is_variable_length=file_idx % 2 == 0)
+        hd5_files.append(hd5_file)
+        expected.extend(patch_paths)
+    return hd5_files, expected
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 23, 1000])
+def test_read_hd5_paths(tmp_path, chunk_size):
+    hd5_files, expected = create_hd5_files(str(tmp_path), n_files=2)
+    actual = read_hd5_paths(hd5_files[0], chunk_size=chunk_size)
+    assert actual == expected[:23]
+    actual = read_hd5_paths(hd5_files[1], chunk_size=chunk_size)
+    assert actual == expected[23:]
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_load_hd5_paths_keeps_file_order(tmp_path, workers):
+    hd5_files, expected = create_hd5_files(str(tmp_path))
+    actual = load_hd5_paths(hd5_files, workers=workers, chunk_size=4)
+    assert actual == expected
+    actual = load_hd5_paths(hd5_files[::-1], workers=workers, chunk_size=4)
+    assert actual == [p for f in range(4, -1, -1) for p in expected[f * 23:(f + 1) * 23]]
+
+def test_path_matcher_matches_fnmatch():
+    root = '/patches'
+    patch_paths = [
+        '/patches/Tumor/MMRd/VOA-100A/256/10/100_100.png',
+        '/patches/Tumor/MMRd/VOA-100A/512/10/100_200.png',
+        '/patches/Stroma/p53abn/VOA-200A/256/10/100_100.png',
+        '/patches/Stroma/P53ABN/VOA-200A/256/10/100_200.png',
+        '/patches/Stroma/p53abn/VOA-200A/256/10/100_100.jpg',
+        '/patches/Stroma/p53abn/VOA-200A/256/10/extra/1_1.png',
+        '/patches/Tumor/MMRd/VOA-100A/256/100/100_100.png',
+        '/patches/Tumor/MMRd/VOA-100A/2560/10/100_100.png',
+        '/other/Tumor/MMRd/VOA-100A/256/10/100_100.png',
+        '/patches/Tumor/MMRd/VOA-100A/256/10/.png',
+        '/patches/Tumor/MMRd/VOA-100A/256/10/png',
+    ]
+    chunk = np.array([p.encode('utf-8') for p in patch_paths])
+    wildcards_list = [
+        ['/patches/**/**/**/**/**/*.png'],
+        ['/patches/**/**/**/256/10/*.png'],
+        ['/patches/Tumor/**/**/256/**/*.png'],
+        ['/patches/**/p53abn/**/**/**/*.png', '/patches/**/P53ABN/**/**/**/*.png'],
+        ['/patches/**/**/**/**/1*/*.png'],
+    ]
+    for wildcards in wildcards_list:
+        matcher = PathMatcher(root, wildcards)
+        assert matcher.is_vectorized == ('1*' not in wildcards[0])
+        expected = [fnmatch.filter(patch_paths, wildcard) for wildcard in wildcards]
+        assert matcher.filter(chunk) == expected
+
+def test_load_hd5_paths_with_matcher(tmp_path):
+    hd5_files, patch_paths = create_hd5_files(str(tmp_path))
+    wildcards = ['/patches/**/**/VOA-300A/**/**/*.png', '/patches/**/**/VOA-100A/**/**/*.png']
+    matcher = PathMatcher('/patches', wildcards)
+    assert matcher.is_vectorized
+    expected = []
+    for wildcard in wildcards:
+        expected.extend(fnmatch.filter(patch_paths, wildcard))
+    for workers in [1, 2]:
+        actual = load_hd5_paths(hd5_files, workers=workers, chunk_size=5,
+                matcher=matcher)
+        assert actual == expected
@@ -0,0 +1,55 @@
+import pytest
+import sys
+import json
+import time
+import subprocess
+
+from create_groups.tests import MOCK_PATCH_DIR
+from benchmarks.run import (parse_args_code, get_regressions, default_baselines_location)
+
+def get_imported_modules(code, args):
+    """Run code with args in a new interpreter and get the modules it imported"""
+    code += "\nimport sys, json\nprint(json.dumps(sorted(sys.modules)))\n"
+    output = subprocess.run([sys.executable, '-c', code] + args, check=True,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return set(json.loads(output.splitlines()[-1]))
+
+def get_parse_args(tmp_path):
+    return ['from-arguments', '--out_location', str(tmp_path / 'patient_groups.json'),
+            'use-hd5', '--hd5_location', str(tmp_path), 'use-origin']
+
+def test_parse_args_does_not_import_group_creator(tmp_path):
+    modules = get_imported_modules(parse_args_code, get_parse_args(tmp_path))
+    assert 'create_groups.parser' in modules
+    assert not {'h5py', 'create_groups.creator', 'create_groups.table'} & modules
+    assert {module for module in modules if module.startswith('create_groups')} \
+            == {'create_groups', 'create_groups.defaults', 'create_groups.parser'}
+    # NumPy is only imported if the package submodule_utils imports it
+    assert ('numpy' in modules) == ('numpy' in get_imported_modules('import submodule_utils', []))
+
+def test_parse_args_is_within_startup_budget(tmp_path):
+    with open(default_baselines_location) as f:
+        baselines = json.load(f)
+    baseline = max((cohort_baselines['parse_args'] for cohort_baselines in baselines.values()),
+            key=lambda baseline: baseline['seconds'])
+    seconds = []
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', parse_args_code] + get_parse_args(tmp_path), check=True)
+        seconds.append(time.perf_counter() - start)
+    assert get_regressions({'parse_args': {'seconds': min(seconds), 'peak_mb': 0.}},
+            {'parse_args': baseline}) == []
+
+@pytest.mark.parametrize('out_format,is_h5py_imported', [('json', False), ('hdf5', True)])
+def test_use_extracted_patches_imports_h5py_only_for_hdf5(tmp_path, out_format, is_h5py_imported):
+    modules = get_imported_modules("""import sys, io, contextlib
+import create_groups
+from create_groups.parser import create_parser
+with contextlib.redirect_stdout(io.StringIO()):
+    create_groups.GroupCreator(create_parser().get_args(sys.argv[1:])).run()""",
+            ['from-arguments', '--out_format', out_format,
+            '--patch_pattern', 'annotation/subtype/slide/patch_size/magnification',
+            '--out_location', str(tmp_path / 'patient_groups'),
+            'use-extracted-patches', '--patch_location', MOCK_PATCH_DIR, 'use-origin'])
+    assert 'create_groups.creator' in modules
+    assert ('h5py' in modules) == is_h5py_imported
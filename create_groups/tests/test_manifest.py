@@ -0,0 +1,65 @@
+import pytest
+import glob
+import json
+import os
+
+import submodule_utils as utils
+
+from create_groups.tests import MOCK_PATCH_DIR
+from create_groups.manifest import ManifestIndex
+from create_groups.defaults import default_subtypes
+
+PATCH_PATTERN = 'annotation/subtype/slide/patch_size/magnification'
+
+def write_manifest(path, rows):
+    with open(path, 'w') as f:
+        f.write('origin,patient_id,slide_id,subtype\n')
+        for row in rows:
+            f.write(','.join(row) + '\n')
+
+def test_manifest_index_cache(tmp_path):
+    manifest_location = str(tmp_path / 'manifest.csv')
+    write_manifest(manifest_location, [('ovcare', 'VOA-100', 'VOA-100A', 'p53wt'),
+            ('ovcare', 'VOA-200', 'VOA-200A', 'p53abn')])
+    path = ManifestIndex.get_default_path(manifest_location)
+    assert path == str(tmp_path / '.manifest.csv.manifest_index.json')
+    assert ManifestIndex.get_default_path(manifest_location, str(tmp_path / 'cache')) \
+            .startswith(str(tmp_path / 'cache' / 'manifest_index_'))
+
+    index = ManifestIndex.load(manifest_location, path)
+    assert index.slides == {'VOA-100A': ('VOA-100', 'ovcare', 'p53wt'),
+            'VOA-200A': ('VOA-200', 'ovcare', 'p53abn')}
+    assert index.get_patient('VOA-200A') == 'ovcare__VOA-200'
+    assert index.get_patient('VOA-300A') is None
+    # the cached index is used while the manifest file is unchanged
+    with open(path) as f:
+        data = json.load(f)
+    data['slides']['VOA-200A'][0] = 'cached'
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    assert ManifestIndex.load(manifest_location, path).get_patient('VOA-200A') == 'ovcare__cached'
+    write_manifest(manifest_location, [('TCGA', 'VOA-100', 'VOA-100A', 'p53wt')])
+    index = ManifestIndex.load(manifest_location, path)
+    assert index.slides == {'VOA-100A': ('VOA-100', 'TCGA', 'p53wt')}
+    assert index.get_origins() == ['tcga']
+    assert ManifestIndex.load(manifest_location, path).slides == index.slides
+
+@pytest.mark.parametrize('is_binary', [False, True])
+def test_create_subtype_patient_slide_patch_dict_is_same_as_utils(tmp_path, is_binary):
+    patch_pattern = utils.create_patch_pattern(PATCH_PATTERN)
+    CategoryEnum = utils.create_category_enum(is_binary, subtypes=default_subtypes)
+    patch_paths = sorted(glob.glob(os.path.join(MOCK_PATCH_DIR, '**', '*.png'), recursive=True))
+    assert patch_paths
+    slide_ids = sorted({utils.get_slide_by_patch_id(utils.create_patch_id(patch_path, patch_pattern),
+            patch_pattern) for patch_path in patch_paths})
+    # the last slide is left out of the manifest and a slide has two rows
+    rows = [('ovcare', slide_id[:-1], slide_id, '') for slide_id in slide_ids[:-1]]
+    rows.append(('tcga', 'other', slide_ids[0], ''))
+    manifest_location = str(tmp_path / 'manifest.csv')
+    write_manifest(manifest_location, rows)
+    index = ManifestIndex.load(manifest_location)
+    expected = utils.create_subtype_patient_slide_patch_dict_manifest(patch_paths,
+            patch_pattern, CategoryEnum, utils.read_manifest(manifest_location), is_binary=is_binary)
+    subtype_patient_slide_patch = index.create_subtype_patient_slide_patch_dict(patch_paths,
+            patch_pattern, CategoryEnum, is_binary=is_binary)
+    assert json.dumps(subtype_patient_slide_patch) == json.dumps(expected)
@@ -0,0 +1,105 @@
+import pytest
+import os
+import json
+import logging
+import contextlib
+import io
+import tracemalloc
+
+from create_groups.tests import MOCK_PATCH_DIR
+from create_groups.parser import create_parser
+from create_groups.metrics import (StageMetrics, get_metrics_location)
+from create_groups import GroupCreator
+
+def create_group_creator(out_location, extra_args=''):
+    args_str = f"""
+    from-arguments
+    {extra_args}
+    --patch_pattern annotation/subtype/slide/patch_size/magnification
+    --out_location {out_location}
+    use-extracted-patches
+    --patch_location {MOCK_PATCH_DIR}
+    use-origin
+    """
+    return GroupCreator(create_parser().get_args(args_str.split()))
+
+def test_stage_metrics(tmp_path, caplog):
+    metrics = StageMetrics()
+    with caplog.at_level(logging.INFO, logger='create_groups'):
+        with metrics.stage('load', patches=10) as stage:
+            stage.count(slides=2)
+        with pytest.raises(RuntimeError):
+            with metrics.stage('fail'):
+                raise RuntimeError
+    assert [stage.name for stage in metrics.stages] == ['load', 'fail']
+    assert metrics.stages[0].counts == {'patches': 10, 'slides': 2}
+    assert 'Stage load' in caplog.text and 'Stage fail' in caplog.text
+    path = str(tmp_path / 'metrics.json')
+    metrics.write(path)
+    with open(path) as f:
+        assert json.load(f) == json.loads(json.dumps(metrics.to_dict()))
+    assert get_metrics_location('/path/to/patient_groups.json') == '/path/to/patient_groups.metrics.json'
+
+@pytest.mark.parametrize('extra_args', ['', '--out_of_core --memory_budget 0'])
+def test_run_writes_metrics(tmp_path, extra_args):
+    out_location = str(tmp_path / 'patient_groups.json')
+    gc = create_group_creator(out_location, f"--write_metrics {extra_args}")
+    with contextlib.redirect_stdout(io.StringIO()):
+        gc.run()
+    with open(get_metrics_location(out_location)) as f:
+        metrics = json.load(f)
+    stages = {stage['name']: stage for stage in metrics['stages']}
+    load_stage = 'spill_patches' if extra_args else 'scan_patches'
+    assert list(stages) == [load_stage] + ([] if extra_args else ['label_patches']) + [
+            'index_patches', 'assign_patients', 'sample_slides', 'select_patches',
+            'shuffle_group_subtypes', 'balance_groups', 'shuffle_groups',
+            'convert_groups', 'write_groups', 'print_group_summary']
+    with open(out_location) as f:
+        groups = json.load(f)
+    assert stages['write_groups']['counts']['patches'] \
+            == sum(len(chunk['imgs']) for chunk in groups['chunks'])
+    assert stages[load_stage]['counts']['patches'] >= stages['write_groups']['counts']['patches']
+    assert all(stage['wall_seconds'] >= 0 for stage in metrics['stages'])
+
+def test_run_does_not_write_metrics_by_default(tmp_path):
+    out_location = str(tmp_path / 'patient_groups.json')
+    gc = create_group_creator(out_location)
+    with contextlib.redirect_stdout(io.StringIO()):
+        gc.run()
+    assert not os.path.exists(get_metrics_location(out_location))
+    assert gc.metrics.stages
+
+def test_stage_metrics_trace_memory():
+    metrics = StageMetrics(trace_memory=True, n_allocation_sites=3)
+    with metrics.tracing():
+        with metrics.stage('allocate'):
+            retained = [bytearray(2**20) for _ in range(8)]
+            transient = bytearray(2**24)
+            del transient
+    assert not tracemalloc.is_tracing()
+    memory = metrics.stages[0].memory
+    assert memory['traced_peak_mb'] >= 8 + 16
+    assert 8 <= memory['traced_retained_diff_mb'] < 8 + 16
+    # the blocks still held at the end of the stage are counted as retained
+    assert memory['traced_retained_mb'] >= sum(len(block) for block in retained) / 2**20
+    assert memory['rss_peak_mb'] >= memory['rss_retained_mb'] > 0
+    assert len(memory['allocation_sites']) <= 3
+    assert memory['allocation_sites'][0]['site'].startswith(__file__)
+    assert memory['allocation_sites'][0]['size_diff_mb'] >= 8
+    assert metrics.to_dict()['traced_peak_mb'] == memory['traced_peak_mb']
+
+    metrics = StageMetrics()
+    with metrics.tracing():
+        with metrics.stage('allocate'):
+            bytearray(2**20)
+    assert metrics.stages[0].memory is None
+
+def test_run_traces_memory(tmp_path):
+    out_location = str(tmp_path / 'patient_groups.json')
+    gc = create_group_creator(out_location, '--write_metrics --trace_memory')
+    with contextlib.redirect_stdout(io.StringIO()):
+        gc.run()
+    with open(get_metrics_location(out_location)) as f:
+        metrics = json.load(f)
+    assert all('memory' in stage for stage in metrics['stages'])
+    assert metrics['rss_peak_mb'] > 0
@@ -0,0 +1,60 @@
+import pytest
+
+import submodule_utils as utils
+from create_groups.tests import (OUTPUT_DIR, MOCK_PATCH_DIR)
+from create_groups.parser import create_parser
+from create_groups.pattern import PatchPatternParser
+from create_groups import *
+
+def test_parse_patch_paths():
+    patch_pattern = utils.create_patch_pattern('annotation/subtype/slide/magnification')
+    parser = PatchPatternParser(patch_pattern)
+    assert parser.words == ['annotation', 'subtype', 'slide', 'magnification']
+    columns = parser.parse([
+        '/path/to/patches/Tumor/MMRD/VOA-1234A/10/1_2.png',
+        'Stroma/P53ABN/VOA-1234B/20/',
+        'P53ABN/VOA-1234B/20/1_2.png',
+    ])
+    assert columns == {'root': ['/path/to/patches', None, None],
+            'annotation': ['Tumor', None, None], 'subtype': ['MMRD', None, None],
+            'slide': ['VOA-1234A', None, None], 'magnification': ['10', None, None],
+            'name': ['1_2.png', None, None]}
+    assert parser.parse(['/Stroma/P53ABN/VOA-1234B/20/']) == {'root': [''],
+            'annotation': ['Stroma'], 'subtype': ['P53ABN'], 'slide': ['VOA-1234B'],
+            'magnification': ['20'], 'name': ['']}
+    assert parser.parse([]) == {'root': [], 'annotation': [], 'subtype': [], 'slide': [],
+            'magnification': [], 'name': []}
+
+def test_group_summary_from_patch_table(capsys):
+    patch_pattern = 'annotation/subtype/slide/patch_size/magnification'
+    args_str = f"""
+    from-arguments
+    --patch_pattern {patch_pattern}
+    --out_location {OUTPUT_DIR}
+    --max_patient_patches 20
+    use-extracted-patches
+    --patch_location {MOCK_PATCH_DIR}
+    use-origin
+    """
+    parser = create_parser()
+    config = parser.get_args(args_str.split())
+    gc = GroupCreator(config)
+    patch_table, group_rows, _ = gc.generate_group_rows()
+    assert 'annotation' in patch_table.directory_columns
+    assert 'magnification' not in patch_table.directory_columns
+    assert sorted(patch_table.directory_columns['category'][0]) == ['MMRD', 'P53ABN', 'P53WT', 'POLE']
+    # the labels from the parsed columns are the ones parsed from the first patch path of each directory
+    categories, category_codes = patch_table.directory_columns['category']
+    slide_ids, slide_codes = patch_table.directory_columns['slide_id']
+    for directory, row in enumerate(patch_table.get_first_row_of_directories().tolist()):
+        patch_id = utils.create_patch_id(patch_table.get_path(row), gc.patch_pattern)
+        assert slide_ids[slide_codes[directory]] == utils.get_slide_by_patch_id(patch_id, gc.patch_pattern)
+        assert categories[category_codes[directory]] == utils.get_label_by_patch_id(patch_id,
+                gc.patch_pattern, gc.CategoryEnum).name
+    groups = {group_id: patch_table.get_paths(rows) for group_id, rows in group_rows.items()}
+    capsys.readouterr()
+    gc.group_summary(groups)
+    expected = capsys.readouterr().out
+    gc.group_summary(group_rows, patch_table=patch_table)
+    actual = capsys.readouterr().out
+    assert actual == expected
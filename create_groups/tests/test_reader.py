@@ -0,0 +1,52 @@
+import pytest
+import pickle
+import multiprocessing
+
+from create_groups.writer import (write_binary, write_json)
+from create_groups.reader import (GroupsFileReader, MappedGroup)
+
+def generate_groups():
+    patch_paths = [f"/patches/Tumor/MMRD/VOA-{i % 7}00A/{i}_{i * 2}.png" for i in range(50)]
+    patch_paths += ['/patches/Tumor/MMRD/VOA-100A/été.png']
+    return {
+        'chunks': [
+            {'id': 0, 'imgs': patch_paths[:20]},
+            {'id': 1, 'imgs': []},
+            {'id': 2, 'imgs': patch_paths[20:]},
+        ]
+    }
+
+def get_length_and_path(reader, chunk_id, idx):
+    return len(reader[chunk_id]), reader[chunk_id][idx]
+
+@pytest.mark.parametrize('out_format', ['hdf5', 'npz'])
+def test_groups_file_reader(tmp_path, out_format):
+    groups = generate_groups()
+    out_location = str(tmp_path / f"patient_groups.{out_format}")
+    write_binary(out_location, groups, out_format)
+    with GroupsFileReader(out_location) as reader:
+        assert list(reader.keys()) == [0, 1, 2]
+        for chunk in groups['chunks']:
+            group = reader[chunk['id']]
+            assert isinstance(group, MappedGroup)
+            assert len(group) == len(chunk['imgs'])
+            assert list(group) == chunk['imgs']
+            assert group[2:9:3] == chunk['imgs'][2:9:3]
+            if chunk['imgs']:
+                assert group[-1] == chunk['imgs'][-1]
+        with pytest.raises(IndexError):
+            reader[0][20]
+        with pytest.raises(KeyError):
+            reader[3]
+        assert reader.to_mitch_format() == groups
+        reader = pickle.loads(pickle.dumps(reader))
+        assert reader[2][30] == groups['chunks'][2]['imgs'][30]
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            assert pool.apply(get_length_and_path, (reader, 2, -1)) \
+                    == (31, groups['chunks'][2]['imgs'][-1])
+
+def test_groups_file_reader_needs_binary_file(tmp_path):
+    out_location = str(tmp_path / 'patient_groups.json')
+    write_json(out_location, generate_groups())
+    with pytest.raises(NotImplementedError):
+        GroupsFileReader(out_location)
@@ -0,0 +1,87 @@
+import pytest
+import random
+
+from create_groups.rng import RandomStreams
+
+def generate_key_items(n_lists=20):
+    return [(('MMRD', f"patient{i}", f"slide{i}"), list(range(i * 10))) for i in range(n_lists)]
+
+def test_legacy_shuffle_each_seeds_every_list():
+    key_items = generate_key_items()
+    expected = []
+    for _, items in key_items:
+        items = list(items)
+        random.seed(256)
+        random.shuffle(items)
+        expected.append(items)
+    RandomStreams(256, is_legacy=True).shuffle_each('slide', key_items)
+    assert [items for _, items in key_items] == expected
+
+def test_legacy_shuffle_sequence_seeds_once():
+    key_items = generate_key_items()
+    expected = [list(items) for _, items in key_items]
+    random.seed(256)
+    for items in expected:
+        random.shuffle(items)
+    RandomStreams(256, is_legacy=True).shuffle_sequence('patient', key_items)
+    assert [items for _, items in key_items] == expected
+
+@pytest.mark.parametrize('workers', [1, 2, 8])
+def test_shuffle_each_does_not_depend_on_workers_or_order(workers):
+    expected = generate_key_items()
+    RandomStreams(256, workers=1).shuffle_each('slide', expected)
+    key_items = generate_key_items()[::-1]
+    RandomStreams(256, workers=workers).shuffle_each('slide', key_items)
+    assert key_items[::-1] == expected
+    for (_, items), (_, original) in zip(expected, generate_key_items()):
+        assert sorted(items) == original
+    key_items = generate_key_items()
+    RandomStreams(256, workers=workers).shuffle_sequence('slide', key_items)
+    assert key_items == expected
+
+def test_streams_differ_by_seed_stage_and_key():
+    items = lambda: list(range(100))
+    permutations = []
+    for seed, stage, key in [(256, 'slide', 'a'), (257, 'slide', 'a'),
+            (256, 'group', 'a'), (256, 'slide', 'b')]:
+        shuffled = items()
+        RandomStreams(seed).shuffle_each(stage, [(key, shuffled)])
+        permutations.append(shuffled)
+    assert all(p != permutations[0] for p in permutations[1:])
+
+@pytest.mark.parametrize('n,k', [(0, 0), (1, 1), (10, 0), (10, 3), (10, 10), (1000, 20)])
+def test_sample_permutation_prefix(n, k):
+    import numpy as np
+    from create_groups.rng import sample_permutation_prefix
+    prefix = sample_permutation_prefix(np.random.default_rng(0), n, k)
+    assert len(prefix) == k
+    assert len(set(prefix)) == k
+    assert all(0 <= idx < n for idx in prefix)
+
+def test_sample_each_keeps_count_items():
+    key_items = generate_key_items()
+    key_items_counts = [(key, items, 7) for key, items in key_items]
+    RandomStreams(256).sample_each('slide', key_items_counts)
+    for (_, items), (_, original) in zip(key_items, generate_key_items()):
+        if len(original) <= 7:
+            assert sorted(items) == original
+        else:
+            assert len(items) == 7
+            assert set(items) < set(original)
+    # legacy mode shuffles and keeps the whole lists
+    key_items = generate_key_items()
+    expected = generate_key_items()
+    RandomStreams(256, is_legacy=True).shuffle_each('slide', expected)
+    RandomStreams(256, is_legacy=True).sample_each('slide',
+            [(key, items, 7) for key, items in key_items])
+    assert key_items == expected
+
+@pytest.mark.parametrize('is_legacy', [False, True])
+def test_sample_positions_each_is_same_as_sample_each(is_legacy):
+    key_items = generate_key_items()
+    key_items_counts = [(key, items, 7) for key, items in key_items]
+    RandomStreams(256, is_legacy=is_legacy).sample_each('slide', key_items_counts)
+    positions = RandomStreams(256, is_legacy=is_legacy, workers=3).sample_positions_each('slide',
+            [(key, len(items), 7) for key, items in generate_key_items()])
+    for (_, items), (_, original), key_positions in zip(key_items, generate_key_items(), positions):
+        assert [original[idx] for idx in key_positions.tolist()] == items
@@ -0,0 +1,211 @@
+import pytest
+import glob
+import os
+
+import submodule_utils as utils
+from create_groups.tests import (OUTPUT_DIR, MOCK_PATCH_DIR)
+from create_groups.parser import create_parser
+from create_groups.scan import (ScanIndex, PatchDirectoryScanner, iter_patch_paths,
+        write_scan_shard, merge_scan_shards)
+from create_groups import *
+
+def create_group_creator(patch_pattern, filter_labels={}, scan_workers=1, scan_in_flight=0):
+    filter_labels_str = ''
+    if filter_labels:
+        filter_labels_str = f"--filter_labels {utils.dict_to_space_sep_eql(filter_labels)}"
+    args_str = f"""
+    from-arguments
+    {filter_labels_str}
+    --patch_pattern {patch_pattern}
+    --out_location {OUTPUT_DIR}
+    --is_binary
+    use-extracted-patches
+    --patch_location {MOCK_PATCH_DIR}
+    --scan_workers {scan_workers}
+    --scan_in_flight {scan_in_flight}
+    use-origin
+    """
+    parser = create_parser()
+    config = parser.get_args(args_str.split())
+    return GroupCreator(config)
+
+def glob_patch_paths(gc):
+    patch_paths = []
+    for wildcard in gc.get_patch_path_wildcards(gc.patch_location, r'*.[jp][pn]g'):
+        patch_paths += glob.glob(wildcard)
+    patch_paths.sort()
+    return patch_paths
+
+@pytest.mark.parametrize('scan_workers,scan_in_flight', [(1, 0), (4, 0), (1, 16)])
+@pytest.mark.parametrize('filter_labels', [
+    {},
+    {'patch_size': '256', 'magnification': '10', 'annotation': 'Tumor'},
+    {'patch_size': '512', 'magnification': '10'},
+    {'subtype': 'p53abn'},
+])
+def test_get_patch_paths_matches_glob(filter_labels, scan_workers, scan_in_flight):
+    patch_pattern = 'annotation/subtype/slide/patch_size/magnification'
+    gc = create_group_creator(patch_pattern, filter_labels=filter_labels,
+            scan_workers=scan_workers, scan_in_flight=scan_in_flight)
+    assert gc.scan_workers == scan_workers
+    assert gc.scan_in_flight == scan_in_flight
+    assert gc.get_patch_paths() == glob_patch_paths(gc)
+
+def test_scan_patch_directories_is_sorted():
+    patch_pattern = 'annotation/subtype/slide/patch_size/magnification'
+    gc = create_group_creator(patch_pattern, scan_workers=4)
+    leaves = gc.scan_patch_directories()
+    assert len(leaves) == 432
+    for directory, names in leaves:
+        assert names == sorted(names)
+        assert len(names) == 4
+    assert list(iter_patch_paths(leaves)) == gc.get_patch_paths()
+
+def test_scanner_skips_hidden_and_non_patch_files(tmp_path):
+    for slide in ['VOA-1A', 'VOA-1A-B', '.VOA-2A']:
+        os.makedirs(tmp_path / 'MMRD' / slide)
+        for name in ['1_1.png', '1_2.jpg', '.1_3.png', '1_4.txt']:
+            (tmp_path / 'MMRD' / slide / name).touch()
+    (tmp_path / 'MMRD' / 'not_a_slide.png').touch()
+    wildcard = os.path.join(str(tmp_path), '**', '**', r'*.[jp][pn]g')
+    for workers in [1, 2]:
+        scanner = PatchDirectoryScanner(str(tmp_path), [wildcard],
+                workers=workers, split_level=2)
+        actual = list(iter_patch_paths(scanner.scan()))
+        assert actual == sorted(glob.glob(wildcard))
+        assert len(actual) == 4
+
+@pytest.mark.parametrize('in_flight', [1, 3, 64])
+def test_async_scan_is_same_as_thread_scan(in_flight):
+    patch_pattern = 'annotation/subtype/slide/patch_size/magnification'
+    gc = create_group_creator(patch_pattern, scan_workers=4)
+    wildcards = gc.get_patch_path_wildcards(gc.patch_location, r'*.[jp][pn]g')
+    scanner = PatchDirectoryScanner(gc.patch_location, wildcards, workers=4, split_level=3)
+    async_scanner = PatchDirectoryScanner(gc.patch_location, wildcards, split_level=3,
+            in_flight=in_flight)
+    assert async_scanner.scan() == scanner.scan()
+    assert async_scanner.n_listings == scanner.n_listings > 432
+    assert 1 <= async_scanner.max_listings_in_flight <= in_flight
+    assert async_scanner.get_listing_rate() > 0
+    # the scan stops when the caller closes it early
+    leaves = async_scanner.iter_scan()
+    assert next(leaves) == scanner.scan()[0]
+    leaves.close()
+
+def make_old(path, mtime=1e9):
+    for dirpath, _, _ in os.walk(path):
+        os.utime(dirpath, (mtime, mtime))
+
+def test_scan_index_reuses_unchanged_directories(tmp_path):
+    patch_location = tmp_path / 'patches'
+    for slide in ['VOA-1A', 'VOA-1B', 'VOA-2A']:
+        os.makedirs(patch_location / 'MMRD' / slide)
+        for name in ['1_1.png', '1_2.png']:
+            (patch_location / 'MMRD' / slide / name).touch()
+    make_old(patch_location)
+    patch_location = str(patch_location)
+    wildcard = os.path.join(patch_location, '**', '**', r'*.[jp][pn]g')
+    index_path = ScanIndex.get_default_path(patch_location, str(tmp_path))
+
+    def scan():
+        index = ScanIndex.load(index_path, patch_location)
+        scanner = PatchDirectoryScanner(patch_location, [wildcard],
+                workers=2, split_level=2, index=index)
+        patch_paths = list(iter_patch_paths(scanner.scan()))
+        index.save()
+        return index, patch_paths
+
+    index, expected = scan()
+    assert (index.hits, index.misses) == (0, 5)
+    assert len(expected) == 6
+    index, actual = scan()
+    assert (index.hits, index.misses) == (5, 0)
+    assert actual == expected
+
+    (tmp_path / 'patches' / 'MMRD' / 'VOA-1B' / '1_3.png').touch()
+    make_old(tmp_path / 'patches' / 'MMRD' / 'VOA-1B', mtime=2e9)
+    index, actual = scan()
+    assert (index.hits, index.misses) == (4, 1)
+    assert actual == sorted(glob.glob(wildcard))
+    assert len(actual) == 7
+
+def test_scan_index_save_removes_temporary_file_on_error(tmp_path):
+    index_path = str(tmp_path / 'scan_index.json')
+    index = ScanIndex(index_path, str(tmp_path))
+    index.updated_directories[str(tmp_path)] = [0, [], [object()]]
+    with pytest.raises(TypeError):
+        index.save()
+    assert os.listdir(str(tmp_path)) == []
+
+def test_scan_index_ignores_other_patch_location(tmp_path):
+    index_path = str(tmp_path / 'index.json')
+    index = ScanIndex(index_path, str(tmp_path / 'a'))
+    index.updated_directories[str(tmp_path / 'a')] = [0, [], []]
+    index.save()
+    assert ScanIndex.load(index_path, str(tmp_path / 'a')).directories != {}
+    assert ScanIndex.load(index_path, str(tmp_path / 'b')).directories == {}
+
+@pytest.mark.parametrize('n_shards', [1, 3, 8])
+def test_merge_scan_shards_is_same_as_scan(tmp_path, n_shards):
+    patch_pattern = 'annotation/subtype/slide/patch_size/magnification'
+    gc = create_group_creator(patch_pattern, scan_workers=4)
+    wildcards = gc.get_patch_path_wildcards(gc.patch_location, r'*.[jp][pn]g')
+    scanner = PatchDirectoryScanner(gc.patch_location, wildcards, workers=2, split_level=3)
+    shard_paths = []
+    n_leaves = 0
+    for shard_index in range(n_shards):
+        leaves = list(scanner.iter_scan(shard_index=shard_index, n_shards=n_shards))
+        n_leaves += len(leaves)
+        shard_paths.append(str(tmp_path / f"shard_{shard_index}.npz"))
+        write_scan_shard(shard_paths[-1], leaves, gc.patch_location, wildcards,
+                shard_index, n_shards)
+    assert n_leaves == 432
+    patch_location, shard_wildcards, leaves = merge_scan_shards(shard_paths[::-1])
+    # the shards store the absolute patch_location
+    abs_patch_location = os.path.abspath(gc.patch_location)
+    assert patch_location == abs_patch_location
+    assert shard_wildcards == gc.get_patch_path_wildcards(abs_patch_location, r'*.[jp][pn]g')
+    assert list(leaves) == PatchDirectoryScanner(abs_patch_location, shard_wildcards,
+            workers=2, split_level=3).scan()
+
+def test_scan_shards_from_different_working_directories_merge(tmp_path, monkeypatch):
+    abs_patch_location = os.path.abspath(MOCK_PATCH_DIR)
+    os.makedirs(tmp_path / 'job')
+    n_shards = 2
+    for shard_index, cwd in enumerate([os.getcwd(), str(tmp_path / 'job')]):
+        monkeypatch.chdir(cwd)
+        args_str = f"""
+        from-arguments
+        --patch_pattern annotation/subtype/slide/patch_size/magnification
+        --out_location {tmp_path / f"shard_{shard_index}.npz"}
+        scan-shard
+        --patch_location {os.path.relpath(abs_patch_location)}
+        --shard_index {shard_index}
+        --n_shards {n_shards}
+        """
+        gc = GroupCreator(create_parser().get_args(args_str.split()))
+        gc.scan_shard()
+    patch_location, wildcards, leaves = merge_scan_shards(
+            [str(tmp_path / f"shard_{shard_index}.npz") for shard_index in range(n_shards)])
+    assert patch_location == abs_patch_location
+    assert list(leaves) == PatchDirectoryScanner(abs_patch_location, wildcards,
+            split_level=3).scan()
+
+    gc.out_location = str(tmp_path / 'shard_0.json')
+    with pytest.raises(ValueError, match='does not end in .npz'):
+        gc.scan_shard()
+
+def test_merge_scan_shards_needs_every_shard(tmp_path):
+    leaves = [('/patches/MMRD/VOA-1A', ['1_1.png'])]
+    wildcard = '/patches/**/**/*.png'
+    for shard_index in [0, 2, 2]:
+        write_scan_shard(str(tmp_path / f"shard_{shard_index}.npz"), leaves, '/patches',
+                [wildcard], shard_index, 4)
+    with pytest.raises(ValueError, match=r"Missing shards: \[1, 3\]"):
+        merge_scan_shards([str(tmp_path / 'shard_0.npz'), str(tmp_path / 'shard_2.npz')])
+    with pytest.raises(ValueError, match=r"Duplicated shards: \[2\]"):
+        merge_scan_shards([str(tmp_path / 'shard_2.npz')] * 2)
+    write_scan_shard(str(tmp_path / 'shard_1.npz'), leaves, '/other_patches',
+            [wildcard], 1, 4)
+    with pytest.raises(ValueError, match='patch_location'):
+        merge_scan_shards([str(tmp_path / 'shard_0.npz'), str(tmp_path / 'shard_1.npz')])
@@ -0,0 +1,86 @@
+import pytest
+import os
+import random
+
+import numpy as np
+
+from create_groups.spill import (PatchSpill, SpilledPaths)
+
+def generate_patch_paths():
+    patch_paths = []
+    for annotation in ['Tumor', 'Stroma']:
+        for subtype in ['MMRd', 'POLE']:
+            for slide in ['VOA-100A', 'VOA-100B', 'VOA-200A', 'VOA-300A']:
+                for x in range(5):
+                    patch_paths.append(f"/patches/{annotation}/{subtype}/{slide}/{x}_{x * 2}.png")
+    patch_paths.append('/patches/Tumor/MMRd/VOA-100A/été.png')
+    return patch_paths
+
+def label_patch_path(patch_path):
+    _, _, annotation, subtype, slide, _ = patch_path.split('/')
+    return subtype, slide[:7], slide
+
+def is_dropped(patch_path):
+    return '/Stroma/POLE/VOA-200A/' in patch_path
+
+def create_spill(spill_location, patch_paths, **kwargs):
+    spill = PatchSpill(spill_location, **kwargs)
+    for patch_path in patch_paths:
+        idx = patch_path.rfind('/') + 1
+        directory_id, is_new = spill.intern_directory(patch_path[:idx])
+        if is_new and not is_dropped(patch_path):
+            spill.set_directory_label(directory_id, *label_patch_path(patch_path))
+        spill.append(directory_id, [patch_path[idx:]])
+    spill.finish()
+    return spill
+
+@pytest.mark.parametrize('memory_budget,n_partitions', [(2**20, 64), (0, 3), (0, 1)])
+def test_patch_spill_is_same_as_patch_table(tmp_path, memory_budget, n_partitions):
+    """Test that the slides of a spill have the same keys and patch paths as the slides of a patch table"""
+    patch_paths = generate_patch_paths()
+    random.seed(2)
+    random.shuffle(patch_paths)
+    expected = {}
+    for patch_path in patch_paths:
+        if not is_dropped(patch_path):
+            subtype, patient, slide = label_patch_path(patch_path)
+            expected.setdefault(subtype, {}).setdefault(patient, {}) \
+                    .setdefault(slide, []).append(patch_path)
+
+    spill = create_spill(str(tmp_path), patch_paths, memory_budget=memory_budget,
+            n_partitions=n_partitions)
+    assert len(spill) == sum(not is_dropped(p) for p in patch_paths)
+    subtype_patient_slide_patch = spill.create_subtype_patient_slide_patch_dict()
+    assert list(subtype_patient_slide_patch.keys()) == list(expected.keys())
+    for subtype, patient_slide_patch in expected.items():
+        assert list(subtype_patient_slide_patch[subtype].keys()) == list(patient_slide_patch.keys())
+        for patient, slide_patch in patient_slide_patch.items():
+            assert list(subtype_patient_slide_patch[subtype][patient].keys()) \
+                    == list(slide_patch.keys())
+
+    slide_records = {}
+    for partition_slide_records in spill.iter_partition_slide_records():
+        assert not slide_records.keys() & partition_slide_records.keys()
+        slide_records.update(partition_slide_records)
+    for subtype, patient_slide_patch in expected.items():
+        for patient, slide_patch in patient_slide_patch.items():
+            for slide, patches in slide_patch.items():
+                records = slide_records[(subtype, patient, slide)]
+                assert len(records) == len(subtype_patient_slide_patch[subtype][patient][slide])
+                assert spill.get_paths(records) == patches
+    spill.close()
+    assert not os.listdir(str(tmp_path))
+
+def test_spilled_paths_view(tmp_path):
+    patch_paths = generate_patch_paths()
+    spill = create_spill(str(tmp_path), patch_paths, memory_budget=0, n_partitions=4)
+    records = np.concatenate(list(records for partition_slide_records \
+            in spill.iter_partition_slide_records() \
+            for records in partition_slide_records.values()))
+    view = spill.view(records[::-1])
+    assert isinstance(view, SpilledPaths)
+    assert len(view) == len(records)
+    assert sorted(view) == sorted(p for p in patch_paths if not is_dropped(p))
+    assert view[1:3] == [view[1], view[2]]
+    assert list(view.__iter__(batch_size=7)) == list(view)
+    spill.close()
@@ -0,0 +1,57 @@
+import pytest
+import contextlib
+import io
+
+import numpy as np
+
+from submodule_utils.metadata.group import convert_mitch_to_yiping_format
+
+from create_groups.tests import MOCK_PATCH_DIR
+from create_groups.parser import create_parser
+from create_groups.reader import load_groups
+from create_groups.summary import summarize_groups
+from create_groups import GroupCreator
+
+def create_group_creator(out_location, extra_args=''):
+    args_str = f"""
+    from-arguments
+    {extra_args}
+    --patch_pattern annotation/subtype/slide/patch_size/magnification
+    --out_location {out_location}
+    use-extracted-patches
+    --patch_location {MOCK_PATCH_DIR}
+    use-origin
+    """
+    return GroupCreator(create_parser().get_args(args_str.split()))
+
+def test_summarize_groups():
+    # directories: (category, patient, slide)
+    directory_category = np.array([0, 1, 1, 0, -1])
+    directory_patient = np.array([0, 0, 1, 2, 2])
+    directory_slide = np.array([0, 1, 2, 3, 3])
+    summary = summarize_groups(['Group 1', 'Group 2'], ['A', 'B'],
+            [np.array([1, 0, 0, 2, 4]), np.array([3, 0, 3])],
+            directory_category, directory_patient, directory_slide)
+    assert len(summary) == 6
+    assert summary['group'].tolist() == ['Group 1', 'Group 1', 'Group 2', 'Group 2', 'Total', 'Total']
+    assert summary['category'].tolist() == ['A', 'B'] * 3
+    # patient 0 is counted by its first patch in each group, and once in total
+    assert summary.pivot('patients').tolist() == [[0, 2], [2, 0], [1, 2]]
+    assert summary.pivot('slides').tolist() == [[1, 2], [2, 0], [2, 2]]
+    assert summary.pivot('patches').tolist() == [[2, 2], [3, 0], [5, 2]]
+    assert summary.to_dict()['patches'] == [2, 2, 3, 0, 5, 2]
+
+@pytest.mark.parametrize('extra_args', ['', '--is_binary --max_patient_patches 20',
+        '--out_of_core --memory_budget 0', '--out_format npz --n_groups 4'])
+def test_print_group_summary_is_same_as_group_summary(tmp_path, extra_args):
+    out_location = str(tmp_path / 'patient_groups')
+    gc = create_group_creator(out_location, extra_args)
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        summary = gc.run()
+    run_output = output.getvalue()
+    groups = convert_mitch_to_yiping_format(load_groups(out_location))
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        expected = gc.group_summary(groups)
+    assert summary.to_dict() == expected.to_dict()
+    assert run_output.startswith(output.getvalue())
+    assert summary.pivot('patches')[-1].sum() == sum(len(patches) for patches in groups.values())
@@ -0,0 +1,86 @@
+import pytest
+import json
+import argparse
+import contextlib
+import io
+
+from create_groups.tests import MOCK_PATCH_DIR
+from create_groups.parser import create_parser
+from create_groups.sweep import read_sweep
+from create_groups import GroupCreator
+
+def create_group_creator(out_location, extra_args=''):
+    args_str = f"""
+    from-arguments
+    {extra_args}
+    --patch_pattern annotation/subtype/slide/patch_size/magnification
+    --out_location {out_location}
+    use-extracted-patches
+    --patch_location {MOCK_PATCH_DIR}
+    use-origin
+    """
+    return GroupCreator(create_parser().get_args(args_str.split()))
+
+def test_read_sweep(tmp_path):
+    sweep_location = str(tmp_path / 'sweep.json')
+    with open(sweep_location, 'w') as f:
+        json.dump([{'out_location': 'a.json', 'seed': '3', 'balance_patches': 'group=100'},
+                {'out_location': 'b.json', 'max_patient_patches': None}], f)
+    assert read_sweep(sweep_location) == [
+        {'out_location': 'a.json', 'seed': 3, 'balance_patches': ('group', 100)},
+        {'out_location': 'b.json', 'max_patient_patches': None},
+    ]
+    for sweep_configs, message in [
+            ([{'seed': 1}], 'does not set out_location'),
+            ([{'out_location': 'a.json', 'patch_location': 'patches'}], 'unknown options'),
+            ([{'out_location': 'a.json'}, {'out_location': 'a.json'}], 'distinct out_location'),
+            ([{'out_location': 'a.json', 'out_format': 'csv'}], 'Out format'),
+            ([{'out_location': 'a.json', 'legacy_shuffle': 'false'}], 'not a JSON boolean'),
+            ([{'out_location': 'a.json', 'is_binary': 0}], 'not a JSON boolean'),
+            ([], 'non-empty list')]:
+        with open(sweep_location, 'w') as f:
+            json.dump(sweep_configs, f)
+        with pytest.raises(ValueError, match=message):
+            read_sweep(sweep_location)
+    for subtypes, message in [
+            ({'MMRD': 'one'}, r"MMRD='one'"),
+            ({'MMRD': 1.5}, r"MMRD=1\.5"),
+            ({'MMRD': None}, r"MMRD=None"),
+            ('MMRD=1', 'not a non-empty JSON object'),
+            ({}, 'not a non-empty JSON object')]:
+        with open(sweep_location, 'w') as f:
+            json.dump([{'out_location': 'a.json', 'subtypes': subtypes}], f)
+        with pytest.raises(argparse.ArgumentTypeError, match=message):
+            read_sweep(sweep_location)
+
+@pytest.mark.parametrize('sweep_workers', [1, 2])
+def test_sweep_is_same_as_separate_runs(tmp_path, sweep_workers):
+    sweep_configs = [
+        {'seed': 1},
+        {'is_binary': True, 'balance_patches': 'overall'},
+        {'n_groups': 2, 'max_patient_patches': 10, 'out_format': 'npz'},
+        {'subtypes': {'MMRD': 1, 'P53ABN': 0, 'P53WT': 3, 'POLE': 2}, 'balance_patches': 'group=20'},
+    ]
+    for idx, sweep_config in enumerate(sweep_configs):
+        sweep_config['out_location'] = str(tmp_path / f"groups_{idx}")
+    sweep_location = str(tmp_path / 'sweep.json')
+    with open(sweep_location, 'w') as f:
+        json.dump(sweep_configs, f)
+    gc = create_group_creator(str(tmp_path / 'groups.json'),
+            f"--sweep_location {sweep_location} --sweep_workers {sweep_workers}")
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        gc.run()
+    sweep_output = output.getvalue()
+
+    for idx, sweep_config in enumerate(sweep_configs):
+        single_location = str(tmp_path / f"single_{idx}")
+        gc = create_group_creator(single_location)
+        for option, value in read_sweep(sweep_location)[idx].items():
+            setattr(gc, option, value)
+        gc.out_location = single_location
+        gc = gc.create_sweep_group_creator({})
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            gc.run()
+        assert output.getvalue() in sweep_output
+        with open(sweep_config['out_location'], 'rb') as f, open(single_location, 'rb') as g:
+            assert f.read() == g.read()
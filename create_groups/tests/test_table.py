@@ -0,0 +1,98 @@
+import pytest
+import random
+
+import numpy as np
+
+from create_groups.table import (PatchTable, PatchPaths)
+
+def generate_patch_paths():
+    patch_paths = []
+    for annotation in ['Tumor', 'Stroma']:
+        for subtype in ['MMRd', 'POLE']:
+            for slide in ['VOA-100A', 'VOA-100B', 'VOA-200A', 'VOA-200A-1']:
+                for x in [0, 100, 2048]:
+                    for y in [0, 512]:
+                        patch_paths.append(f"/patches/{annotation}/{subtype}/{slide}/{x}_{y}.png")
+    patch_paths += [
+        '/patches/Tumor/MMRd/VOA-100A/0100_200.png',
+        '/patches/Tumor/MMRd/VOA-100A/patch.png',
+        '/patches/Tumor/MMRd/VOA-100A/1_2.tar.gz',
+        '/patches/Tumor/MMRd/VOA-100A/1_2.jpg',
+        '/patches/Tumor/MMRd/VOA-100A/1_2',
+    ]
+    return patch_paths
+
+def label_patch_path(patch_path):
+    _, _, annotation, subtype, slide, _ = patch_path.split('/')
+    return subtype, slide[:7], slide
+
+def test_patch_table_from_paths():
+    patch_paths = generate_patch_paths()
+    random.seed(0)
+    random.shuffle(patch_paths)
+    patch_table = PatchTable.from_paths(patch_paths)
+    assert len(patch_table) == len(patch_paths)
+    assert patch_table.get_paths() == patch_paths
+    assert [patch_table.get_path(row) for row in range(len(patch_paths))] == patch_paths
+    assert len(patch_table.directories) == 16
+    assert sorted(patch_table.extensions) == ['.jpg', '.png']
+    assert sorted(patch_table.names) == ['0100_200.png', '1_2', '1_2.tar.gz', 'patch.png']
+
+def test_patch_table_from_directories():
+    leaves = [
+        ('/patches/Tumor/MMRd/VOA-100A', ['0_0.png', '0_1.png']),
+        ('/patches/Tumor/MMRd/VOA-100A-1', ['a.png']),
+    ]
+    patch_table = PatchTable.from_directories(leaves)
+    assert patch_table.get_paths() == [
+        '/patches/Tumor/MMRd/VOA-100A/0_0.png',
+        '/patches/Tumor/MMRd/VOA-100A/0_1.png',
+        '/patches/Tumor/MMRd/VOA-100A-1/a.png',
+    ]
+    assert patch_table.directories == ['/patches/Tumor/MMRd/VOA-100A/',
+            '/patches/Tumor/MMRd/VOA-100A-1/']
+
+def test_create_subtype_patient_slide_patch_dict():
+    """Test that grouping rows by directory labels is the same as grouping path by path"""
+    patch_paths = generate_patch_paths()
+    random.seed(1)
+    random.shuffle(patch_paths)
+    # drop the labels of a directory
+    is_dropped = lambda p: '/Stroma/POLE/VOA-200A/' in p
+    expected = {}
+    for row, patch_path in enumerate(patch_paths):
+        if is_dropped(patch_path):
+            continue
+        subtype, patient, slide = label_patch_path(patch_path)
+        expected.setdefault(subtype, {}).setdefault(patient, {}).setdefault(slide, []).append(row)
+
+    patch_table = PatchTable.from_paths(patch_paths)
+    first_rows = patch_table.get_first_row_of_directories()
+    directories = np.argsort(first_rows, kind='stable')
+    subtype_patient_slide_directory = {}
+    for directory in directories.tolist():
+        patch_path = patch_table.get_path(first_rows[directory])
+        if is_dropped(patch_path):
+            continue
+        subtype, patient, slide = label_patch_path(patch_path)
+        subtype_patient_slide_directory.setdefault(subtype, {}).setdefault(patient, {}) \
+                .setdefault(slide, []).append(directory)
+    patch_table.set_directory_labels(subtype_patient_slide_directory)
+    actual = patch_table.create_subtype_patient_slide_patch_dict()
+    assert actual == expected
+    assert list(actual.keys()) == list(expected.keys())
+    for subtype in expected.keys():
+        assert list(actual[subtype].keys()) == list(expected[subtype].keys())
+        for patient in expected[subtype].keys():
+            assert list(actual[subtype][patient].keys()) == list(expected[subtype][patient].keys())
+
+def test_patch_paths_view():
+    patch_paths = generate_patch_paths()
+    patch_table = PatchTable.from_paths(patch_paths)
+    rows = [5, 3, 100, 0]
+    view = patch_table.view(rows)
+    assert isinstance(view, PatchPaths)
+    assert len(view) == 4
+    assert list(view) == [patch_paths[r] for r in rows]
+    assert view[2] == patch_paths[100]
+    assert view[1:3] == [patch_paths[3], patch_paths[100]]
@@ -0,0 +1,150 @@
+import pytest
+import os
+import json
+import shutil
+import contextlib
+import collections
+import io
+
+from create_groups.tests import MOCK_PATCH_DIR
+from create_groups.parser import create_parser
+from create_groups import GroupCreator
+
+def run_group_creator(patch_location, out_location, update_from=None, shuffle='--legacy_shuffle', options=''):
+    update_from_str = f"--update_from {update_from}" if update_from else ''
+    args_str = f"""
+    from-arguments
+    {shuffle}
+    {options}
+    {update_from_str}
+    --patch_pattern annotation/subtype/slide/patch_size/magnification
+    --out_location {out_location}
+    use-extracted-patches
+    --patch_location {patch_location}
+    use-origin
+    """
+    gc = GroupCreator(create_parser().get_args(args_str.split()))
+    with contextlib.redirect_stdout(io.StringIO()):
+        gc.run()
+    with open(out_location) as f:
+        return gc, json.load(f)
+
+def get_subtype_patient_group(groups):
+    subtype_patient_group = {}
+    for chunk in groups['chunks']:
+        for patch_path in chunk['imgs']:
+            subtype, slide = patch_path.split('/')[-5:-3]
+            subtype_patient_group.setdefault((subtype.upper(), slide), set()).add(chunk['id'])
+    return subtype_patient_group
+
+def move_new_patients(patch_location, tmp_path):
+    """Move patient VOA-300 of every subtype out of patch_location and return the directories to move them back to"""
+    new_patient_directories = []
+    for annotation in os.listdir(patch_location):
+        for subtype in os.listdir(os.path.join(patch_location, annotation)):
+            new_patient_directories.append(os.path.join(patch_location, annotation, subtype, 'VOA-300'))
+            shutil.move(new_patient_directories[-1], str(tmp_path / f"{annotation}_{subtype}"))
+    return new_patient_directories
+
+def restore_new_patients(new_patient_directories, tmp_path):
+    for directory in new_patient_directories:
+        annotation, subtype = directory.split('/')[-3:-1]
+        shutil.move(str(tmp_path / f"{annotation}_{subtype}"), directory)
+
+@pytest.mark.parametrize('shuffle', ['--legacy_shuffle', ''])
+def test_update_from_keeps_patient_groups(tmp_path, shuffle):
+    patch_location = str(tmp_path / 'patches')
+    shutil.copytree(MOCK_PATCH_DIR, patch_location)
+    new_patient_directories = move_new_patients(patch_location, tmp_path)
+    existing_location = str(tmp_path / 'existing_groups.json')
+    _, existing_groups = run_group_creator(patch_location, existing_location, shuffle=shuffle,
+            options='--write_options')
+
+    restore_new_patients(new_patient_directories, tmp_path)
+    gc, groups = run_group_creator(patch_location, str(tmp_path / 'groups.json'),
+            update_from=existing_location, shuffle=shuffle)
+
+    existing_patient_group = get_subtype_patient_group(existing_groups)
+    patient_group = get_subtype_patient_group(groups)
+    assert len(patient_group) > len(existing_patient_group)
+    for key, group_ids in existing_patient_group.items():
+        assert patient_group[key] == group_ids
+    # every group takes one new patient of a subtype, so only groups without new patients are kept
+    new_group_ids = {group_id for key, group_ids in patient_group.items() \
+            if key not in existing_patient_group for group_id in group_ids}
+    assert gc.kept_group_ids == ['group_' + str(chunk['id'] + 1) \
+            for chunk in existing_groups['chunks'] if chunk['id'] not in new_group_ids]
+    for existing_chunk, chunk in zip(existing_groups['chunks'], groups['chunks']):
+        if 'group_' + str(chunk['id'] + 1) in gc.kept_group_ids:
+            assert chunk['imgs'] == existing_chunk['imgs']
+
+@pytest.mark.parametrize('shuffle', ['--legacy_shuffle', ''])
+def test_update_from_unchanged_cohort_keeps_every_group(tmp_path, shuffle):
+    existing_location = str(tmp_path / 'existing_groups.json')
+    _, existing_groups = run_group_creator(MOCK_PATCH_DIR, existing_location, shuffle=shuffle,
+            options='--write_options')
+    with open(str(tmp_path / 'existing_groups.options.json')) as f:
+        assert json.load(f)['legacy_shuffle'] == bool(shuffle)
+    gc, groups = run_group_creator(MOCK_PATCH_DIR, str(tmp_path / 'groups.json'),
+            update_from=existing_location, shuffle=shuffle)
+    assert gc.kept_group_ids == ['group_1', 'group_2', 'group_3']
+    assert groups == existing_groups
+
+@pytest.mark.parametrize('shuffle,options', [
+    ('', ''),
+    ('--legacy_shuffle', '--seed 7'),
+    ('--legacy_shuffle', '--max_patient_patches 20'),
+    ('--legacy_shuffle', '--balance_patches overall'),
+])
+def test_update_from_changed_options_keeps_no_group(tmp_path, shuffle, options):
+    existing_location = str(tmp_path / 'existing_groups.json')
+    _, existing_groups = run_group_creator(MOCK_PATCH_DIR, existing_location, options='--write_options')
+    gc, groups = run_group_creator(MOCK_PATCH_DIR, str(tmp_path / 'groups.json'),
+            update_from=existing_location, shuffle=shuffle, options=options)
+    assert gc.kept_group_ids == []
+    assert get_subtype_patient_group(groups) == get_subtype_patient_group(existing_groups)
+
+def test_update_from_without_options_file_keeps_no_group(tmp_path):
+    existing_location = str(tmp_path / 'existing_groups.json')
+    run_group_creator(MOCK_PATCH_DIR, existing_location)
+    # the options file is only written with --write_options or --update_from
+    assert os.listdir(str(tmp_path)) == ['existing_groups.json']
+    gc, _ = run_group_creator(MOCK_PATCH_DIR, str(tmp_path / 'groups.json'),
+            update_from=existing_location)
+    assert gc.kept_group_ids == []
+    assert sorted(os.listdir(str(tmp_path))) == ['existing_groups.json', 'groups.json',
+            'groups.options.json']
+
+def test_update_from_new_patches_in_slide_recomputes_group(tmp_path):
+    patch_location = str(tmp_path / 'patches')
+    shutil.copytree(MOCK_PATCH_DIR, patch_location)
+    existing_location = str(tmp_path / 'existing_groups.json')
+    _, existing_groups = run_group_creator(patch_location, existing_location, options='--write_options')
+    patch_path = existing_groups['chunks'][0]['imgs'][0].replace(MOCK_PATCH_DIR, patch_location, 1)
+    new_patch_path = os.path.join(os.path.dirname(patch_path), '99999_99999.png')
+    shutil.copyfile(patch_path, new_patch_path)
+    gc, groups = run_group_creator(patch_location, str(tmp_path / 'groups.json'),
+            update_from=existing_location)
+    assert gc.kept_group_ids == ['group_2', 'group_3']
+    assert new_patch_path in groups['chunks'][0]['imgs']
+
+def test_update_from_balance_patches_rebalances_kept_groups(tmp_path):
+    patch_location = str(tmp_path / 'patches')
+    shutil.copytree(MOCK_PATCH_DIR, patch_location)
+    new_patient_directories = move_new_patients(patch_location, tmp_path)
+    existing_location = str(tmp_path / 'existing_groups.json')
+    _, existing_groups = run_group_creator(patch_location, existing_location,
+            options='--write_options --balance_patches overall')
+
+    restore_new_patients(new_patient_directories, tmp_path)
+    gc, groups = run_group_creator(patch_location, str(tmp_path / 'groups.json'),
+            update_from=existing_location, options='--balance_patches overall')
+    # overall balancing takes the same number of patches from every group and category
+    cell_counts = collections.Counter((chunk['id'], patch_path.split('/')[-5]) \
+            for chunk in groups['chunks'] for patch_path in chunk['imgs'])
+    assert len(set(cell_counts.values())) == 1
+    existing_cell_counts = collections.Counter((chunk['id'], patch_path.split('/')[-5]) \
+            for chunk in existing_groups['chunks'] for patch_path in chunk['imgs'])
+    # the new patients change the smallest cell, so every group has new take counts and is recomputed
+    assert set(cell_counts.values()) != set(existing_cell_counts.values())
+    assert gc.kept_group_ids == []
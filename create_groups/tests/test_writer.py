@@ -0,0 +1,78 @@
+import pytest
+import os
+import json
+
+from create_groups.table import PatchTable
+from create_groups.writer import (iter_encode, write_json)
+
+def generate_groups():
+    patch_paths = [f"/patches/Tumor/MMRD/VOA-{i % 7}00A/{i}_{i * 2}.png" for i in range(50)]
+    patch_paths += ['/patches/Tumor/MMRD/VOA-100A/été "quoted"\\.png']
+    return {
+        'chunks': [
+            {'id': 0, 'imgs': patch_paths[:20]},
+            {'id': 1, 'imgs': []},
+            {'id': 2, 'imgs': patch_paths[20:]},
+        ]
+    }
+
+@pytest.mark.parametrize('batch_size', [1, 3, 20, 4096])
+def test_iter_encode_is_same_as_json_dumps(batch_size):
+    groups = generate_groups()
+    assert ''.join(iter_encode(groups, batch_size=batch_size)) == json.dumps(groups)
+    obj = {1: [None, True, 1.5, {'a': []}], 'b': (1, 'x'), 'c': {}}
+    assert ''.join(iter_encode(obj, batch_size=batch_size)) == json.dumps(obj)
+
+def test_write_json_patch_paths_view(tmp_path):
+    groups = generate_groups()
+    patch_paths = [p for chunk in groups['chunks'] for p in chunk['imgs']]
+    patch_table = PatchTable.from_paths(patch_paths)
+    view_groups = {'chunks': [
+        {'id': 0, 'imgs': patch_table.view(range(20))},
+        {'id': 1, 'imgs': patch_table.view([])},
+        {'id': 2, 'imgs': patch_table.view(range(20, len(patch_paths)))},
+    ]}
+    out_location = str(tmp_path / 'patient_groups.json')
+    write_json(out_location, view_groups, batch_size=7)
+    with open(out_location) as f:
+        assert f.read() == json.dumps(groups)
+    assert os.listdir(str(tmp_path)) == ['patient_groups.json']
+
+def test_write_json_keeps_previous_file_on_error(tmp_path):
+    out_location = str(tmp_path / 'patient_groups.json')
+    write_json(out_location, generate_groups())
+    with pytest.raises(TypeError):
+        write_json(out_location, {'chunks': [{'id': 0, 'imgs': [object()]}]})
+    with open(out_location) as f:
+        assert json.load(f) == generate_groups()
+    assert os.listdir(str(tmp_path)) == ['patient_groups.json']
+
+@pytest.mark.parametrize('out_format', ['hdf5', 'npz'])
+def test_write_binary_loads_as_mitch_format(tmp_path, out_format):
+    from create_groups.writer import write_binary
+    from create_groups.reader import (load_groups, get_out_format)
+    groups = generate_groups()
+    groups['chunks'][2]['id'] = 5
+    out_location = str(tmp_path / 'patient_groups.bin')
+    write_binary(out_location, groups, out_format, batch_size=7)
+    assert get_out_format(out_location) == out_format
+    assert load_groups(out_location) == groups
+    assert os.listdir(str(tmp_path)) == ['patient_groups.bin']
+
+def test_write_binary_empty_groups(tmp_path):
+    from create_groups.writer import write_binary
+    from create_groups.reader import load_groups
+    groups = {'chunks': [{'id': 0, 'imgs': []}]}
+    out_location = str(tmp_path / 'patient_groups.npz')
+    write_binary(out_location, groups, 'npz')
+    assert load_groups(out_location) == groups
+
+def test_create_path_table_encodes_file_names():
+    from create_groups.writer import create_path_table
+    arrays = create_path_table(generate_groups(), batch_size=7)
+    assert arrays['chunk_bounds'].tolist() == [[0, 20], [20, 20], [20, 51]]
+    assert arrays['path_x'][:3].tolist() == [0, 1, 2]
+    assert arrays['path_y'][:3].tolist() == [0, 2, 4]
+    # only the file name that is not of the form x_y.png is stored as a string
+    assert bytes(arrays['names']).decode('utf-8') == 'été "quoted"\\.png'
+    assert arrays['path_name'].tolist() == [-1] * 50 + [0]
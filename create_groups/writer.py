@@ -0,0 +1,195 @@
+"""Writing of groups files
+"""
+import os
+import json
+import contextlib
+import collections.abc
+
+import numpy as np
+
+from create_groups.hd5 import open_h5
+from create_groups.table import PatchTableBuilder
+
+default_write_batch_size = 4096
+groups_file_version = 2
+
+def encode_key(key):
+    """Encode a dict key the way json.dumps does, converting keys that are not str"""
+    if isinstance(key, str):
+        return json.dumps(key)
+    return json.dumps(json.dumps(key))
+
+def iter_encode(obj, batch_size=default_write_batch_size):
+    """Encode obj to JSON like json.dumps(obj), yielding the JSON in parts.
+
+    Lists are encoded one batch of batch_size items at a time so that lists of patch paths,
+    including lazy sequences like PatchPaths, are never encoded or copied whole.
+
+    Parameters
+    ----------
+    obj : object
+        A JSON serializable object, where lists can be any sequence
+
+    batch_size : int
+        The number of items of a list to encode at a time
+
+    Yields
+    ------
+    str
+        Consecutive parts of the JSON
+    """
+    if isinstance(obj, dict):
+        yield '{'
+        for idx, (key, value) in enumerate(obj.items()):
+            yield (', ' if idx > 0 else '') + encode_key(key) + ': '
+            yield from iter_encode(value, batch_size=batch_size)
+        yield '}'
+    elif isinstance(obj, collections.abc.Sequence) and not isinstance(obj, (str, bytes)):
+        yield '['
+        for start in range(0, len(obj), batch_size):
+            batch = list(obj[start:start + batch_size])
+            if start > 0:
+                yield ', '
+            if all(isinstance(item, str) for item in batch):
+                yield json.dumps(batch)[1:-1]
+            else:
+                for idx, item in enumerate(batch):
+                    if idx > 0:
+                        yield ', '
+                    yield from iter_encode(item, batch_size=batch_size)
+        yield ']'
+    else:
+        yield json.dumps(obj)
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Write a file to path atomically.
+
+    Yields the path of a temporary file next to path, which is renamed to path when the with block
+    ends, so path is either the previous file or the complete new file. The temporary file is
+    removed if the with block raises. Files opened on the temporary path must be closed in the block.
+
+    Yields
+    ------
+    str
+        The path of the temporary file to write
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_json(path, obj, batch_size=default_write_batch_size):
+    """Write obj to path as the same JSON as json.dump(obj, f), streaming lists in batches.
+
+    The JSON is written atomically with atomic_path().
+    """
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            for part in iter_encode(obj, batch_size=batch_size):
+                f.write(part)
+
+def get_index_dtype(size):
+    """Get the smallest of int32 and int64 that can index size items"""
+    return np.int32 if size < 2**31 else np.int64
+
+def encode_strings(strings):
+    """Concatenate strings to one UTF-8 byte array.
+
+    Returns
+    -------
+    numpy.ndarray
+        The bytes of the strings as uint8
+
+    numpy.ndarray
+        The offsets of the strings in the bytes, where string i is bytes[offsets[i]:offsets[i + 1]]
+    """
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)),
+            out=offsets[1:])
+    offsets = offsets.astype(get_index_dtype(offsets[-1] + 1))
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+def create_path_table(groups, batch_size=default_write_batch_size):
+    """Create the arrays of a binary groups file from groups in Mitch format.
+
+    The patch paths are appended to the columns of a PatchTable. The directories are stored once
+    in a table of unique directories, and a file name x_y.png is stored as the coordinates x and y
+    and the index of its extension. Other file names are stored once in a table of unique names.
+    The patches of each chunk are consecutive rows, so each chunk is stored as the bounds
+    [start, end) of its rows in chunk_bounds.
+
+    Parameters
+    ----------
+    groups : dict
+        Groups in Mitch format, where imgs can be any sequence of patch paths
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        The arrays of the groups file
+    """
+    builder = PatchTableBuilder()
+    chunk_ids = []
+    chunk_bounds = []
+    for chunk in groups['chunks']:
+        imgs = chunk['imgs']
+        start = len(builder.directory)
+        for batch_start in range(0, len(imgs), batch_size):
+            for patch_path in imgs[batch_start:batch_start + batch_size]:
+                idx = patch_path.rfind('/') + 1
+                builder.append(builder.intern_directory(patch_path[:idx]), patch_path[idx:])
+        chunk_ids.append(chunk['id'])
+        chunk_bounds.append((start, len(builder.directory)))
+    patch_table = builder.build()
+    arrays = {}
+    arrays['version'] = np.array(groups_file_version, dtype=np.int64)
+    arrays['chunk_ids'] = np.array(chunk_ids, dtype=np.int64)
+    arrays['chunk_bounds'] = np.array(chunk_bounds, dtype=np.int64).reshape(-1, 2)
+    arrays['directories'], arrays['directory_offsets'] = encode_strings(patch_table.directories)
+    arrays['extensions'], arrays['extension_offsets'] = encode_strings(patch_table.extensions)
+    arrays['names'], arrays['name_offsets'] = encode_strings(patch_table.names)
+    arrays['path_directory'] = patch_table.directory
+    arrays['path_x'] = patch_table.x
+    arrays['path_y'] = patch_table.y
+    arrays['path_extension'] = patch_table.extension
+    arrays['path_name'] = patch_table.name
+    return arrays
+
+def write_binary(path, groups, out_format, batch_size=default_write_batch_size):
+    """Write groups in Mitch format to path as a binary groups file.
+
+    The file is written atomically with atomic_path().
+
+    Parameters
+    ----------
+    path : str
+        Path of the groups file
+
+    groups : dict
+        Groups in Mitch format
+
+    out_format : str
+        One of 'hdf5' or 'npz'. NPZ files are not compressed so that they can be memory mapped
+    """
+    arrays = create_path_table(groups, batch_size=batch_size)
+    with atomic_path(path) as tmp_path:
+        if out_format == 'hdf5':
+            with open_h5(tmp_path, 'w') as f:
+                for key, array in arrays.items():
+                    f.create_dataset(key, data=array)
+        elif out_format == 'npz':
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+        else:
+            raise NotImplementedError(f"Out format {out_format} is not implemented.")
+
+def get_options_location(out_location):
+    """Get the path of the file of the options a groups file was generated with, i.e.
+    /path/to/patient_groups.options.json for /path/to/patient_groups.json"""
+    return f"{os.path.splitext(out_location)[0]}.options.json"
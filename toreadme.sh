@@ -38,6 +38,17 @@ echo >> README.md
 python app.py from-arguments use-hd5 use-origin -h >> README.md
 echo >> README.md
 echo """\`\`\`
+### Updating groups ###
+
+\`--write_options\` writes the options that the groups depend on next to the groups file, i.e. \`/path/to/patient_groups.options.json\` for \`/path/to/patient_groups.json\`. No options file is written by default.
+
+\`--update_from /path/to/patient_groups.json\` regroups a cohort with new patients or slides. Patients in the existing file keep their group. A group is copied unchanged from the existing file only if:
+
+- its options file has the same options as this run;
+- the recomputed group has the same number of patches in every directory after \`--balance_patches\`.
+
+All other groups are written as recomputed. Every group is still computed from the whole cohort, so an update takes as long as a new run. Only the write step uses the existing file. A run with \`--update_from\` always writes the options file of its output, so the output can be updated again.
+
 TODO: there is a chance --balance_patches sets empty groups. This happens if any patches for some (group, category) is zero.
 TODO: in create_groups, variables are named 'subtype' instead of 'category'. That leads to confusion.
 TODO: further explain how --max_patient_patches works in description.